@@ -0,0 +1,226 @@
+# app/cli.py
+#
+# Operational command line entry point:
+#
+#     python -m app.cli migrate status
+#     python -m app.cli migrate apply [--target N] [--batch-size N] [--force-unlock]
+#     python -m app.cli migrate verify
+#     python -m app.cli fortunes archive [--older-than-months N | --before YYYY-MM] [--grace-seconds S]
+#     python -m app.cli export users|fortunes [--format ndjson|csv] [--gzip] [--since ISO] [--output FILE]
+#     python -m app.cli achievements recompute|rebuild-luck [--batch-size N]
+#     python -m app.cli users import FILE [--format csv|ndjson] [--workers N] [--rounds N] [--report FILE]
+
+import argparse
+import asyncio
+import logging
+import sys
+
+
+def _setup_logging() -> None:
+    logger = logging.getLogger("api_logger")
+    logger.setLevel(logging.INFO)
+    handler = logging.StreamHandler(sys.stderr)
+    handler.setFormatter(logging.Formatter('%(asctime)s - %(levelname)s - %(message)s'))
+    logger.addHandler(handler)
+
+
+# --- migrate ---
+
+async def _migrate(args: argparse.Namespace) -> int:
+    from .db import get_database
+    from .core.migrations import (
+        SCHEMA_VERSION, MigrationError, apply_migrations, get_migration_status, verify_schema_version
+    )
+    db = get_database()
+
+    if args.action == "status":
+        for item in await get_migration_status(db):
+            applied_at = item["applied_at"].isoformat() if item["applied_at"] else "-"
+            print(f"{item['version']:>4}  {item['status']:<8}  {applied_at:<32}  {item['name']}")
+        print(f"Code schema version: {SCHEMA_VERSION}")
+        return 0
+
+    if args.action == "verify":
+        return 0 if await verify_schema_version(db) else 1
+
+    try:
+        applied = await apply_migrations(
+            db,
+            target=args.target,
+            batch_size=args.batch_size,
+            force_unlock=args.force_unlock
+        )
+    except MigrationError as e:
+        print(f"error: {e}", file=sys.stderr)
+        return 1
+    print(f"Applied migrations: {applied or 'none (already up to date)'}")
+    return 0
+
+
+# --- fortunes ---
+
+async def _fortunes(args: argparse.Namespace) -> int:
+    from .db import get_database
+    from .services.fortune_history import archive_fortunes, latest_archivable_month, shift_month
+    db = get_database()
+
+    before = args.before or shift_month(latest_archivable_month(), 1 - args.older_than_months)
+    try:
+        stats = await archive_fortunes(db, before, batch_size=args.batch_size, grace_seconds=args.grace_seconds)
+    except ValueError as e:
+        print(f"error: {e}", file=sys.stderr)
+        return 1
+    print(
+        f"Archived fortunes before {stats['cutoff']}: {stats['archived']} fortunes in {stats['buckets']} buckets "
+        f"({stats['users']} users), {stats['deleted']} hot documents removed."
+    )
+    return 0
+
+
+# --- export ---
+
+async def _export(args: argparse.Namespace) -> int:
+    from datetime import datetime, timezone
+    from .db import get_database
+    from .services.export import export_stream, export_until
+    db = get_database()
+
+    since = None
+    if args.since:
+        since = datetime.fromisoformat(args.since)
+        if since.tzinfo is None:
+            since = since.replace(tzinfo=timezone.utc)
+    until = export_until()
+
+    output = sys.stdout.buffer if args.output == "-" else open(args.output, "wb")
+    written = 0
+    try:
+        async for chunk in export_stream(
+            db, args.collection, args.format, since=since, until=until, compress=args.gzip, batch_size=args.batch_size
+        ):
+            output.write(chunk)
+            written += len(chunk)
+    finally:
+        if output is not sys.stdout.buffer:
+            output.close()
+    print(f"Exported {args.collection}: {written} bytes. Next --since: {until.isoformat()}", file=sys.stderr)
+    return 0
+
+
+# --- achievements ---
+
+async def _achievements(args: argparse.Namespace) -> int:
+    from .db import get_database
+    from .services.achievements import recompute_achievements
+    from .services.luck import rebuild_luck_histogram
+    db = get_database()
+
+    logger = logging.getLogger("api_logger")
+
+    async def progress(last_id, processed: int) -> None:
+        logger.info(f"Achievements: {processed} users recomputed.")
+
+    if args.action == "recompute":
+        processed = await recompute_achievements(db, batch_size=args.batch_size, on_batch=progress)
+        print(f"Recomputed streaks, luckiest months and luck scores for {processed} users.")
+    histogram = await rebuild_luck_histogram(db)
+    print(f"Rebuilt the luck histogram: {histogram['users']} users over {histogram['bin_count']} bins.")
+    return 0
+
+
+# --- users ---
+
+async def _users(args: argparse.Namespace) -> int:
+    import gzip
+    import json
+    from .db import get_database
+    from .services.user_import import import_users, read_rows
+    db = get_database()
+
+    format = args.format or ("csv" if args.file.removesuffix(".gz").endswith(".csv") else "ndjson")
+    if args.file == "-":
+        source = sys.stdin
+    elif args.file.endswith(".gz"):
+        source = gzip.open(args.file, "rt", encoding="utf-8-sig", newline="")
+    else:
+        source = open(args.file, encoding="utf-8-sig", newline="")
+
+    logger = logging.getLogger("api_logger")
+
+    async def progress(report: dict) -> None:
+        logger.info(f"Import: {report['rows']} rows read, {report['imported']} users imported.")
+
+    try:
+        report = await import_users(
+            db, read_rows(source, format),
+            batch_size=args.batch_size, workers=args.workers, rounds=args.rounds, on_batch=progress
+        )
+    finally:
+        if source is not sys.stdin:
+            source.close()
+    if args.report:
+        with open(args.report, "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+    print(
+        f"Imported {report['imported']} of {report['rows']} users: "
+        f"{len(report['invalid'])} invalid rows, {len(report['conflicts'])} conflicts."
+    )
+    return 0
+
+
+def build_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(prog="python -m app.cli", description="DailyFortune API operations.")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    migrate = subparsers.add_parser("migrate", help="Apply or verify database schema migrations.")
+    migrate.add_argument("action", choices=["status", "apply", "verify"])
+    migrate.add_argument("--target", type=int, default=None, help="Stop after this migration version.")
+    migrate.add_argument("--batch-size", type=int, default=1000, help="Documents per backfill batch.")
+    migrate.add_argument("--force-unlock", action="store_true", help="Clear a lock left by a crashed run.")
+    migrate.set_defaults(handler=_migrate)
+
+    fortunes = subparsers.add_parser("fortunes", help="Fortune storage maintenance.")
+    fortunes.add_argument("action", choices=["archive"])
+    fortunes.add_argument("--older-than-months", type=int, default=12,
+                          help="Archive months that ended more than N months ago (N >= 1).")
+    fortunes.add_argument("--before", default=None, help="Archive months before this one (YYYY-MM).")
+    fortunes.add_argument("--batch-size", type=int, default=500, help="Users per batch.")
+    fortunes.add_argument("--grace-seconds", type=float, default=None,
+                          help="Wait between switching reads to the archive and deleting (default: cutoff cache TTL + 5s).")
+    fortunes.set_defaults(handler=_fortunes)
+
+    export = subparsers.add_parser("export", help="Stream users or fortunes for analytics.")
+    export.add_argument("collection", choices=["users", "fortunes"])
+    export.add_argument("--format", choices=["ndjson", "csv"], default="ndjson")
+    export.add_argument("--gzip", action="store_true", help="Gzip the output.")
+    export.add_argument("--since", default=None, help="Watermark (ISO 8601) printed by the previous run.")
+    export.add_argument("--batch-size", type=int, default=1000, help="Cursor batch size.")
+    export.add_argument("--output", default="-", help="Output file ('-' for stdout).")
+    export.set_defaults(handler=_export)
+
+    achievements = subparsers.add_parser("achievements", help="Streak, luckiest-month and luck-score maintenance.")
+    achievements.add_argument("action", choices=["recompute", "rebuild-luck"])
+    achievements.add_argument("--batch-size", type=int, default=500, help="Users per batch.")
+    achievements.set_defaults(handler=_achievements)
+
+    users = subparsers.add_parser("users", help="Account administration.")
+    users.add_argument("action", choices=["import"])
+    users.add_argument("file", help="CSV (username,email,password header) or NDJSON, optionally .gz; '-' for stdin.")
+    users.add_argument("--format", choices=["csv", "ndjson"], default=None, help="Default: from the file extension.")
+    users.add_argument("--batch-size", type=int, default=None, help="Users per insert (default: USER_IMPORT_BATCH_SIZE).")
+    users.add_argument("--workers", type=int, default=None, help="Hashing processes (default: one per CPU).")
+    users.add_argument("--rounds", type=int, default=None, help="bcrypt cost (default: USER_IMPORT_BCRYPT_ROUNDS).")
+    users.add_argument("--report", default=None, help="Write the per-row report as JSON to this file.")
+    users.set_defaults(handler=_users)
+
+    return parser
+
+
+def main(argv=None) -> int:
+    args = build_parser().parse_args(argv)
+    _setup_logging()
+    return asyncio.run(args.handler(args))
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,186 @@
+# app/core/admission.py
+#
+# Overload protection for the whole API (AdmissionMiddleware in
+# app/core/middleware.py). Requests run under an adaptive concurrency limit:
+# the limit grows by one per window while latency stays under
+# ADMISSION_LATENCY_TARGET_MS and is cut multiplicatively when it does not
+# (AIMD). Requests over the limit wait in a bounded priority queue; when the
+# queue is full or a wait times out the request is shed with a 503 instead of
+# piling up on the event loop behind a slow database.
+
+import asyncio
+import logging
+import time
+from collections import Counter, deque
+from functools import lru_cache
+from typing import Deque, List, Optional, Tuple
+
+from .config import settings
+
+logger = logging.getLogger("api_logger")
+
+CRITICAL, NORMAL, LOW = 0, 1, 2
+PRIORITY_NAMES = ("critical", "normal", "low")
+
+# Token subjects RequestContextMiddleware records for requests without a usable token.
+UNAUTHENTICATED_USERS = ("anonymous", "invalid_token", "unknown")
+
+SHED_LOG_INTERVAL_SECONDS = 10.0
+
+
+@lru_cache(maxsize=None)
+def _exempt_paths() -> Tuple[frozenset, Tuple[str, ...]]:
+    entries = [p.strip() for p in settings.ADMISSION_EXEMPT_PATHS.split(",") if p.strip()]
+    exact = frozenset(p for p in entries if not p.endswith("*"))
+    prefixes = tuple(p[:-1] for p in entries if p.endswith("*"))
+    return exact, prefixes
+
+
+def is_exempt(path: str) -> bool:
+    """Long-lived streams hold no slot: ADMISSION_EXEMPT_PATHS entries, `*` suffix for prefixes."""
+    exact, prefixes = _exempt_paths()
+    return path in exact or path.startswith(prefixes)
+
+
+def classify(method: str, path: str, user_id: str, role: Optional[str] = None) -> int:
+    """
+    Priority class of a request. Health checks, preflights and admin calls (by the
+    access token's `role` claim) come first, then authenticated traffic (draws,
+    /users/me, token refresh), then anonymous traffic, public profile reads and
+    /admin calls by anyone else.
+    """
+    if method == "OPTIONS" or path == "/":
+        return CRITICAL
+    authenticated = user_id not in UNAUTHENTICATED_USERS
+    if path.startswith("/admin/"):
+        return CRITICAL if authenticated and role == "admin" else LOW
+    if path.startswith("/users/u/"):
+        return LOW
+    if path == "/auth/refresh":
+        return NORMAL
+    return NORMAL if authenticated else LOW
+
+
+class AdmissionController:
+    """
+    Adaptive concurrency limiter with a bounded, priority-ordered wait queue.
+    A freed slot goes to the oldest waiter of the most important class; when the
+    queue is full an arrival evicts the newest waiter of a less important class,
+    or is shed itself. CRITICAL requests may exceed the limit by
+    ADMISSION_CRITICAL_HEADROOM so health checks keep answering under load.
+    """
+
+    def __init__(self):
+        self.limit: Optional[float] = None
+        self.in_flight = 0
+        self._waiters: List[Deque[asyncio.Future]] = [deque() for _ in PRIORITY_NAMES]
+        self._last_decrease = 0.0
+        self.admitted: Counter = Counter()
+        self.shed: Counter = Counter()
+        self._unlogged_sheds = 0
+        self._last_shed_log = 0.0
+
+    @property
+    def queued(self) -> int:
+        return sum(len(waiters) for waiters in self._waiters)
+
+    def _capacity(self, priority: int) -> float:
+        if self.limit is None:
+            self.limit = float(settings.ADMISSION_INITIAL_LIMIT)
+        headroom = settings.ADMISSION_CRITICAL_HEADROOM if priority == CRITICAL else 0
+        return self.limit + headroom
+
+    async def acquire(self, priority: int) -> Optional[str]:
+        """Waits for a slot. Returns None once admitted, or the reason the request was shed."""
+        if self.in_flight < self._capacity(priority) and not any(self._waiters[: priority + 1]):
+            self.in_flight += 1
+            self.admitted[PRIORITY_NAMES[priority]] += 1
+            return None
+
+        if self.queued >= settings.ADMISSION_QUEUE_SIZE and not self._evict_below(priority):
+            return self._record_shed(priority, "queue_full")
+
+        future = asyncio.get_running_loop().create_future()
+        waiters = self._waiters[priority]
+        waiters.append(future)
+        try:
+            admitted = await asyncio.wait_for(future, settings.ADMISSION_QUEUE_TIMEOUT_MS / 1000)
+        except asyncio.TimeoutError:
+            return self._record_shed(priority, "timeout")
+        except asyncio.CancelledError:
+            # The client went away; hand a slot granted in the meantime back.
+            if future.done() and not future.cancelled() and future.result():
+                self.release(None)
+            raise
+        finally:
+            if future in waiters:
+                waiters.remove(future)
+        if not admitted:
+            return self._record_shed(priority, "evicted")
+        self.admitted[PRIORITY_NAMES[priority]] += 1
+        return None
+
+    def release(self, latency: Optional[float]) -> None:
+        """Frees a slot; `latency` (seconds from admission) feeds the limit, None skips the sample."""
+        self.in_flight -= 1
+        if latency is not None:
+            self._adjust(latency)
+        self._wake()
+
+    def _adjust(self, latency: float) -> None:
+        target = settings.ADMISSION_LATENCY_TARGET_MS / 1000
+        if latency > target:
+            # Requests admitted before the cut finish slow too; one decrease per target interval.
+            now = time.monotonic()
+            if now - self._last_decrease >= target:
+                self._last_decrease = now
+                self.limit = max(settings.ADMISSION_MIN_LIMIT, self.limit * settings.ADMISSION_BACKOFF)
+        elif self.in_flight + 1 >= self.limit / 2:
+            # Only grow a limit that is actually in use.
+            self.limit = min(settings.ADMISSION_MAX_LIMIT, self.limit + 1 / self.limit)
+
+    def _wake(self) -> None:
+        for priority, waiters in enumerate(self._waiters):
+            while waiters and self.in_flight < self._capacity(priority):
+                future = waiters.popleft()
+                if not future.done():
+                    self.in_flight += 1
+                    future.set_result(True)
+            if waiters:
+                return
+
+    def _evict_below(self, priority: int) -> bool:
+        for lower in range(len(self._waiters) - 1, priority, -1):
+            waiters = self._waiters[lower]
+            while waiters:
+                future = waiters.pop()
+                if not future.done():
+                    future.set_result(False)
+                    return True
+        return False
+
+    def _record_shed(self, priority: int, reason: str) -> str:
+        self.shed[(PRIORITY_NAMES[priority], reason)] += 1
+        self._unlogged_sheds += 1
+        now = time.monotonic()
+        if now - self._last_shed_log >= SHED_LOG_INTERVAL_SECONDS:
+            self._last_shed_log = now
+            logger.warning(
+                f"Load shedding: shed={self._unlogged_sheds} since last report, "
+                f"limit={self.limit:.1f} in_flight={self.in_flight} queued={self.queued} "
+                f"totals={self.stats()['shed']}"
+            )
+            self._unlogged_sheds = 0
+        return reason
+
+    def stats(self) -> dict:
+        return {
+            "limit": round(self.limit, 1) if self.limit is not None else settings.ADMISSION_INITIAL_LIMIT,
+            "in_flight": self.in_flight,
+            "queued": {name: len(self._waiters[p]) for p, name in enumerate(PRIORITY_NAMES)},
+            "admitted": dict(self.admitted),
+            "shed": {f"{name}/{reason}": count for (name, reason), count in self.shed.items()},
+        }
+
+
+admission_controller = AdmissionController()
@@ -0,0 +1,162 @@
+# app/core/compression.py
+#
+# Response compression: codec registry and Accept-Encoding negotiation shared by
+# CompressionMiddleware (app/core/middleware.py) and the precompressed ResponseCache
+# below. gzip is always available; brotli ("br") and zstd are offered when the
+# `brotli` / `zstandard` packages are installed.
+
+import gzip
+import time
+from collections import OrderedDict
+from functools import lru_cache
+from typing import Callable, Dict, Hashable, Optional
+
+from starlette.requests import Request
+from starlette.responses import Response
+
+from .config import settings
+
+
+def _gzip_codec() -> Callable[[bytes], bytes]:
+    level = settings.COMPRESSION_GZIP_LEVEL
+    return lambda body: gzip.compress(body, compresslevel=level, mtime=0)
+
+
+def _brotli_codec() -> Optional[Callable[[bytes], bytes]]:
+    try:
+        import brotli
+    except ImportError:
+        return None
+    quality = settings.COMPRESSION_BROTLI_QUALITY
+    return lambda body: brotli.compress(body, quality=quality)
+
+
+def _zstd_codec() -> Optional[Callable[[bytes], bytes]]:
+    try:
+        import zstandard
+    except ImportError:
+        return None
+    compressor = zstandard.ZstdCompressor(level=settings.COMPRESSION_ZSTD_LEVEL)
+    return compressor.compress
+
+
+@lru_cache(maxsize=None)
+def get_codecs() -> Dict[str, Callable[[bytes], bytes]]:
+    """Available encodings in server preference order (best ratio per CPU first)."""
+    codecs = {}
+    for name, factory in (("zstd", _zstd_codec), ("br", _brotli_codec), ("gzip", _gzip_codec)):
+        if name in settings.COMPRESSION_ENCODINGS.split(","):
+            codec = factory()
+            if codec is not None:
+                codecs[name] = codec
+    return codecs
+
+
+@lru_cache(maxsize=256)
+def negotiate_encoding(accept_encoding: str) -> Optional[str]:
+    """Picks the preferred available encoding the client accepts (q > 0), if any."""
+    accepted = {}
+    for part in accept_encoding.lower().split(","):
+        name, _, params = part.strip().partition(";")
+        q = 1.0
+        params = params.strip()
+        if params.startswith("q="):
+            try:
+                q = float(params[2:])
+            except ValueError:
+                q = 0.0
+        accepted[name.strip()] = q
+    wildcard = accepted.get("*", 0.0)
+    for name in get_codecs():
+        if accepted.get(name, wildcard) > 0:
+            return name
+    return None
+
+
+@lru_cache(maxsize=None)
+def _compressible_types() -> frozenset:
+    return frozenset(t.strip() for t in settings.COMPRESSION_CONTENT_TYPES.split(",") if t.strip())
+
+
+def is_compressible(content_type: str) -> bool:
+    return content_type.split(";", 1)[0].strip().lower() in _compressible_types()
+
+
+def compress(body: bytes, encoding: str) -> bytes:
+    return get_codecs()[encoding](body)
+
+
+class CachedBody:
+    """A cached response body plus its encoded variants, each compressed once on first use."""
+
+    __slots__ = ("body", "media_type", "stored_at", "expires_at", "_encoded")
+
+    def __init__(self, body: bytes, media_type: str, expires_at: float):
+        self.body = body
+        self.media_type = media_type
+        self.stored_at = time.monotonic()
+        self.expires_at = expires_at
+        self._encoded: Dict[str, bytes] = {}
+
+    @property
+    def age(self) -> float:
+        return time.monotonic() - self.stored_at
+
+    def encoded(self, encoding: str) -> bytes:
+        data = self._encoded.get(encoding)
+        if data is None:
+            data = self._encoded[encoding] = compress(self.body, encoding)
+        return data
+
+    def to_response(self, request: Request, headers: Optional[dict] = None) -> Response:
+        """
+        Serves the variant the client accepts. The response already carries its
+        Content-Encoding, so CompressionMiddleware passes it through untouched.
+        """
+        response_headers = {"Vary": "Accept-Encoding", **(headers or {})}
+        encoding = None
+        if settings.COMPRESSION_ENABLED and len(self.body) >= settings.COMPRESSION_MIN_SIZE:
+            encoding = negotiate_encoding(request.headers.get("accept-encoding", ""))
+        if encoding is None:
+            return Response(self.body, media_type=self.media_type, headers=response_headers)
+        response_headers["Content-Encoding"] = encoding
+        return Response(self.encoded(encoding), media_type=self.media_type, headers=response_headers)
+
+
+class ResponseCache:
+    """Small in-process TTL + LRU cache of response bodies, stored with their compressed variants."""
+
+    def __init__(self, max_entries: int = 256):
+        self.max_entries = max_entries
+        self._entries: "OrderedDict[Hashable, CachedBody]" = OrderedDict()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def get(self, key: Hashable) -> Optional[CachedBody]:
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        if entry.expires_at <= time.monotonic():
+            del self._entries[key]
+            return None
+        self._entries.move_to_end(key)
+        return entry
+
+    def put(self, key: Hashable, body: bytes, media_type: str, ttl: float) -> CachedBody:
+        entry = CachedBody(body, media_type, time.monotonic() + ttl)
+        self._entries[key] = entry
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+        return entry
+
+    def evict(self, predicate: Callable[[Hashable], bool]) -> int:
+        """Drops the entries whose key matches `predicate`; returns how many."""
+        keys = [key for key in self._entries if predicate(key)]
+        for key in keys:
+            del self._entries[key]
+        return len(keys)
+
+    def clear(self) -> None:
+        self._entries.clear()
@@ -1,11 +1,16 @@
 # app/core/config.py
 
+from functools import lru_cache
 from pydantic_settings import BaseSettings
 from typing import List
 
 class Settings(BaseSettings):
     DATABASE_URL: str
     DATABASE_NAME: str
+    # How long an operation waits for a reachable server before failing (pymongo's default is 30 s).
+    DATABASE_SERVER_SELECTION_TIMEOUT_MS: int = 5000
+    # Refuse to start when the database schema is behind the code (see app/core/migrations.py).
+    SCHEMA_CHECK_STRICT: bool = False
     
     RATE_LIMITING_ENABLED: bool = False 
     REDIS_URL: str = "redis://localhost:6379"
@@ -14,6 +19,14 @@ class Settings(BaseSettings):
     ALGORITHM: str
     ACCESS_TOKEN_EXPIRE_MINUTES: int
     REFRESH_TOKEN_EXPIRE_DAYS: int = 7
+    # Refresh token rotation (see app/services/refresh_tokens.py): "redis" shares the
+    # revocation store between workers; "memory" only works with a single worker.
+    REFRESH_TOKEN_STORE_BACKEND: str = "redis"
+    # While Redis is down, trust unknown refresh tokens in an in-process store instead
+    # of answering 503. Keeps sessions alive, but revoked tokens work again meanwhile.
+    REFRESH_TOKEN_OUTAGE_FALLBACK: bool = False
+    # A spent token presented again within this window is a client race, not theft.
+    REFRESH_TOKEN_REUSE_GRACE_SECONDS: int = 10
 
     
     APP_TIMEZONE: str = "UTC" 
@@ -22,6 +35,145 @@ class Settings(BaseSettings):
     # --- NEW: Default timezone for new users ---
     USER_DEFAULT_TIMEZONE: str = "Asia/Shanghai"
 
+    # --- Draw admission (see app/services/draw_admission.py) ---
+    # `next_draw_at` hints are spread over this many seconds after the reset, per user.
+    DRAW_NEXT_AT_JITTER_SECONDS: int = 60
+    # Concurrent draws by the same user in one worker share a single execution.
+    DRAW_COALESCING_ENABLED: bool = True
+    # Batch fortune inserts into insert_many calls.
+    DRAW_INSERT_BATCHING_ENABLED: bool = False
+    DRAW_INSERT_BATCH_SIZE: int = 200
+    DRAW_INSERT_MAX_DELAY_MS: int = 20
+    DRAW_INSERT_QUEUE_MAX: int = 10000
+    # Derive each day's fortune from HMAC(user_id, day key) instead of storing-then-reading
+    # it; the fortunes collection becomes a write-behind history. Switch on at a day boundary:
+    # fortunes already stored for the current day may differ from the derived ones.
+    FORTUNE_DERIVATION_ENABLED: bool = False
+    # Defaults to a key derived from SECRET_KEY; changing it changes every derived fortune.
+    FORTUNE_DERIVATION_SECRET: str = ""
+    # How long workers cache the fortune archive cutoff (see app/services/fortune_history.py).
+    FORTUNE_ARCHIVE_CUTOFF_CACHE_SECONDS: int = 60
+
+    # --- Leaderboard push (GET /fortune/leaderboard/stream) ---
+    # "memory" delivers within one worker; "redis" fans out across workers via pub/sub.
+    LEADERBOARD_PUSH_BACKEND: str = "memory"
+    LEADERBOARD_PUSH_QUEUE_SIZE: int = 100
+    LEADERBOARD_PUSH_HEARTBEAT_SECONDS: int = 15
+    LEADERBOARD_PUSH_MAX_RESYNCS: int = 5
+    # GET /fortune/leaderboard bodies are cached (precompressed) this long; new draws clear it.
+    LEADERBOARD_CACHE_SECONDS: float = 5.0
+
+    # --- Luck percentiles (see app/services/luck.py) ---
+    # Fixed-width bins over the 1-7 rank range; changing it needs `achievements rebuild-luck`.
+    LUCK_HISTOGRAM_BINS: int = 60
+    LUCK_HISTOGRAM_CACHE_SECONDS: float = 30.0
+    # Exact recount period (0 disables it); one worker per period does the work.
+    LUCK_HISTOGRAM_REBUILD_SECONDS: int = 3600
+
+    # --- Response compression (see app/core/compression.py) ---
+    COMPRESSION_ENABLED: bool = True
+    COMPRESSION_MIN_SIZE: int = 1024
+    # Offered in this order when installed: zstd needs `zstandard`, br needs `brotli`.
+    COMPRESSION_ENCODINGS: str = "zstd,br,gzip"
+    COMPRESSION_GZIP_LEVEL: int = 6
+    COMPRESSION_BROTLI_QUALITY: int = 4
+    COMPRESSION_ZSTD_LEVEL: int = 3
+    COMPRESSION_CONTENT_TYPES: str = "application/json,text/plain,text/csv,text/html"
+
+    # --- Overload protection (see app/core/admission.py) ---
+    ADMISSION_ENABLED: bool = False
+    ADMISSION_INITIAL_LIMIT: int = 100
+    ADMISSION_MIN_LIMIT: int = 10
+    ADMISSION_MAX_LIMIT: int = 1000
+    # Latency above this shrinks the concurrency limit by ADMISSION_BACKOFF.
+    ADMISSION_LATENCY_TARGET_MS: int = 1000
+    ADMISSION_BACKOFF: float = 0.9
+    ADMISSION_QUEUE_SIZE: int = 200
+    ADMISSION_QUEUE_TIMEOUT_MS: int = 2000
+    # Extra slots for health checks, preflights and admin calls.
+    ADMISSION_CRITICAL_HEADROOM: int = 10
+    ADMISSION_RETRY_AFTER_SECONDS: int = 2
+    ADMISSION_EXEMPT_PATHS: str = "/fortune/leaderboard/stream,/admin/export/*"
+
+    # --- Degraded mode when the database is unreachable (see app/core/resilience.py) ---
+    BREAKER_ENABLED: bool = True
+    # Consecutive connection failures that open the breaker.
+    BREAKER_FAILURE_THRESHOLD: int = 5
+    # Time the breaker stays open before a background ping probes the database.
+    BREAKER_OPEN_SECONDS: float = 5.0
+    BREAKER_PROBE_TIMEOUT_SECONDS: float = 2.0
+    # Oldest last-known-good response served (flagged `X-Degraded: stale`) during an outage.
+    STALE_MAX_AGE_SECONDS: int = 3600
+    # Draws answered during an outage (derivation mode only) and replayed on recovery.
+    DEGRADED_DRAW_QUEUE_MAX: int = 10000
+
+    # --- Idempotency-Key support (see app/core/idempotency.py) ---
+    IDEMPOTENCY_ENABLED: bool = True
+    # "redis" shares keys between workers; "memory" is a per-worker LRU.
+    IDEMPOTENCY_BACKEND: str = "memory"
+    IDEMPOTENCY_TTL_SECONDS: int = 86400
+    IDEMPOTENCY_MEMORY_MAX_ENTRIES: int = 10000
+    # Larger requests run without idempotency; larger responses are not kept.
+    IDEMPOTENCY_MAX_REQUEST_BYTES: int = 65536
+    IDEMPOTENCY_MAX_RESPONSE_BYTES: int = 262144
+    # How long a duplicate waits for the first request before a 409; also the lease of the in-flight
+    # claim, renewed while the first request runs.
+    IDEMPOTENCY_WAIT_SECONDS: float = 10.0
+
+    # --- Bulk user import (see app/services/user_import.py) ---
+    USER_IMPORT_BATCH_SIZE: int = 1000
+    # Hashing processes of `app.cli users import`; 0 means one per CPU.
+    USER_IMPORT_HASH_WORKERS: int = 0
+    # Hashing processes per API worker, shared by all POST /admin/users/import calls.
+    USER_IMPORT_API_HASH_WORKERS: int = 2
+    # bcrypt cost of imported passwords. Lower imports faster; such hashes are raised
+    # to the normal cost (12) at the user's first login.
+    USER_IMPORT_BCRYPT_ROUNDS: int = 12
+    # Largest request body POST /admin/users/import accepts; use the CLI beyond it.
+    USER_IMPORT_MAX_BYTES: int = 16 * 1024 * 1024
+
+    # --- Diagnostics (see app/core/diagnostics.py) ---
+    # Mounts /admin/diagnostics and runs the event-loop lag probe; off, neither exists.
+    DIAGNOSTICS_ENABLED: bool = False
+    DIAGNOSTICS_LOOP_LAG_INTERVAL_SECONDS: float = 0.5
+    # Frames kept per traced allocation when tracemalloc is started without `frames`.
+    DIAGNOSTICS_TRACEMALLOC_FRAMES: int = 10
+    # Debug mode: a watchdog thread reports call sites that hold the event loop
+    # longer than BLOCKING_THRESHOLD_MS (GET /admin/diagnostics/blocking, served even
+    # without DIAGNOSTICS_ENABLED, and the log).
+    BLOCKING_DETECTOR_ENABLED: bool = False
+    BLOCKING_THRESHOLD_MS: float = 100.0
+
+    # --- Avatar / background proxy (see app/services/avatar_proxy.py) ---
+    AVATAR_PROXY_ENABLED: bool = True
+    # Shared by the workers; each keeps its own LRU index, so budget per worker.
+    AVATAR_CACHE_DIR: str = "avatar_cache"
+    AVATAR_CACHE_MAX_BYTES: int = 256 * 1024 * 1024
+    # Upstream images older than this are fetched again (served stale if that fails).
+    AVATAR_CACHE_TTL_SECONDS: int = 86400
+    # Standard sizes (longest side, px); a requested size is rounded up to one of them.
+    # Resizing needs Pillow; without it the original is served at every size.
+    AVATAR_PROXY_AVATAR_SIZES: str = "64,128,256"
+    AVATAR_PROXY_BACKGROUND_SIZES: str = "640,1280"
+    AVATAR_PROXY_QQ_URL: str = "https://q1.qlogo.cn/g?b=qq&nk={qq}&s=640"
+    AVATAR_PROXY_MAX_BYTES: int = 5 * 1024 * 1024
+    AVATAR_PROXY_MAX_PIXELS: int = 25_000_000
+    AVATAR_PROXY_TIMEOUT_SECONDS: float = 5.0
+    # A failed upstream is not retried for this long.
+    AVATAR_PROXY_FAILURE_TTL_SECONDS: int = 60
+    # Cache-Control max-age of proxied images; clients revalidate with If-None-Match after it.
+    AVATAR_PROXY_MAX_AGE_SECONDS: int = 86400
+    # Upstream hosts resolving to loopback/private/link-local addresses are refused
+    # unless this is set (for a local stand-in server in development).
+    AVATAR_PROXY_ALLOW_PRIVATE_HOSTS: bool = False
+
+    # --- Registration availability checks (see app/services/availability.py) ---
+    AVAILABILITY_BLOOM_CAPACITY: int = 100000
+    AVAILABILITY_BLOOM_ERROR_RATE: float = 0.01
+    # Catch-up with users created elsewhere (an _id range read), and full rebuild.
+    AVAILABILITY_BLOOM_REFRESH_SECONDS: int = 60
+    AVAILABILITY_BLOOM_REBUILD_SECONDS: int = 86400
+
     # A comma-separated string of allowed frontend origins for CORS.
     CORS_ORIGINS: str = "http://localhost:5173,http://127.0.0.1:5173"
     API_DOMAIN: str = "localhost"
@@ -33,4 +185,20 @@ class Settings(BaseSettings):
     class Config:
         env_file = ".env"
 
-settings = Settings()
\ No newline at end of file
+@lru_cache(maxsize=None)
+def get_settings() -> Settings:
+    return Settings()
+
+class _LazySettings:
+    """
+    Stands in for the Settings instance so importing this module reads neither
+    the environment nor `.env`; that happens on first attribute access.
+    """
+
+    def __getattr__(self, name):
+        return getattr(get_settings(), name)
+
+    def __setattr__(self, name, value):
+        setattr(get_settings(), name, value)
+
+settings = _LazySettings()
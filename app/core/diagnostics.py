@@ -0,0 +1,373 @@
+# app/core/diagnostics.py
+#
+# Tools for investigating a worker's memory and responsiveness in production,
+# served by /admin/diagnostics (app/routers/diagnostics.py). Nothing here runs
+# unless DIAGNOSTICS_ENABLED is set, and even then tracemalloc stays off until an
+# admin starts it (it slows allocation-heavy code by roughly 2x while tracing).
+#
+#   - event-loop lag: a background task asks to wake up every
+#     DIAGNOSTICS_LOOP_LAG_INTERVAL_SECONDS and records how late it actually did,
+#     which is how long something held the loop;
+#   - tracemalloc: start/stop, the top allocation sites of a fresh snapshot, and
+#     the difference between a fresh snapshot and a stored baseline;
+#   - object counts per type, from a walk over the objects tracked by the GC;
+#   - process memory: current and peak RSS;
+#   - blocking calls (BLOCKING_DETECTOR_ENABLED, independent of the above): a
+#     watchdog thread notices when one task step runs for longer than
+#     BLOCKING_THRESHOLD_MS, captures the loop thread's stack while it is still
+#     stuck, and tallies the stalls per call site.
+#
+# Snapshots and GC walks are slow on a large heap, so they run in a thread; the
+# event loop keeps serving requests between the GIL switches.
+
+import asyncio
+import gc
+import logging
+import os
+import resource
+import sys
+import threading
+import time
+import tracemalloc
+import traceback
+from collections import Counter, deque
+from typing import Deque, Dict, Iterable, List, Optional, Tuple
+
+from .config import settings
+
+logger = logging.getLogger("api_logger")
+
+# Allocations made by tracemalloc itself and by imports are noise in every report.
+SNAPSHOT_FILTERS = (
+    tracemalloc.Filter(False, tracemalloc.__file__),
+    tracemalloc.Filter(False, "<frozen importlib._bootstrap>"),
+    tracemalloc.Filter(False, "<frozen importlib._bootstrap_external>"),
+    tracemalloc.Filter(False, "<unknown>"),
+)
+GROUP_BY = ("lineno", "filename", "traceback")
+LAG_SAMPLES = 600
+
+
+# --- Event-loop lag ---
+
+class LoopLagMonitor:
+    """How late the loop wakes a task that sleeps for a fixed interval."""
+
+    def __init__(self):
+        self._samples: Deque[float] = deque(maxlen=LAG_SAMPLES)
+        self._max_since_read = 0.0
+        self._task: Optional[asyncio.Task] = None
+
+    @property
+    def running(self) -> bool:
+        return self._task is not None and not self._task.done()
+
+    def start(self) -> None:
+        if self._task is None:
+            self._task = asyncio.create_task(self._run(settings.DIAGNOSTICS_LOOP_LAG_INTERVAL_SECONDS))
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def _run(self, interval: float) -> None:
+        while True:
+            expected = time.perf_counter() + interval
+            await asyncio.sleep(interval)
+            lag = max(0.0, time.perf_counter() - expected)
+            self._samples.append(lag)
+            self._max_since_read = max(self._max_since_read, lag)
+
+    def stats(self) -> dict:
+        """Lag over the last LAG_SAMPLES intervals; `max_since_last_read_ms` resets on every call."""
+        samples = sorted(self._samples)
+        max_since_read, self._max_since_read = self._max_since_read, 0.0
+
+        def pct(p: float) -> Optional[float]:
+            if not samples:
+                return None
+            return round(samples[min(len(samples) - 1, int(len(samples) * p / 100))] * 1000, 2)
+
+        return {
+            "running": self.running,
+            "interval_ms": round(settings.DIAGNOSTICS_LOOP_LAG_INTERVAL_SECONDS * 1000),
+            "samples": len(samples),
+            "last_ms": round(self._samples[-1] * 1000, 2) if samples else None,
+            "p50_ms": pct(50),
+            "p99_ms": pct(99),
+            "max_ms": round(samples[-1] * 1000, 2) if samples else None,
+            "max_since_last_read_ms": round(max_since_read * 1000, 2),
+        }
+
+
+loop_lag_monitor = LoopLagMonitor()
+
+
+# --- Process memory ---
+
+def memory_usage() -> dict:
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    usage = {
+        # KiB on Linux, bytes on macOS.
+        "peak_rss_bytes": peak if sys.platform == "darwin" else peak * 1024,
+        "rss_bytes": None,
+        "gc_counts": gc.get_count(),
+        "gc_objects": len(gc.get_objects()),
+    }
+    try:
+        with open("/proc/self/statm") as f:
+            usage["rss_bytes"] = int(f.read().split()[1]) * resource.getpagesize()
+    except OSError:
+        pass
+    return usage
+
+
+# --- tracemalloc ---
+
+class AllocationTracer:
+    """tracemalloc control plus one stored baseline snapshot to diff against."""
+
+    def __init__(self):
+        self._baseline: Optional[tracemalloc.Snapshot] = None
+        self._baseline_at: Optional[float] = None
+
+    def status(self) -> dict:
+        status = {"tracing": tracemalloc.is_tracing(), "baseline_taken_at": self._baseline_at}
+        if status["tracing"]:
+            current, peak = tracemalloc.get_traced_memory()
+            status.update({
+                "frames": tracemalloc.get_traceback_limit(),
+                "traced_bytes": current,
+                "traced_peak_bytes": peak,
+                "overhead_bytes": tracemalloc.get_tracemalloc_memory(),
+            })
+        return status
+
+    def start(self, frames: int) -> dict:
+        if not tracemalloc.is_tracing():
+            tracemalloc.start(frames)
+            logger.warning(f"tracemalloc started ({frames} frames per allocation).")
+        return self.status()
+
+    def stop(self) -> dict:
+        if tracemalloc.is_tracing():
+            tracemalloc.stop()
+            logger.warning("tracemalloc stopped.")
+        self._baseline = self._baseline_at = None
+        return self.status()
+
+    @staticmethod
+    def _snapshot() -> tracemalloc.Snapshot:
+        if not tracemalloc.is_tracing():
+            raise RuntimeError("tracemalloc is not running; start it first.")
+        return tracemalloc.take_snapshot().filter_traces(SNAPSHOT_FILTERS)
+
+    @staticmethod
+    def _describe(stat, group_by: str) -> dict:
+        frames = stat.traceback.format() if group_by == "traceback" else [str(stat.traceback[0])]
+        entry = {"site": frames, "size_bytes": stat.size, "count": stat.count}
+        if hasattr(stat, "size_diff"):
+            entry.update({"size_diff_bytes": stat.size_diff, "count_diff": stat.count_diff})
+        return entry
+
+    def top(self, limit: int, group_by: str) -> List[dict]:
+        stats = self._snapshot().statistics(group_by)
+        return [self._describe(stat, group_by) for stat in stats[:limit]]
+
+    def set_baseline(self) -> dict:
+        self._baseline = self._snapshot()
+        self._baseline_at = time.time()
+        return self.status()
+
+    def diff(self, limit: int, group_by: str) -> List[dict]:
+        """Sites that grew (or shrank) the most since the baseline; the baseline is kept."""
+        if self._baseline is None:
+            raise RuntimeError("No baseline snapshot; take one first.")
+        stats = self._snapshot().compare_to(self._baseline, group_by)
+        return [self._describe(stat, group_by) for stat in stats[:limit]]
+
+
+allocation_tracer = AllocationTracer()
+
+
+# --- Object counts ---
+
+def object_counts(types: Iterable[type], top: int = 0) -> dict:
+    """Live instances of `types` (subclasses included) and, if `top`, the most common types overall."""
+    types = tuple(types)
+    per_type: Dict[str, int] = {t.__name__: 0 for t in types}
+    overall: Counter = Counter()
+    for obj in gc.get_objects():
+        cls = type(obj)
+        if top:
+            overall[cls] += 1
+        if isinstance(obj, types):
+            for t in types:
+                if isinstance(obj, t):
+                    per_type[t.__name__] += 1
+    counts = {"models": per_type}
+    if top:
+        counts["top_types"] = [
+            {"type": f"{cls.__module__}.{cls.__qualname__}", "count": count} for cls, count in overall.most_common(top)
+        ]
+    return counts
+
+
+# --- Blocking calls ---
+
+PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+ROUTERS_DIR = os.path.join(PROJECT_ROOT, "app", "routers")
+STACK_FRAMES_KEPT = 12
+
+
+def _is_project_frame(filename: str) -> bool:
+    return filename.startswith(PROJECT_ROOT) and "site-packages" not in filename
+
+
+def _where(frame: traceback.FrameSummary) -> str:
+    filename = os.path.relpath(frame.filename, PROJECT_ROOT) if _is_project_frame(frame.filename) else frame.filename
+    return f"{filename}:{frame.lineno} in {frame.name}"
+
+
+def _running_step(frame):
+    """
+    The frame of the loop's `Handle._run` call on the loop thread's stack: one per task
+    step or callback, so it changes whenever the loop moves on. None while idle.
+    """
+    while frame is not None:
+        code = frame.f_code
+        if code.co_name == "_run" and code.co_filename == asyncio.events.__file__:
+            return frame
+        frame = frame.f_back
+    return None
+
+
+def _cpu_wait(native_id: int) -> float:
+    """Seconds the thread spent runnable but waiting for a CPU (Linux schedstat; 0 elsewhere)."""
+    try:
+        with open(f"/proc/self/task/{native_id}/schedstat") as f:
+            return int(f.read().split()[1]) / 1e9
+    except (OSError, ValueError, IndexError):
+        return 0.0
+
+
+class BlockingDetector:
+    """
+    Finds code that holds the event loop. A watchdog thread looks at the loop thread
+    every fifth of the threshold; a task step (or callback) seen running for longer
+    than the threshold has its stack taken while the blocking call is still on it.
+    Timing single steps rather than loop iterations keeps a busy iteration of many
+    short steps from being blamed on whichever of them happened to be sampled, and
+    time the loop thread spent waiting for a CPU is not counted against the step.
+    The stack is sampled at every look while a step runs, and a stall is keyed by the
+    call site seen most often: the innermost frame of this project's code (the call
+    site to fix) and the route handler on the stack, if any.
+    """
+
+    def __init__(self):
+        self.threshold = 0.0
+        self._sites: Dict[Tuple[str, Optional[str]], dict] = {}
+        self._lock = threading.Lock()
+        self._watchdog: Optional[threading.Thread] = None
+        self._stopping = threading.Event()
+        self._loop_thread_id: Optional[int] = None
+        self._loop_native_id: Optional[int] = None
+
+    @property
+    def running(self) -> bool:
+        return self._watchdog is not None
+
+    def start(self, threshold_ms: float) -> None:
+        """Call from the event loop's thread."""
+        if self._watchdog is not None:
+            return
+        self.threshold = threshold_ms / 1000
+        self._loop_thread_id = threading.get_ident()
+        self._loop_native_id = threading.get_native_id()
+        self._stopping.clear()
+        self._watchdog = threading.Thread(target=self._watch, name="blocking-detector", daemon=True)
+        self._watchdog.start()
+        logger.warning(f"Blocking-call detector ENABLED (threshold {threshold_ms:g} ms).")
+
+    async def stop(self) -> None:
+        if self._watchdog is None:
+            return
+        self._stopping.set()
+        await asyncio.to_thread(self._watchdog.join)
+        self._watchdog = None
+
+    def _watch(self) -> None:
+        poll = max(0.001, self.threshold / 5)
+        step = None
+        first_seen = waited_before = held = 0.0
+        # Stack samples of the current step by call site: [times seen, details of the first].
+        samples: Dict[Tuple[str, Optional[str]], list] = {}
+        while not self._stopping.wait(poll):
+            frame = sys._current_frames().get(self._loop_thread_id)
+            current = _running_step(frame)
+            now = time.perf_counter()
+            if current is not step:
+                if held >= self.threshold:
+                    self._finish(*self._dominant(samples), held)
+                # Holding the frame keeps its identity from being reused by a later step.
+                step, first_seen, held, samples = current, now, 0.0, {}
+                waited_before = _cpu_wait(self._loop_native_id)
+            elif step is not None:
+                key, details = self._capture(frame)
+                samples.setdefault(key, [0, details])[0] += 1
+                # Time spent waiting for a CPU (other threads or processes busy on a small
+                # machine) starved the step; it did not hold the loop.
+                held = now - first_seen - (_cpu_wait(self._loop_native_id) - waited_before)
+            del frame, current
+
+    @staticmethod
+    def _dominant(samples: Dict[Tuple[str, Optional[str]], list]) -> Tuple[Tuple[str, Optional[str]], dict]:
+        """The call site the step was seen in most often: where it spent its time."""
+        key = max(samples, key=lambda k: samples[k][0])
+        return key, samples[key][1]
+
+    @staticmethod
+    def _capture(frame) -> Tuple[Tuple[str, Optional[str]], dict]:
+        stack = traceback.extract_stack(frame)
+        project = [f for f in stack if _is_project_frame(f.filename)]
+        call_site = _where(project[-1]) if project else _where(stack[-1])
+        handler = next((f"{os.path.relpath(f.filename, PROJECT_ROOT)} in {f.name}"
+                        for f in reversed(stack) if f.filename.startswith(ROUTERS_DIR)), None)
+        return (call_site, handler), {
+            "call_site": call_site,
+            "handler": handler,
+            "blocked_in": _where(stack[-1]),
+            "stack": [_where(f) for f in stack[-STACK_FRAMES_KEPT:]],
+        }
+
+    def _finish(self, key: Tuple[str, Optional[str]], details: dict, blocked: float) -> None:
+        blocked_ms = round(blocked * 1000, 1)
+        with self._lock:
+            site = self._sites.get(key)
+            if site is None:
+                site = self._sites[key] = {**details, "count": 0, "total_ms": 0.0, "max_ms": 0.0}
+            site["count"] += 1
+            site["total_ms"] = round(site["total_ms"] + blocked_ms, 1)
+            site["max_ms"] = max(site["max_ms"], blocked_ms)
+        logger.warning(
+            f"Event loop blocked for {blocked_ms:.0f} ms at {details['call_site']}"
+            + (f" (handler {details['handler']})" if details["handler"] else "")
+        )
+
+    def report(self) -> List[dict]:
+        """Call sites that blocked the loop, worst total first."""
+        with self._lock:
+            sites = [dict(site) for site in self._sites.values()]
+        return sorted(sites, key=lambda site: site["total_ms"], reverse=True)
+
+    def reset(self) -> None:
+        with self._lock:
+            self._sites.clear()
+
+
+blocking_detector = BlockingDetector()
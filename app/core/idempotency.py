@@ -0,0 +1,144 @@
+# app/core/idempotency.py
+#
+# Storage behind `Idempotency-Key` support (IdempotencyMiddleware in
+# app/core/middleware.py). One record per (requester, key), where the requester is
+# the token subject or, for anonymous calls, the client IP:
+#
+#     {"fp": request fingerprint, "state": "inflight"}                  while running
+#     {"fp": ..., "state": "done", "status", "headers", "body" (base64)} afterwards
+#
+# The in-flight record is claimed with set-if-absent for IDEMPOTENCY_WAIT_SECONDS
+# and extended while the request runs, so a worker dying mid-request does not
+# block the key for long; completed records live IDEMPOTENCY_TTL_SECONDS.
+# IDEMPOTENCY_BACKEND="redis" shares records between workers (in-process store
+# while Redis fails); "memory" keeps them in a per-worker LRU of
+# IDEMPOTENCY_MEMORY_MAX_ENTRIES.
+
+import base64
+import json
+import logging
+import time
+from collections import OrderedDict
+from typing import List, Optional, Tuple
+
+from .config import settings
+from .redis_client import get_redis
+
+logger = logging.getLogger("api_logger")
+
+INFLIGHT, DONE = "inflight", "done"
+FALLBACK_LOG_INTERVAL_SECONDS = 10.0
+
+
+def completed_record(fingerprint: str, status: int, headers: List[Tuple[bytes, bytes]], body: bytes) -> dict:
+    return {
+        "fp": fingerprint,
+        "state": DONE,
+        "status": status,
+        "headers": [[name.decode("latin-1"), value.decode("latin-1")] for name, value in headers],
+        "body": base64.b64encode(body).decode("ascii"),
+    }
+
+
+def record_response(record: dict) -> Tuple[int, List[Tuple[bytes, bytes]], bytes]:
+    headers = [(name.encode("latin-1"), value.encode("latin-1")) for name, value in record["headers"]]
+    return record["status"], headers, base64.b64decode(record["body"])
+
+
+class MemoryIdempotencyStore:
+    """LRU of records with per-entry expiry."""
+
+    def __init__(self, max_entries: int):
+        self.max_entries = max_entries
+        self._entries: "OrderedDict[str, Tuple[dict, float]]" = OrderedDict()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    async def get(self, key: str) -> Optional[dict]:
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        if entry[1] <= time.monotonic():
+            del self._entries[key]
+            return None
+        self._entries.move_to_end(key)
+        return entry[0]
+
+    def _put(self, key: str, record: dict, ttl: float) -> None:
+        self._entries[key] = (record, time.monotonic() + ttl)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    async def claim(self, key: str, fingerprint: str, ttl: float) -> bool:
+        if await self.get(key) is not None:
+            return False
+        self._put(key, {"fp": fingerprint, "state": INFLIGHT}, ttl)
+        return True
+
+    async def extend(self, key: str, ttl: float) -> None:
+        record = await self.get(key)
+        if record is not None:
+            self._put(key, record, ttl)
+
+    async def complete(self, key: str, record: dict, ttl: float) -> None:
+        self._put(key, record, ttl)
+
+    async def release(self, key: str) -> None:
+        self._entries.pop(key, None)
+
+
+class RedisIdempotencyStore:
+    PREFIX = "idem:"
+
+    async def get(self, key: str) -> Optional[dict]:
+        raw = await get_redis().get(self.PREFIX + key)
+        return json.loads(raw) if raw else None
+
+    async def claim(self, key: str, fingerprint: str, ttl: float) -> bool:
+        record = json.dumps({"fp": fingerprint, "state": INFLIGHT})
+        return bool(await get_redis().set(self.PREFIX + key, record, nx=True, px=int(ttl * 1000)))
+
+    async def extend(self, key: str, ttl: float) -> None:
+        await get_redis().pexpire(self.PREFIX + key, int(ttl * 1000))
+
+    async def complete(self, key: str, record: dict, ttl: float) -> None:
+        await get_redis().set(self.PREFIX + key, json.dumps(record, separators=(",", ":")), px=int(ttl * 1000))
+
+    async def release(self, key: str) -> None:
+        await get_redis().delete(self.PREFIX + key)
+
+
+class IdempotencyStore:
+    """The configured backend, with the in-process store while Redis fails."""
+
+    def __init__(self):
+        self.redis = RedisIdempotencyStore()
+        self._memory: Optional[MemoryIdempotencyStore] = None
+        self._last_fallback_log = 0.0
+
+    @property
+    def memory(self) -> MemoryIdempotencyStore:
+        if self._memory is None:
+            self._memory = MemoryIdempotencyStore(settings.IDEMPOTENCY_MEMORY_MAX_ENTRIES)
+        return self._memory
+
+    def memory_entries(self) -> int:
+        """Records in the in-process store, without creating it."""
+        return len(self._memory) if self._memory is not None else 0
+
+    async def call(self, operation: str, *args):
+        if settings.IDEMPOTENCY_BACKEND != "redis":
+            return await getattr(self.memory, operation)(*args)
+        try:
+            return await getattr(self.redis, operation)(*args)
+        except Exception as e:
+            now = time.monotonic()
+            if now - self._last_fallback_log >= FALLBACK_LOG_INTERVAL_SECONDS:
+                self._last_fallback_log = now
+                logger.warning(f"Idempotency store: Redis unavailable, using the in-process store: {e}")
+            return await getattr(self.memory, operation)(*args)
+
+
+idempotency_store = IdempotencyStore()
@@ -0,0 +1,420 @@
+# app/core/middleware.py
+
+import asyncio
+import hashlib
+import json
+import logging
+import re
+import time
+import uuid
+from typing import Dict, List, Optional, Tuple
+
+from jose import jwt, JWTError
+from starlette.concurrency import run_in_threadpool
+from starlette.middleware.cors import CORSMiddleware
+from starlette.datastructures import MutableHeaders
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+from .admission import admission_controller, classify, is_exempt
+from .compression import compress, is_compressible, negotiate_encoding
+from .config import settings
+from .idempotency import DONE, completed_record, idempotency_store, record_response
+
+logger = logging.getLogger("api_logger")
+
+REQUEST_ID_HEADER = b"x-request-id"
+# Bodies at least this large are compressed in a worker thread instead of on the event loop.
+THREADED_COMPRESSION_SIZE = 256 * 1024
+_VALID_REQUEST_ID = re.compile(r"^[A-Za-z0-9._-]{1,64}$")
+
+IDEMPOTENCY_KEY_HEADER = b"idempotency-key"
+IDEMPOTENT_METHODS = frozenset({"POST", "PUT", "PATCH", "DELETE"})
+REPLAYED_HEADER = (b"idempotent-replayed", b"true")
+IDEMPOTENCY_POLL_SECONDS = 0.05
+ANONYMOUS_SUBJECTS = frozenset({"anonymous", "invalid_token", "unknown"})
+# Routes that issue credentials: a replayed response would hand one caller's session
+# (token body, refresh cookie) to whoever reuses the key from the same address.
+IDEMPOTENCY_EXCLUDED_PATHS = frozenset({"/auth/register", "/auth/login", "/auth/refresh", "/auth/logout", "/users/me/password"})
+
+
+async def send_json(send: Send, status: int, content: dict, headers: List[Tuple[bytes, bytes]] = ()) -> None:
+    body = json.dumps(content).encode()
+    await send({
+        "type": "http.response.start",
+        "status": status,
+        "headers": [
+            (b"content-type", b"application/json"),
+            (b"content-length", str(len(body)).encode()),
+            *headers,
+        ],
+    })
+    await send({"type": "http.response.body", "body": body})
+
+
+def identity_from_authorization(auth_header: str | None) -> Tuple[str, str | None]:
+    """
+    Returns the token's `sub` (or a marker for missing/invalid tokens) for the access
+    log and its `role` claim for admission priority. The role is only a hint: the
+    admin routes still check the stored role.
+    """
+    if not auth_header or not auth_header.startswith("Bearer "):
+        return "anonymous", None
+    try:
+        payload = jwt.decode(auth_header[7:], settings.SECRET_KEY, algorithms=[settings.ALGORITHM])
+        return payload.get("sub", "unknown"), payload.get("role")
+    except JWTError:
+        return "invalid_token", None
+
+
+class RequestContextMiddleware:
+    """
+    Request logging, timing, auth-context extraction and request-id assignment as a
+    single pure ASGI middleware. Unlike `@app.middleware("http")` (BaseHTTPMiddleware)
+    it creates no extra task per request and never copies the response stream, so
+    streaming responses (SSE, NDJSON) pass through untouched.
+
+    The request id (taken from a well-formed `X-Request-ID` header or generated) and the
+    token subject and role are exposed as `request.state.request_id` /
+    `request.state.user_id` / `request.state.role`.
+    """
+
+    def __init__(self, app: ASGIApp):
+        self.app = app
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        start_time = time.perf_counter()
+        request_id = None
+        auth_header = None
+        for name, value in scope["headers"]:
+            if name == REQUEST_ID_HEADER:
+                request_id = value.decode("latin-1")
+            elif name == b"authorization":
+                auth_header = value.decode("latin-1")
+        if request_id is None or not _VALID_REQUEST_ID.match(request_id):
+            request_id = uuid.uuid4().hex
+        user_id, role = identity_from_authorization(auth_header)
+
+        state = scope.setdefault("state", {})
+        state["request_id"] = request_id
+        state["user_id"] = user_id
+        state["role"] = role
+
+        status_code = 500
+        request_id_header = (REQUEST_ID_HEADER, request_id.encode("latin-1"))
+
+        async def send_with_context(message: Message) -> None:
+            nonlocal status_code
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+                message["headers"] = [*message.get("headers", ()), request_id_header]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_context)
+        finally:
+            # For streaming responses this runs when the stream ends (or the client leaves).
+            process_time = (time.perf_counter() - start_time) * 1000
+            client = scope.get("client")
+            log_message = (
+                f'user="{user_id}" '
+                f'ip="{client[0] if client else "-"}" '
+                f'method="{scope["method"]}" '
+                f'path="{scope["path"]}" '
+                f'status={status_code} '
+                f'duration={process_time:.2f}ms '
+                f'request_id="{request_id}"'
+            )
+            logger.info(log_message)
+
+
+class SettingsCORSMiddleware(CORSMiddleware):
+    """
+    CORSMiddleware with the origins from CORS_ORIGINS. Starlette instantiates
+    middleware when the app first runs (lifespan), so settings are not read at import.
+    """
+
+    def __init__(self, app: ASGIApp, **kwargs):
+        super().__init__(app, allow_origins=settings.cors_origins_list, **kwargs)
+
+
+class CompressionMiddleware:
+    """
+    Compresses complete response bodies (a single `http.response.body` message, as
+    sent by JSONResponse) with the best encoding the client accepts, when they are
+    at least COMPRESSION_MIN_SIZE bytes and of an allowlisted content type.
+    Streaming responses and responses that already carry a Content-Encoding (e.g.
+    precompressed cache entries) pass through untouched.
+    """
+
+    def __init__(self, app: ASGIApp):
+        self.app = app
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http" or not settings.COMPRESSION_ENABLED:
+            await self.app(scope, receive, send)
+            return
+
+        accept_encoding = ""
+        for name, value in scope["headers"]:
+            if name == b"accept-encoding":
+                accept_encoding = value.decode("latin-1")
+                break
+        encoding = negotiate_encoding(accept_encoding) if accept_encoding else None
+        if encoding is None:
+            await self.app(scope, receive, send)
+            return
+
+        start_message: Message | None = None
+        passthrough = False
+
+        async def send_compressed(message: Message) -> None:
+            nonlocal start_message, passthrough
+            if passthrough:
+                await send(message)
+                return
+            if message["type"] == "http.response.start":
+                start_message = message
+                return
+            if message["type"] != "http.response.body" or start_message is None:
+                await send(message)
+                return
+
+            start, start_message = start_message, None
+            body = message.get("body", b"")
+            headers = MutableHeaders(raw=start.setdefault("headers", []))
+            if (
+                message.get("more_body", False)
+                or "content-encoding" in headers
+                or start["status"] < 200 or start["status"] in (204, 304)
+                or len(body) < settings.COMPRESSION_MIN_SIZE
+                or not is_compressible(headers.get("content-type", ""))
+            ):
+                passthrough = True
+                await send(start)
+                await send(message)
+                return
+
+            if len(body) >= THREADED_COMPRESSION_SIZE:
+                data = await run_in_threadpool(compress, body, encoding)
+            else:
+                data = compress(body, encoding)
+            headers["Content-Encoding"] = encoding
+            headers["Content-Length"] = str(len(data))
+            headers.add_vary_header("Accept-Encoding")
+            await send(start)
+            await send({"type": "http.response.body", "body": data})
+
+        await self.app(scope, receive, send_compressed)
+
+
+class AdmissionMiddleware:
+    """
+    Runs each request under the adaptive concurrency limit of
+    app/core/admission.py and answers shed requests with a 503 and Retry-After.
+    Long-lived streams (ADMISSION_EXEMPT_PATHS) bypass the limiter.
+    """
+
+    def __init__(self, app: ASGIApp):
+        self.app = app
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http" or not settings.ADMISSION_ENABLED or is_exempt(scope["path"]):
+            await self.app(scope, receive, send)
+            return
+
+        state = scope.get("state", {})
+        user_id, role = state.get("user_id"), state.get("role")
+        if user_id is None:
+            auth_header = None
+            for name, value in scope["headers"]:
+                if name == b"authorization":
+                    auth_header = value.decode("latin-1")
+                    break
+            user_id, role = identity_from_authorization(auth_header)
+        priority = classify(scope["method"], scope["path"], user_id, role)
+
+        shed_reason = await admission_controller.acquire(priority)
+        if shed_reason is not None:
+            await send_json(send, 503, {"detail": "Server is busy, please retry later."}, [
+                (b"retry-after", str(settings.ADMISSION_RETRY_AFTER_SECONDS).encode()),
+                (b"x-shed-reason", shed_reason.encode()),
+            ])
+            return
+
+        start_time = time.perf_counter()
+        failed = False
+        try:
+            await self.app(scope, receive, send)
+        except Exception:
+            failed = True
+            raise
+        finally:
+            # Errors are not latency samples: a fast failure would grow the limit.
+            latency = None if failed else time.perf_counter() - start_time
+            admission_controller.release(latency)
+
+
+async def _buffer_request_body(receive: Receive, limit: int) -> Tuple[Optional[bytes], Receive]:
+    """
+    Reads the request body up to `limit` bytes. Returns it (None when it is larger
+    or the client left) and a receive callable that hands the app the same messages.
+    """
+    messages: List[Message] = []
+    size = 0
+    body: Optional[bytes] = None
+    while True:
+        message = await receive()
+        messages.append(message)
+        if message["type"] != "http.request":
+            break
+        size += len(message.get("body", b""))
+        if size > limit:
+            break
+        if not message.get("more_body", False):
+            body = b"".join(m.get("body", b"") for m in messages)
+            break
+
+    async def replay_receive() -> Message:
+        if messages:
+            return messages.pop(0)
+        return await receive()
+
+    return body, replay_receive
+
+
+class IdempotencyMiddleware:
+    """
+    `Idempotency-Key` support for mutating requests (app/core/idempotency.py). The
+    first request with a key runs; its response is recorded per (requester, key)
+    and every retry gets it back with `Idempotent-Replayed: true` instead of
+    running again. Duplicates arriving while it still runs wait for its response:
+    in this worker on a shared future, across workers by polling the store for up
+    to IDEMPOTENCY_WAIT_SECONDS (then 409). Reusing a key for a different request
+    is a 422. 5xx responses are handed to waiting duplicates but not kept, so a
+    later retry runs again. Credential-issuing routes run without idempotency, and a
+    response that sets a cookie is never kept or shared.
+    """
+
+    def __init__(self, app: ASGIApp):
+        self.app = app
+        self._inflight: Dict[str, asyncio.Future] = {}
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if (scope["type"] != "http" or scope["method"] not in IDEMPOTENT_METHODS or not settings.IDEMPOTENCY_ENABLED
+                or scope["path"] in IDEMPOTENCY_EXCLUDED_PATHS):
+            await self.app(scope, receive, send)
+            return
+        idempotency_key = None
+        for name, value in scope["headers"]:
+            if name == IDEMPOTENCY_KEY_HEADER:
+                idempotency_key = value.decode("latin-1")
+                break
+        if idempotency_key is None:
+            await self.app(scope, receive, send)
+            return
+        if not 1 <= len(idempotency_key) <= 255:
+            await send_json(send, 400, {"detail": "Idempotency-Key must be 1 to 255 characters long."})
+            return
+
+        body, receive = await _buffer_request_body(receive, settings.IDEMPOTENCY_MAX_REQUEST_BYTES)
+        if body is None:
+            await self.app(scope, receive, send)
+            return
+        fingerprint = hashlib.sha256(
+            b"\0".join((scope["method"].encode(), scope["path"].encode(), scope.get("query_string", b""), body))
+        ).hexdigest()
+        key = f"{self._requester(scope)}:{idempotency_key}"
+
+        waiting = self._inflight.get(key)
+        if waiting is not None:
+            await self._answer(send, await asyncio.shield(waiting), fingerprint)
+            return
+
+        deadline = time.monotonic() + settings.IDEMPOTENCY_WAIT_SECONDS
+        while True:
+            record = await idempotency_store.call("get", key)
+            if record is None:
+                if await idempotency_store.call("claim", key, fingerprint, settings.IDEMPOTENCY_WAIT_SECONDS):
+                    break
+                continue
+            if record["fp"] != fingerprint or record["state"] == DONE:
+                await self._answer(send, record, fingerprint)
+                return
+            if time.monotonic() >= deadline:
+                await self._answer(send, None, fingerprint)
+                return
+            await asyncio.sleep(IDEMPOTENCY_POLL_SECONDS)
+
+        await self._run(scope, receive, send, key, fingerprint)
+
+    @staticmethod
+    def _requester(scope: Scope) -> str:
+        user_id = scope.get("state", {}).get("user_id")
+        if user_id and user_id not in ANONYMOUS_SUBJECTS:
+            return f"u:{user_id}"
+        client = scope.get("client")
+        return f"ip:{client[0] if client else '-'}"
+
+    async def _run(self, scope: Scope, receive: Receive, send: Send, key: str, fingerprint: str) -> None:
+        future = asyncio.get_running_loop().create_future()
+        self._inflight[key] = future
+        status: Optional[int] = None
+        headers: List[Tuple[bytes, bytes]] = []
+        chunks: List[bytes] = []
+        size = 0
+
+        async def send_and_record(message: Message) -> None:
+            nonlocal status, headers, size
+            if message["type"] == "http.response.start":
+                status = message["status"]
+                headers = list(message.get("headers", ()))
+            elif message["type"] == "http.response.body" and size <= settings.IDEMPOTENCY_MAX_RESPONSE_BYTES:
+                chunk = message.get("body", b"")
+                size += len(chunk)
+                chunks.append(chunk)
+            await send(message)
+
+        record = None
+        renewal = asyncio.create_task(self._keep_claimed(key))
+        try:
+            await self.app(scope, receive, send_and_record)
+            if (status is not None and size <= settings.IDEMPOTENCY_MAX_RESPONSE_BYTES
+                    and not any(name.lower() == b"set-cookie" for name, _ in headers)):
+                record = completed_record(fingerprint, status, headers, b"".join(chunks))
+        finally:
+            renewal.cancel()
+            await asyncio.gather(renewal, return_exceptions=True)
+            del self._inflight[key]
+            future.set_result(record)
+            if record is not None and record["status"] < 500:
+                await idempotency_store.call("complete", key, record, settings.IDEMPOTENCY_TTL_SECONDS)
+            else:
+                await idempotency_store.call("release", key)
+
+    @staticmethod
+    async def _keep_claimed(key: str) -> None:
+        """
+        Extends the in-flight claim while the first request runs, however long it takes:
+        a claim that expired under a slow request would let a duplicate run it again.
+        The claim still lapses within IDEMPOTENCY_WAIT_SECONDS if this worker dies.
+        """
+        lease = settings.IDEMPOTENCY_WAIT_SECONDS
+        while True:
+            await asyncio.sleep(lease / 3)
+            await idempotency_store.call("extend", key, lease)
+
+    @staticmethod
+    async def _answer(send: Send, record: Optional[dict], fingerprint: str) -> None:
+        if record is None:
+            await send_json(send, 409, {"detail": "A request with this Idempotency-Key is still in progress or failed; retry."},
+                            [(b"retry-after", b"1")])
+        elif record["fp"] != fingerprint:
+            await send_json(send, 422, {"detail": "Idempotency-Key was already used for a different request."})
+        else:
+            status, headers, body = record_response(record)
+            await send({"type": "http.response.start", "status": status, "headers": [*headers, REPLAYED_HEADER]})
+            await send({"type": "http.response.body", "body": body})
@@ -0,0 +1,392 @@
+# app/core/migrations.py
+
+import logging
+from datetime import datetime, timezone
+from typing import Callable, Dict, List, Optional
+
+from motor.motor_asyncio import AsyncIOMotorDatabase
+from pymongo import ASCENDING, IndexModel, UpdateOne
+from pymongo.errors import DuplicateKeyError
+
+from .time_service import get_business_day_key, get_timezone
+
+logger = logging.getLogger("api_logger")
+
+MIGRATIONS_COLLECTION = "migrations"
+LOCK_ID = "__lock__"
+DEFAULT_BATCH_SIZE = 1000
+
+
+class MigrationError(Exception):
+    pass
+
+
+class MigrationContext:
+    """
+    Handed to every migration step. Keeps the resumable checkpoint of the
+    running migration in its `migrations` document so an interrupted backfill
+    continues where it stopped instead of starting over.
+    """
+
+    def __init__(self, db: AsyncIOMotorDatabase, version: int, checkpoint: Optional[dict], batch_size: int):
+        self.db = db
+        self.version = version
+        self.checkpoint = checkpoint or {}
+        self.batch_size = batch_size
+
+    async def save_checkpoint(self, **values) -> None:
+        self.checkpoint.update(values)
+        await self.db[MIGRATIONS_COLLECTION].update_one(
+            {"_id": self.version},
+            {"$set": {"checkpoint": self.checkpoint}}
+        )
+
+    async def create_indexes(self, collection: str, indexes: List[IndexModel]) -> None:
+        """
+        Builds indexes online. `background` is honoured by MongoDB < 4.2 and ignored
+        (builds are always non-blocking) on newer servers.
+        """
+        for index in indexes:
+            index.document.setdefault("background", True)
+        names = await self.db[collection].create_indexes(indexes)
+        logger.info(f"Migration {self.version}: ensured indexes {names} on '{collection}'.")
+
+    async def backfill(
+        self,
+        collection: str,
+        query: dict,
+        transform: Callable[[dict], Optional[dict]],
+        projection: Optional[dict] = None,
+    ) -> int:
+        """
+        Walks `collection` in `_id` order in batches of `batch_size`, applying the
+        `$set` document returned by `transform` to each matching document.
+        Progress is checkpointed after every batch.
+        """
+        coll = self.db[collection]
+        total = await coll.count_documents(query)
+        processed = self.checkpoint.get("processed", 0)
+        last_id = self.checkpoint.get("last_id")
+        logger.info(f"Migration {self.version}: backfilling ~{total} documents in '{collection}' (resuming after {processed}).")
+
+        while True:
+            batch_query = dict(query)
+            if last_id is not None:
+                batch_query["_id"] = {"$gt": last_id}
+            cursor = coll.find(batch_query, projection).sort("_id", ASCENDING).limit(self.batch_size)
+            docs = await cursor.to_list(length=self.batch_size)
+            if not docs:
+                break
+
+            operations = []
+            for doc in docs:
+                update = transform(doc)
+                if update:
+                    operations.append(UpdateOne({"_id": doc["_id"]}, {"$set": update}))
+            if operations:
+                await coll.bulk_write(operations, ordered=False)
+
+            last_id = docs[-1]["_id"]
+            processed += len(docs)
+            await self.save_checkpoint(last_id=last_id, processed=processed)
+            logger.info(f"Migration {self.version}: {processed}/{total} documents processed.")
+
+        return processed
+
+
+class Migration:
+    """A single, ordered schema change. Subclasses implement `apply`."""
+
+    version: int
+    name: str
+
+    async def apply(self, ctx: MigrationContext) -> None:
+        raise NotImplementedError
+
+
+# --- Migration Definitions ---
+
+class InitialIndexes(Migration):
+    version = 1
+    name = "initial_indexes"
+
+    async def apply(self, ctx: MigrationContext) -> None:
+        await ctx.create_indexes("users", [
+            IndexModel([("username", ASCENDING)], unique=True, name="username_unique"),
+            IndexModel([("email", ASCENDING)], unique=True, name="email_unique"),
+            IndexModel([("display_name", ASCENDING)], unique=True, name="display_name_unique", collation={'locale': 'en', 'strength': 2})
+        ])
+        await ctx.create_indexes("fortunes", [
+            IndexModel([("user_id", ASCENDING)], name="fortune_user_id")
+        ])
+        await ctx.create_indexes("config", [
+            IndexModel([("key", ASCENDING)], unique=True, name="config_key_unique")
+        ])
+
+
+class BackfillFortuneDate(Migration):
+    version = 2
+    name = "backfill_fortune_date"
+
+    async def apply(self, ctx: MigrationContext) -> None:
+        await ctx.backfill(
+            "fortunes",
+            {"date": {"$exists": False}},
+            lambda doc: {"date": get_business_day_key(doc["created_at"])},
+            projection={"created_at": 1}
+        )
+
+
+class FortuneDayIndexes(Migration):
+    version = 3
+    name = "fortune_day_indexes"
+
+    async def apply(self, ctx: MigrationContext) -> None:
+        await ctx.create_indexes("fortunes", [
+            IndexModel([("user_id", ASCENDING), ("date", ASCENDING)], unique=True, name="user_date_unique"),
+            IndexModel([("created_at", ASCENDING)], name="fortune_created_at")
+        ])
+
+
+class FortuneTimezone(Migration):
+    """
+    Fortunes store the user-local day key plus the zone it was computed in.
+    Legacy documents were keyed by APP_TIMEZONE (migration 2), so that is their zone.
+    """
+    version = 4
+    name = "fortune_timezone"
+
+    async def apply(self, ctx: MigrationContext) -> None:
+        app_zone = get_timezone().zone
+        await ctx.backfill(
+            "fortunes",
+            {"tz": {"$exists": False}},
+            lambda doc: {"tz": app_zone},
+            projection={"_id": 1}
+        )
+        await ctx.create_indexes("fortunes", [
+            IndexModel([("tz", ASCENDING), ("date", ASCENDING)], name="fortune_tz_date")
+        ])
+
+
+class FortuneArchive(Migration):
+    """
+    Cold storage for old fortunes: one bucket document per user per month (see
+    app/services/fortune_history.py). Existing fortunes are moved by
+    `python -m app.cli fortunes archive`, which can run while the API is serving.
+    """
+    version = 5
+    name = "fortune_archive"
+
+    async def apply(self, ctx: MigrationContext) -> None:
+        await ctx.create_indexes("fortune_archive", [
+            IndexModel([("user_id", ASCENDING), ("month", ASCENDING)], unique=True, name="user_month_unique")
+        ])
+
+
+class UserSearchIndexes(Migration):
+    """
+    Indexes behind GET /admin/users (app/services/user_search.py). They share the
+    case-insensitive collation of display_name_unique, which the search queries use.
+    """
+    version = 6
+    name = "user_search_indexes"
+
+    async def apply(self, ctx: MigrationContext) -> None:
+        collation = {'locale': 'en', 'strength': 2}
+        await ctx.create_indexes("users", [
+            IndexModel([("username", ASCENDING)], name="username_search", collation=collation),
+            IndexModel([("registration_date", ASCENDING), ("_id", ASCENDING)], name="registration_date_search", collation=collation),
+            IndexModel([("last_active_date", ASCENDING), ("_id", ASCENDING)], name="last_active_date_search", collation=collation),
+            IndexModel([("tags", ASCENDING)], name="tags_search", collation=collation)
+        ])
+
+
+class UserAchievements(Migration):
+    """
+    Builds the streak / luckiest-month state on every user from their fortune history
+    (app/services/achievements.py); POST /fortune/draw keeps it current from then on.
+    Resumable: the last processed user id is checkpointed after every batch.
+    """
+    version = 7
+    name = "user_achievements"
+
+    async def apply(self, ctx: MigrationContext) -> None:
+        from ..services.achievements import recompute_achievements
+
+        async def checkpoint(last_id, processed: int) -> None:
+            await ctx.save_checkpoint(last_id=last_id, processed=processed)
+            logger.info(f"Migration {ctx.version}: {processed} users processed.")
+
+        await recompute_achievements(
+            ctx.db,
+            batch_size=ctx.batch_size,
+            start_after=ctx.checkpoint.get("last_id"),
+            on_batch=checkpoint,
+        )
+
+
+class LuckHistogram(Migration):
+    """
+    Recomputes achievements so they carry the lifetime draws / rank_sum behind the
+    luck score, then builds the score histogram (app/services/luck.py). Resumable
+    like migration 7; the histogram is rebuilt from scratch at the end.
+    """
+    version = 8
+    name = "luck_histogram"
+
+    async def apply(self, ctx: MigrationContext) -> None:
+        from ..services.achievements import recompute_achievements
+        from ..services.luck import rebuild_luck_histogram
+
+        async def checkpoint(last_id, processed: int) -> None:
+            await ctx.save_checkpoint(last_id=last_id, processed=processed)
+            logger.info(f"Migration {ctx.version}: {processed} users processed.")
+
+        await recompute_achievements(
+            ctx.db,
+            batch_size=ctx.batch_size,
+            start_after=ctx.checkpoint.get("last_id"),
+            on_batch=checkpoint,
+        )
+        await rebuild_luck_histogram(ctx.db)
+
+
+class UserFilterIndexes(Migration):
+    """
+    Compound indexes for the GET /admin/users filters, in the search collation. A
+    status filter leads each sort order (equality before sort/range); role and
+    is_hidden lead one index each, in the default registration_date order. That
+    covers their selective values (admins, hidden users); their common values
+    barely narrow the plain sort indexes of migration 6.
+    """
+    version = 9
+    name = "user_filter_indexes"
+
+    async def apply(self, ctx: MigrationContext) -> None:
+        collation = {'locale': 'en', 'strength': 2}
+        await ctx.create_indexes("users", [
+            IndexModel([("status", ASCENDING), ("username", ASCENDING)], name="status_username_search", collation=collation),
+            IndexModel([("status", ASCENDING), ("registration_date", ASCENDING), ("_id", ASCENDING)],
+                       name="status_registration_date_search", collation=collation),
+            IndexModel([("status", ASCENDING), ("last_active_date", ASCENDING), ("_id", ASCENDING)],
+                       name="status_last_active_date_search", collation=collation),
+            IndexModel([("role", ASCENDING), ("registration_date", ASCENDING), ("_id", ASCENDING)],
+                       name="role_search", collation=collation),
+            IndexModel([("is_hidden", ASCENDING), ("registration_date", ASCENDING), ("_id", ASCENDING)],
+                       name="is_hidden_search", collation=collation)
+        ])
+
+
+MIGRATIONS: List[Migration] = [
+    InitialIndexes(),
+    BackfillFortuneDate(),
+    FortuneDayIndexes(),
+    FortuneTimezone(),
+    FortuneArchive(),
+    UserSearchIndexes(),
+    UserAchievements(),
+    LuckHistogram(),
+    UserFilterIndexes(),
+]
+
+SCHEMA_VERSION = max(m.version for m in MIGRATIONS)
+
+
+# --- Runner ---
+
+async def get_applied_versions(db: AsyncIOMotorDatabase) -> Dict[int, dict]:
+    cursor = db[MIGRATIONS_COLLECTION].find({"_id": {"$ne": LOCK_ID}})
+    return {doc["_id"]: doc async for doc in cursor}
+
+
+async def get_schema_version(db: AsyncIOMotorDatabase) -> int:
+    """Highest version such that it and every version below it are applied."""
+    applied = await get_applied_versions(db)
+    version = 0
+    for migration in sorted(MIGRATIONS, key=lambda m: m.version):
+        if applied.get(migration.version, {}).get("status") != "applied":
+            break
+        version = migration.version
+    return version
+
+
+async def verify_schema_version(db: AsyncIOMotorDatabase) -> bool:
+    """
+    Cheap startup check: a single read of the `migrations` collection.
+    Returns True when the database is at the schema version this code expects.
+    """
+    current = await get_schema_version(db)
+    if current < SCHEMA_VERSION:
+        logger.error(
+            f"Database schema is at version {current}, code expects {SCHEMA_VERSION}. "
+            f"Run `python -m app.cli migrate apply`."
+        )
+        return False
+    logger.info(f"Database schema version {current} verified.")
+    return True
+
+
+async def _acquire_lock(db: AsyncIOMotorDatabase, force: bool) -> None:
+    collection = db[MIGRATIONS_COLLECTION]
+    if force:
+        await collection.delete_one({"_id": LOCK_ID})
+    try:
+        await collection.insert_one({"_id": LOCK_ID, "locked_at": datetime.now(timezone.utc)})
+    except DuplicateKeyError:
+        raise MigrationError("Another migration run holds the lock. Use --force-unlock if it crashed.")
+
+
+async def apply_migrations(
+    db: AsyncIOMotorDatabase,
+    target: Optional[int] = None,
+    batch_size: int = DEFAULT_BATCH_SIZE,
+    force_unlock: bool = False,
+) -> List[int]:
+    """Applies every pending migration up to `target` (default: latest), in order."""
+    target = SCHEMA_VERSION if target is None else target
+    collection = db[MIGRATIONS_COLLECTION]
+    await _acquire_lock(db, force_unlock)
+    applied_now = []
+    try:
+        applied = await get_applied_versions(db)
+        for migration in sorted(MIGRATIONS, key=lambda m: m.version):
+            if migration.version > target:
+                break
+            record = applied.get(migration.version, {})
+            if record.get("status") == "applied":
+                continue
+
+            logger.info(f"Applying migration {migration.version} ({migration.name})...")
+            await collection.update_one(
+                {"_id": migration.version},
+                {
+                    "$set": {"name": migration.name, "status": "running"},
+                    "$setOnInsert": {"started_at": datetime.now(timezone.utc), "checkpoint": {}}
+                },
+                upsert=True
+            )
+            ctx = MigrationContext(db, migration.version, record.get("checkpoint"), batch_size)
+            await migration.apply(ctx)
+            await collection.update_one(
+                {"_id": migration.version},
+                {"$set": {"status": "applied", "applied_at": datetime.now(timezone.utc)}}
+            )
+            applied_now.append(migration.version)
+            logger.info(f"Migration {migration.version} applied.")
+    finally:
+        await collection.delete_one({"_id": LOCK_ID})
+    return applied_now
+
+
+async def get_migration_status(db: AsyncIOMotorDatabase) -> List[dict]:
+    applied = await get_applied_versions(db)
+    return [
+        {
+            "version": m.version,
+            "name": m.name,
+            "status": applied.get(m.version, {}).get("status", "pending"),
+            "applied_at": applied.get(m.version, {}).get("applied_at"),
+        }
+        for m in sorted(MIGRATIONS, key=lambda m: m.version)
+    ]
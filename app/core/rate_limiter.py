@@ -1,28 +1,99 @@
 # app/core/rate_limiter.py
 
-from slowapi import Limiter
-from slowapi.util import get_remote_address
+import asyncio
+import functools
+import logging
+from functools import lru_cache
+
+from fastapi import Request
+from fastapi.responses import JSONResponse
+from jose import jwt, JWTError
 from ..core.config import settings
 
-# This is a dummy decorator that does nothing.
-# It's used when rate limiting is disabled in the config.
-def no_op_decorator(*args, **kwargs):
+logger = logging.getLogger("api_logger")
+
+def get_remote_address(request: Request) -> str:
+    # Same as slowapi.util.get_remote_address, without importing slowapi when it's disabled.
+    if not request.client or not request.client.host:
+        return "127.0.0.1"
+    return request.client.host
+
+def get_user_or_remote_address(request: Request) -> str:
+    """
+    Keys authenticated requests by user id and everything else by IP, so users
+    behind a shared NAT don't exhaust each other's limits. Only tokens with a
+    valid signature are trusted, otherwise a forged `sub` would dodge the limit.
+    """
+    auth_header = request.headers.get("authorization")
+    if auth_header and auth_header.startswith("Bearer "):
+        try:
+            payload = jwt.decode(auth_header[7:], settings.SECRET_KEY, algorithms=[settings.ALGORITHM])
+            if payload.get("sub"):
+                return f"user:{payload['sub']}"
+        except JWTError:
+            pass
+    return get_remote_address(request)
+
+@lru_cache(maxsize=None)
+def get_limiter():
+    """The slowapi Limiter, or None when rate limiting is disabled. Built on first use, not at import."""
+    if not settings.RATE_LIMITING_ENABLED:
+        return None
+    # slowapi (and limits/redis behind it) is only imported when the feature is on.
+    from slowapi import Limiter
+    from slowapi.errors import RateLimitExceeded
+
+    global _rate_limit_errors
+    _rate_limit_errors = (RateLimitExceeded,)
+    # The key_func determines how to identify a client (by user id, falling back to IP address).
+    return Limiter(key_func=get_user_or_remote_address, storage_uri=settings.REDIS_URL)
+
+
+# slowapi's RateLimitExceeded once the limiter exists; catching () catches nothing.
+_rate_limit_errors: tuple = ()
+
+
+def _rate_limited_response(request: Request, exc: Exception) -> JSONResponse:
+    logger.warning(f"Rate limit exceeded for IP {get_remote_address(request)} on path {request.url.path}")
+    return JSONResponse(status_code=429, content={"detail": f"Rate limit exceeded: {exc.detail}"})
+
+
+def limiter_decorator(limit_value: str):
+    """
+    Applies `limit_value` to a route. Whether rate limiting is enabled is read
+    from settings at the route's first request, when the slowapi wrapper is
+    built; until then (and when disabled) the route runs as is.
+    """
     def decorator(func):
-        return func
-    return decorator
+        limited = None
+
+        def resolve():
+            nonlocal limited
+            if limited is None:
+                limiter = get_limiter()
+                limited = limiter.limit(limit_value)(func) if limiter else func
+            return limited
 
-# --- Initialize the Limiter only if the feature is enabled ---
-if settings.RATE_LIMITING_ENABLED:
-    # The key_func determines how to identify a client (by IP address).
-    limiter = Limiter(
-        key_func=get_remote_address,
-        # --- MODIFICATION: Remove storage_options and let slowapi handle the connection ---
-        storage_uri=settings.REDIS_URL
-    )
-    
-    # When enabled, our decorator is the real limiter.
-    limiter_decorator = limiter.limit
-else:
-    # When disabled, assign the limiter variable to None and the decorator to our dummy function.
-    limiter = None
-    limiter_decorator = no_op_decorator
\ No newline at end of file
+        def request_of(args, kwargs) -> Request:
+            return kwargs.get("request") or next(arg for arg in args if isinstance(arg, Request))
+
+        if asyncio.iscoroutinefunction(func):
+            @functools.wraps(func)
+            async def async_wrapper(*args, **kwargs):
+                route = resolve()
+                try:
+                    return await route(*args, **kwargs)
+                except _rate_limit_errors as e:
+                    return _rate_limited_response(request_of(args, kwargs), e)
+            return async_wrapper
+
+        @functools.wraps(func)
+        def sync_wrapper(*args, **kwargs):
+            route = resolve()
+            try:
+                return route(*args, **kwargs)
+            except _rate_limit_errors as e:
+                return _rate_limited_response(request_of(args, kwargs), e)
+        return sync_wrapper
+
+    return decorator
@@ -0,0 +1,19 @@
+# app/core/redis_client.py
+
+from .config import settings
+
+# Created on first use so importing the app neither imports redis nor opens a connection.
+_client = None
+
+def get_redis():
+    global _client
+    if _client is None:
+        import redis.asyncio as aioredis
+        _client = aioredis.from_url(settings.REDIS_URL, decode_responses=True)
+    return _client
+
+async def close_redis() -> None:
+    global _client
+    if _client is not None:
+        await _client.aclose()
+        _client = None
@@ -0,0 +1,172 @@
+# app/core/resilience.py
+#
+# Degraded mode for database outages. A circuit breaker around the Motor client
+# (checked by the `get_db` dependency) turns a run of connection failures into
+# immediate DatabaseUnavailable errors instead of every request waiting out
+# server selection. While it is open, read endpoints that registered their
+# responses with `remember_response` answer with their last known good body,
+# flagged with `X-Degraded: stale`; a background ping probes for recovery.
+# Remembered bodies are per requester (token subject, or anonymous); routes drop
+# the ones that must not outlive a change with `forget_responses`.
+
+import asyncio
+import logging
+import math
+import time
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple
+
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import JSONResponse
+from pymongo.errors import ConnectionFailure
+from starlette.requests import Request
+from starlette.responses import Response
+
+from .compression import ResponseCache
+from .config import settings
+
+logger = logging.getLogger("api_logger")
+
+# AutoReconnect, NetworkTimeout, ServerSelectionTimeoutError and NotPrimaryError all derive from it.
+DATABASE_ERRORS = (ConnectionFailure,)
+
+DEGRADED_HEADER = "X-Degraded"
+STALE_CACHE_MAX_ENTRIES = 4096
+
+CLOSED, OPEN, HALF_OPEN = "closed", "open", "half_open"
+
+
+class DatabaseUnavailable(Exception):
+    """Raised instead of touching the database while the circuit breaker is open."""
+
+
+class CircuitBreaker:
+    """
+    Opens after BREAKER_FAILURE_THRESHOLD consecutive connection failures. After
+    BREAKER_OPEN_SECONDS the next request moves it to half-open and starts a single
+    `ping` probe in the background: success closes it (and runs the recovery
+    callbacks), failure opens it again. Requests never act as probes.
+    """
+
+    def __init__(self):
+        self.state = CLOSED
+        self.failures = 0
+        self.opened_until = 0.0
+        self._probe_task: Optional[asyncio.Task] = None
+        self._recovery_callbacks: List[Callable[[], Awaitable[None]]] = []
+
+    def on_recovery(self, callback: Callable[[], Awaitable[None]]) -> None:
+        self._recovery_callbacks.append(callback)
+
+    @property
+    def retry_after(self) -> int:
+        return max(1, math.ceil(self.opened_until - time.monotonic()))
+
+    def check(self) -> None:
+        if self.state == CLOSED or not settings.BREAKER_ENABLED:
+            return
+        if self.state == OPEN and time.monotonic() >= self.opened_until:
+            self.state = HALF_OPEN
+            self._probe_task = asyncio.create_task(self._probe())
+        raise DatabaseUnavailable()
+
+    def record_success(self) -> None:
+        if self.state == CLOSED:
+            self.failures = 0
+
+    def record_failure(self) -> None:
+        if self.state != CLOSED or not settings.BREAKER_ENABLED:
+            return
+        self.failures += 1
+        if self.failures >= settings.BREAKER_FAILURE_THRESHOLD:
+            self._open()
+            logger.warning(f"Database circuit breaker opened after {self.failures} consecutive connection failures.")
+
+    def _open(self) -> None:
+        self.state = OPEN
+        self.opened_until = time.monotonic() + settings.BREAKER_OPEN_SECONDS
+
+    async def _probe(self) -> None:
+        from ..db import get_database
+
+        try:
+            await asyncio.wait_for(get_database().command("ping"), settings.BREAKER_PROBE_TIMEOUT_SECONDS)
+        except Exception:
+            self._open()
+            return
+        self.state = CLOSED
+        self.failures = 0
+        logger.info("Database circuit breaker closed: probe succeeded.")
+        for callback in self._recovery_callbacks:
+            try:
+                await callback()
+            except Exception:
+                logger.exception("Database recovery callback failed.")
+
+    async def stop(self) -> None:
+        if self._probe_task is not None and not self._probe_task.done():
+            self._probe_task.cancel()
+            await asyncio.gather(self._probe_task, return_exceptions=True)
+
+
+db_breaker = CircuitBreaker()
+
+# Last known good bodies of read endpoints, keyed by requester, path and query string.
+last_known_good = ResponseCache(max_entries=STALE_CACHE_MAX_ENTRIES)
+
+# (method, path template) -> handler answering a request without the database, or None to give up.
+DegradedHandler = Callable[[Request], Awaitable[Optional[Response]]]
+degraded_handlers: Dict[Tuple[str, str], DegradedHandler] = {}
+
+
+def _stale_key(request: Request) -> Tuple[str, str, str]:
+    # A body is only ever served back to the requester it was rendered for.
+    subject = request.scope.get("state", {}).get("user_id", "anonymous")
+    return subject, request.url.path, request.url.query
+
+
+def remember_body(request: Request, body: bytes, media_type: str) -> None:
+    last_known_good.put(_stale_key(request), body, media_type, settings.STALE_MAX_AGE_SECONDS)
+
+
+def remember_response(request: Request, content: Any) -> Response:
+    """Renders `content` as JSON and keeps it as the fallback for this URL."""
+    rendered = JSONResponse(jsonable_encoder(content))
+    remember_body(request, rendered.body, rendered.media_type)
+    return rendered
+
+
+def forget_responses(path: str) -> int:
+    """Drops the remembered bodies of `path` and the paths below it, for every requester."""
+    path = path.lower()
+    return last_known_good.evict(lambda key: key[1].lower() == path or key[1].lower().startswith(path + "/"))
+
+
+def degraded_handler(method: str, path: str) -> Callable[[DegradedHandler], DegradedHandler]:
+    def register(handler: DegradedHandler) -> DegradedHandler:
+        degraded_handlers[(method, path)] = handler
+        return handler
+    return register
+
+
+async def database_unavailable_response(request: Request) -> Response:
+    """
+    Exception-handler body for DatabaseUnavailable and connection errors: a route's
+    degraded handler, else the last known good response, else a 503.
+    """
+    route = request.scope.get("route")
+    handler = degraded_handlers.get((request.method, getattr(route, "path", request.url.path)))
+    if handler is not None:
+        response = await handler(request)
+        if response is not None:
+            return response
+
+    if request.method in ("GET", "HEAD"):
+        entry = last_known_good.get(_stale_key(request))
+        if entry is not None:
+            return entry.to_response(request, headers={DEGRADED_HEADER: "stale", "Age": str(int(entry.age))})
+
+    return JSONResponse(
+        status_code=503,
+        content={"detail": "Database temporarily unavailable."},
+        headers={"Retry-After": str(db_breaker.retry_after)},
+    )
@@ -1,22 +1,70 @@
 # /daily-fortune-api/app/core/security.py
 
+import asyncio
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timedelta, timezone
-from typing import Optional
-from passlib.context import CryptContext
+from functools import lru_cache
+from typing import Callable, List, Optional, Tuple, TypeVar
 from jose import JWTError, jwt
 from fastapi import Depends, HTTPException, status
 from fastapi.security import OAuth2PasswordBearer
 from .config import settings
 from ..models.token import TokenData
 
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="/auth/login")
 
+# bcrypt cost of every hash the application creates, except bulk imports.
+BCRYPT_ROUNDS = 12
+
+@lru_cache(maxsize=None)
+def get_pwd_context():
+    # Deferred: importing passlib's bcrypt handler and loading the backend is only
+    # needed by the endpoints that actually hash or verify passwords.
+    from passlib.context import CryptContext
+    # Hashes below the normal cost (bulk imports, see hash_passwords) are flagged
+    # for an upgrade by verify_and_update_password.
+    return CryptContext(schemes=["bcrypt"], deprecated="auto", bcrypt__min_rounds=BCRYPT_ROUNDS)
+
 def verify_password(plain_password: str, hashed_password: str) -> bool:
-    return pwd_context.verify(plain_password, hashed_password)
+    return get_pwd_context().verify(plain_password, hashed_password)
+
+def verify_and_update_password(plain_password: str, hashed_password: str) -> Tuple[bool, Optional[str]]:
+    """(matches, replacement hash at the normal cost if the stored one is weaker)."""
+    return get_pwd_context().verify_and_update(plain_password, hashed_password)
 
 def get_password_hash(password: str) -> str:
-    return pwd_context.hash(password)
+    return get_pwd_context().hash(password)
+
+T = TypeVar("T")
+
+# Niceness of the password hashing threads. bcrypt releases the GIL, so the
+# threads compete with the event loop for the CPU only; at a lower priority a
+# burst of logins slows down the logins, not every other request on the loop.
+PASSWORD_HASHING_NICENESS = 10
+
+def _lower_thread_priority() -> None:
+    try:
+        os.setpriority(os.PRIO_PROCESS, threading.get_native_id(), PASSWORD_HASHING_NICENESS)
+    except (AttributeError, OSError):
+        pass  # Not supported on this platform: the threads keep the normal priority.
+
+_password_executor = ThreadPoolExecutor(
+    max_workers=os.cpu_count() or 1,
+    thread_name_prefix="password-hashing",
+    initializer=_lower_thread_priority
+)
+
+async def run_password_hashing(func: Callable[..., T], *args) -> T:
+    """Runs a bcrypt hash or verification off the event loop, on the low-priority pool."""
+    return await asyncio.get_running_loop().run_in_executor(_password_executor, func, *args)
+
+def hash_passwords(passwords: List[str], rounds: int = BCRYPT_ROUNDS) -> List[str]:
+    """Hashes a batch at the given cost. Module-level so process pools can run it."""
+    from passlib.hash import bcrypt
+    handler = bcrypt.using(rounds=rounds)
+    return [handler.hash(password) for password in passwords]
 
 # --- FIX: 修改函数签名以接受可选的 issued_at 参数 ---
 def create_access_token(
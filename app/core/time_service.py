@@ -1,65 +1,106 @@
 # app/core/time_service.py
 
 from datetime import datetime, time, timedelta, timezone
+from functools import lru_cache
+from typing import Dict, Optional
 import pytz
 from .config import settings
 
-def get_current_day_start_in_utc() -> datetime:
+@lru_cache(maxsize=None)
+def get_timezone(tz_name: Optional[str] = None) -> pytz.BaseTzInfo:
     """
-    Calculates the exact start datetime of the "current business day" in UTC.
-    This logic is based on the configured APP_TIMEZONE and DAY_RESET_OFFSET_SECONDS.
-    
-    The returned datetime is always timezone-aware and in UTC.
+    Resolves a timezone name (default: APP_TIMEZONE) to a cached pytz object.
+    Unknown names fall back to UTC.
     """
     try:
-        # Get the target timezone from settings
-        app_tz = pytz.timezone(settings.APP_TIMEZONE)
+        return pytz.timezone(tz_name or settings.APP_TIMEZONE)
     except pytz.UnknownTimeZoneError:
-        # Fallback to UTC if the timezone is invalid
-        app_tz = pytz.utc
-
-    # Get the current time in the target timezone
-    now_in_app_tz = datetime.now(app_tz)
-
-    # Apply the offset to determine the "logical" current time
-    logical_now = now_in_app_tz - timedelta(seconds=settings.DAY_RESET_OFFSET_SECONDS)
-    
-    # The start of the "logical day" is the date part of the logical time
-    logical_day_date = logical_now.date()
-    
-    # The start of the "logical day" in the app's timezone is at midnight of that date
-    day_start_naive = datetime.combine(logical_day_date, time.min)
-    
-    # Make it timezone-aware
+        return pytz.utc
+
+def is_valid_timezone(tz_name: str) -> bool:
+    return tz_name in pytz.all_timezones_set
+
+def _day_start_for(app_tz: pytz.BaseTzInfo, at_utc: datetime) -> datetime:
+    """
+    Calculates the exact start datetime (in UTC) of the business day containing `at_utc`
+    in `app_tz`, honouring DAY_RESET_OFFSET_SECONDS.
+    """
+    # Apply the offset to determine the "logical" time in the target timezone
+    logical_now = at_utc.astimezone(app_tz) - timedelta(seconds=settings.DAY_RESET_OFFSET_SECONDS)
+
+    # The start of the "logical day" in the timezone is at midnight of that date
+    day_start_naive = datetime.combine(logical_now.date(), time.min)
     day_start_in_app_tz = app_tz.localize(day_start_naive)
-    
+
     # Now, add the offset back to get the actual reset time
     actual_day_reset_time_in_app_tz = day_start_in_app_tz + timedelta(seconds=settings.DAY_RESET_OFFSET_SECONDS)
 
     # Finally, convert this start time back to UTC for database storage and comparison
-    day_start_utc = actual_day_reset_time_in_app_tz.astimezone(pytz.utc)
+    return actual_day_reset_time_in_app_tz.astimezone(pytz.utc)
 
-    return day_start_utc
+class DayWindow:
+    """The `[start, next)` UTC window of one business day in one timezone, plus its day key."""
 
-def get_next_day_start_in_utc() -> datetime:
+    __slots__ = ("tz_name", "start", "next", "key")
+
+    def __init__(self, tz_name: str, start: datetime, next: datetime, key: str):
+        self.tz_name = tz_name
+        self.start = start
+        self.next = next
+        self.key = key
+
+    def contains(self, at_utc: datetime) -> bool:
+        return self.start <= at_utc < self.next
+
+# One window per zone, shared by every user in that zone. Recomputed only when the day rolls over.
+_day_windows: Dict[str, DayWindow] = {}
+
+def compute_day_window(tz_name: Optional[str], at_utc: datetime) -> DayWindow:
+    """Computes (uncached) the business-day window of `tz_name` that contains `at_utc`."""
+    app_tz = get_timezone(tz_name)
+    start = _day_start_for(app_tz, at_utc)
+    # We add 25 hours and then find the start of that day to safely handle DST changes.
+    next_start = _day_start_for(app_tz, start + timedelta(hours=25))
+    key = (start.astimezone(app_tz) - timedelta(seconds=settings.DAY_RESET_OFFSET_SECONDS)).date().isoformat()
+    return DayWindow(app_tz.zone, start, next_start, key)
+
+def get_day_window(tz_name: Optional[str] = None) -> DayWindow:
+    """
+    Returns the current business-day window for `tz_name` (default: APP_TIMEZONE).
+    O(1) per call: the pytz work only happens once per zone per day.
+    """
+    now = datetime.now(timezone.utc)
+    zone = get_timezone(tz_name).zone
+    window = _day_windows.get(zone)
+    if window is None or not window.contains(now):
+        window = compute_day_window(zone, now)
+        _day_windows[zone] = window
+    return window
+
+def get_current_day_start_in_utc(tz_name: Optional[str] = None) -> datetime:
+    """
+    Calculates the exact start datetime of the "current business day" in UTC.
+    This logic is based on the timezone (default: APP_TIMEZONE) and DAY_RESET_OFFSET_SECONDS.
+
+    The returned datetime is always timezone-aware and in UTC.
+    """
+    return get_day_window(tz_name).start
+
+def get_next_day_start_in_utc(tz_name: Optional[str] = None) -> datetime:
     """
     Calculates the start of the *next* business day in UTC.
     This is effectively the time when the next draw becomes available.
     """
-    current_day_start = get_current_day_start_in_utc()
-    # We add 25 hours and then find the start of that day to safely handle DST changes.
-    day_after = current_day_start + timedelta(hours=25)
-    
-    try:
-        app_tz = pytz.timezone(settings.APP_TIMEZONE)
-    except pytz.UnknownTimeZoneError:
-        app_tz = pytz.utc
+    return get_day_window(tz_name).next
 
-    day_after_in_app_tz = day_after.astimezone(app_tz)
-    logical_day_after = day_after_in_app_tz - timedelta(seconds=settings.DAY_RESET_OFFSET_SECONDS)
-    logical_day_date = logical_day_after.date()
-    day_start_naive = datetime.combine(logical_day_date, time.min)
-    day_start_in_app_tz = app_tz.localize(day_start_naive)
-    actual_day_reset_time_in_app_tz = day_start_in_app_tz + timedelta(seconds=settings.DAY_RESET_OFFSET_SECONDS)
-    
-    return actual_day_reset_time_in_app_tz.astimezone(pytz.utc)
\ No newline at end of file
+def get_business_day_key(dt: datetime, tz_name: Optional[str] = None) -> str:
+    """
+    Returns the business-day key ("YYYY-MM-DD") that a UTC datetime falls into
+    in `tz_name` (default: APP_TIMEZONE).
+    This is the value stored in the `date` field of fortune documents.
+    """
+    if dt.tzinfo is None:
+        dt = dt.replace(tzinfo=timezone.utc)
+
+    logical_dt = dt.astimezone(get_timezone(tz_name)) - timedelta(seconds=settings.DAY_RESET_OFFSET_SECONDS)
+    return logical_dt.date().isoformat()
@@ -1,13 +1,53 @@
+from typing import AsyncIterator, Optional
 from motor.motor_asyncio import AsyncIOMotorClient, AsyncIOMotorDatabase
 from .core.config import settings
+from .core.resilience import DATABASE_ERRORS, db_breaker
 
-# --- THIS IS THE FIX ---
-# Add tz_aware=True to the client constructor.
-# This ensures all dates read from MongoDB are timezone-aware (UTC).
-client = AsyncIOMotorClient(settings.DATABASE_URL, tz_aware=True)
-# --- END OF FIX ---
+# The client is created on first use rather than at import time: constructing it
+# starts pymongo's background monitoring, which must not happen before uvicorn/gunicorn
+# has forked its workers and only slows down cold start.
+_client: Optional[AsyncIOMotorClient] = None
+_database: Optional[AsyncIOMotorDatabase] = None
 
-db: AsyncIOMotorDatabase = client[settings.DATABASE_NAME]
+def get_client() -> AsyncIOMotorClient:
+    global _client
+    if _client is None:
+        # tz_aware=True ensures all dates read from MongoDB are timezone-aware (UTC).
+        _client = AsyncIOMotorClient(
+            settings.DATABASE_URL,
+            tz_aware=True,
+            serverSelectionTimeoutMS=settings.DATABASE_SERVER_SELECTION_TIMEOUT_MS,
+        )
+    return _client
 
-async def get_db() -> AsyncIOMotorDatabase:
-    return db
\ No newline at end of file
+def get_database() -> AsyncIOMotorDatabase:
+    global _database
+    if _database is None:
+        _database = get_client()[settings.DATABASE_NAME]
+    return _database
+
+def set_client(client: AsyncIOMotorClient) -> None:
+    """Installs an already constructed client (e.g. mongomock-motor in benchmarks)."""
+    global _client, _database
+    _client = client
+    _database = None
+
+def close_client() -> None:
+    global _client, _database
+    if _client is not None:
+        _client.close()
+    _client = None
+    _database = None
+
+async def get_db() -> AsyncIterator[AsyncIOMotorDatabase]:
+    """
+    The database for a request. Fails fast with DatabaseUnavailable while the circuit
+    breaker is open, and reports connection failures of the request back to it.
+    """
+    db_breaker.check()
+    try:
+        yield get_database()
+    except DATABASE_ERRORS:
+        db_breaker.record_failure()
+        raise
+    db_breaker.record_success()
\ No newline at end of file
@@ -2,7 +2,7 @@
 
 from pydantic import BaseModel
 from datetime import date, datetime
-from typing import List
+from typing import List, Optional
 
 class FortuneHistoryItem(BaseModel):
     created_at: datetime
@@ -11,6 +11,8 @@ class FortuneHistoryItem(BaseModel):
 class LeaderboardUser(BaseModel):
     username: str
     display_name: str
+    # "Luckier than X% of users"; None until the luck histogram has been built.
+    luck_percentile: Optional[float] = None
 
 class LeaderboardGroup(BaseModel):
     fortune: str
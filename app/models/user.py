@@ -4,6 +4,7 @@ from pydantic import BaseModel, EmailStr, Field, field_validator
 from typing import Optional, List
 from datetime import datetime
 import re
+import pytz
 
 class UserBase(BaseModel):
     username: str = Field(..., min_length=2, max_length=50)
@@ -39,6 +40,12 @@ class UserInDB(UserBase):
     use_qq_avatar: bool = False
     # --- FIX: 增加密码修改时间戳字段 ---
     password_changed_at: Optional[datetime] = None
+    # Business-day key ("YYYY-MM-DD") of the user's latest draw, set by POST /fortune/draw.
+    last_draw_date: Optional[str] = None
+    # When that draw was made (UTC); a timezone change cannot reopen its day window.
+    last_draw_at: Optional[datetime] = None
+    # Streak / luckiest-month state maintained by app/services/achievements.py.
+    achievements: Optional[dict] = None
 
 class UserPublicProfile(BaseModel):
     username: str
@@ -51,6 +58,12 @@ class UserPublicProfile(BaseModel):
     total_draws: int
     has_drawn_today: bool
     todays_fortune: Optional[str] = None
+    current_streak: int = 0
+    longest_streak: int = 0
+    luckiest_month: Optional[str] = None
+    # Mean fortune rank (1-7) and the share of users with a lower one, in percent.
+    luck_score: Optional[float] = None
+    luck_percentile: Optional[float] = None
     status: str
     is_hidden: bool
     tags: List[str]
@@ -76,6 +89,22 @@ class UserUpdate(BaseModel):
     qq: Optional[int] = Field(None, ge=10000, le=9999999999)
     use_qq_avatar: Optional[bool] = None
 
+    @field_validator('timezone')
+    @classmethod
+    def timezone_known(cls, value: Optional[str]) -> Optional[str]:
+        if value is not None and value not in pytz.all_timezones_set:
+            raise ValueError('Unknown timezone.')
+        return value
+
+class LuckRanking(BaseModel):
+    username: str
+    display_name: str
+    draws: int
+    luck_score: Optional[float] = None
+    luck_percentile: Optional[float] = None
+    # Users in the histogram the percentile was taken from.
+    ranked_users: int = 0
+
 # --- NEW MODEL ---
 class PasswordUpdate(BaseModel):
     current_password: str
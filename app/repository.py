@@ -0,0 +1,182 @@
+# app/repository.py
+#
+# Projection-specific reads of `users` and `fortunes`. Each view fetches only the
+# fields its callers use, so hot paths (authorization on every request, profile
+# lookups, single-field checks) neither transfer nor decode bios, URLs and password
+# hashes they never look at:
+#
+#     auth view     AuthUser (__slots__)   get_current_user, the draw path
+#     public view   PublicUserDoc          GET /users/u/{username}
+#     profile view  ProfileUserDoc         /users/me, login, admin listings (no password_hash)
+#     single fields dict                   login (hash), token refresh, QQ status, history, luck
+#
+# Views are plain records: the documents were validated when written, so there is
+# no pydantic model per read. Lookups by username and by (user_id, date) are served
+# by the unique indexes created by migrations 1 and 3; they pass no index hint, so
+# they still work (slowly) on a database those migrations have not reached.
+
+from datetime import datetime, timezone
+from typing import List, Optional, TypedDict
+
+from bson import ObjectId
+from motor.motor_asyncio import AsyncIOMotorDatabase
+from pymongo import ReturnDocument
+
+from .core.config import settings
+
+USERNAME_INDEX = "username_unique"
+
+
+# --- Users ---
+
+class AuthUser:
+    """What authorization and the draw path need to know about the requester."""
+
+    __slots__ = (
+        "id", "username", "display_name", "role", "status", "timezone",
+        "password_changed_at", "last_draw_date", "last_draw_at", "achievements",
+    )
+
+    def __init__(self, doc: dict):
+        self.id = str(doc["_id"])
+        self.username = doc["username"]
+        self.display_name = doc["display_name"]
+        self.role = doc.get("role", "user")
+        self.status = doc.get("status", "active")
+        self.timezone = doc["timezone"]
+        self.password_changed_at: Optional[datetime] = doc.get("password_changed_at")
+        self.last_draw_date: Optional[str] = doc.get("last_draw_date")
+        self.last_draw_at: Optional[datetime] = doc.get("last_draw_at")
+        self.achievements: Optional[dict] = doc.get("achievements")
+
+
+AUTH_PROJECTION = {field: 1 for field in AuthUser.__slots__ if field != "id"}
+
+
+class PublicUserDoc(TypedDict, total=False):
+    _id: ObjectId
+    username: str
+    display_name: str
+    status: str
+    is_hidden: bool
+    tags: List[str]
+    bio: str
+    avatar_url: str
+    background_url: str
+    registration_date: datetime
+    last_active_date: datetime
+    qq: Optional[int]
+    use_qq_avatar: bool
+    timezone: str
+    last_draw_date: Optional[str]
+    last_draw_at: Optional[datetime]
+    achievements: Optional[dict]
+
+
+PUBLIC_PROJECTION = {field: 1 for field in PublicUserDoc.__annotations__ if field != "_id"}
+
+
+class ProfileUserDoc(PublicUserDoc, total=False):
+    email: str
+    role: str
+    language: str
+    password_changed_at: Optional[datetime]
+
+
+# Everything but the hash; also what admin listings use (see app/services/user_search.py).
+PROFILE_PROJECTION = {"password_hash": 0}
+
+# Unique index on users -> the field it guards, for reporting DuplicateKeyErrors.
+USER_UNIQUE_INDEXES = {
+    USERNAME_INDEX: "username",
+    "email_unique": "email",
+    "display_name_unique": "display_name",
+}
+
+
+def duplicate_user_field(error: dict) -> Optional[str]:
+    """The field a DuplicateKeyError (or a bulk write error entry) on users is about."""
+    message = error.get("errmsg", "")
+    for index, field in USER_UNIQUE_INDEXES.items():
+        if index in message:
+            return field
+    return None
+
+
+def new_user_doc(username: str, email: str, password_hash: str, now: datetime) -> dict:
+    """
+    A new account as registration (and the admin bulk import) creates it. `now`
+    should be truncated to whole seconds, the precision of a JWT's `iat`, or a
+    token issued in the same second would be older than password_changed_at.
+    """
+    return {
+        "username": username.lower(),
+        "display_name": username,
+        "email": email.lower(),
+        "password_hash": password_hash,
+        "role": "user",
+        "status": "active",
+        "bio": "",
+        "avatar_url": "",
+        "background_url": "",
+        "language": "zh",
+        "registration_date": now,
+        "last_active_date": now,
+        "password_changed_at": now,
+        "is_hidden": False,
+        "tags": [],
+        "timezone": settings.USER_DEFAULT_TIMEZONE,
+        "qq": None,
+        "use_qq_avatar": False
+    }
+
+
+async def find_auth_user(db: AsyncIOMotorDatabase, user_id: ObjectId) -> Optional[AuthUser]:
+    doc = await db.users.find_one({"_id": user_id}, AUTH_PROJECTION)
+    return AuthUser(doc) if doc else None
+
+
+async def find_public_user(db: AsyncIOMotorDatabase, username: str) -> Optional[PublicUserDoc]:
+    return await db.users.find_one({"username": username.lower()}, PUBLIC_PROJECTION)
+
+
+async def find_user_fields(db: AsyncIOMotorDatabase, username: str, *fields: str) -> Optional[dict]:
+    """Just `fields` (plus _id) of the user with this username."""
+    return await db.users.find_one({"username": username.lower()}, dict.fromkeys(fields, 1))
+
+
+async def find_profile_user(db: AsyncIOMotorDatabase, user_id: ObjectId) -> Optional[ProfileUserDoc]:
+    return await db.users.find_one({"_id": user_id}, PROFILE_PROJECTION)
+
+
+async def update_profile_user(db: AsyncIOMotorDatabase, user_id: ObjectId, fields: dict) -> Optional[ProfileUserDoc]:
+    """Sets `fields` and returns the updated profile view, in one round trip."""
+    return await db.users.find_one_and_update(
+        {"_id": user_id},
+        {"$set": fields},
+        projection=PROFILE_PROJECTION,
+        return_document=ReturnDocument.AFTER,
+    )
+
+
+async def touch_profile_user(db: AsyncIOMotorDatabase, user_id: ObjectId) -> Optional[ProfileUserDoc]:
+    """Sets last_active_date to now and returns the profile view."""
+    return await update_profile_user(db, user_id, {"last_active_date": datetime.now(timezone.utc)})
+
+
+async def find_token_claims(db: AsyncIOMotorDatabase, user_id: ObjectId) -> Optional[dict]:
+    """status and role of the user: what re-issuing its tokens has to check."""
+    return await db.users.find_one({"_id": user_id}, {"_id": 0, "status": 1, "role": 1})
+
+
+async def find_password_hash(db: AsyncIOMotorDatabase, user_id: ObjectId) -> Optional[str]:
+    doc = await db.users.find_one({"_id": user_id}, {"_id": 0, "password_hash": 1})
+    return doc.get("password_hash") if doc else None
+
+
+# --- Fortunes ---
+
+async def find_fortune_value(db: AsyncIOMotorDatabase, user_id: ObjectId, day_key: str) -> Optional[str]:
+    """The fortune of one business day: a point lookup on user_date_unique."""
+    doc = await db.fortunes.find_one({"user_id": user_id, "date": day_key}, {"_id": 0, "value": 1})
+    return doc["value"] if doc else None
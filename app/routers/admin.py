@@ -1,16 +1,26 @@
 # app/routers/admin.py
 
-from fastapi import APIRouter, Depends, HTTPException, status
+from fastapi import APIRouter, Depends, HTTPException, Query, Request, Response, status
 from motor.motor_asyncio import AsyncIOMotorDatabase
-from typing import List
-from datetime import datetime, time, timezone, timedelta
+import asyncio
+import io
+from typing import List, Optional
+from datetime import datetime
 from pydantic import BaseModel
 from bson import ObjectId
 
 from ..db import get_db
-from ..models.user import UserInDB, UserMeProfile
+from ..models.user import UserMeProfile
+from ..repository import AuthUser
 from .dependencies import get_current_user
-from ..core.time_service import get_current_day_start_in_utc
+from ..services.fortune_service import find_todays_fortune_value
+from ..services.fortune_history import count_user_fortunes
+from ..services.user_search import build_user_query, search_users
+from ..services.achievements import achievements_view
+from ..services.luck import luck_histogram
+from ..services.user_import import import_users, read_rows, shared_hash_pool
+from ..core.config import settings
+from ..core.resilience import forget_responses
 
 router = APIRouter(prefix="/admin", tags=["Administration"])
 
@@ -24,7 +34,7 @@ class TagsUpdate(BaseModel):
     tags: List[str]
 
 # Dependency to check for admin role
-async def get_current_admin_user(current_user: UserInDB = Depends(get_current_user)) -> UserInDB:
+async def get_current_admin_user(current_user: AuthUser = Depends(get_current_user)) -> AuthUser:
     if current_user.role != "admin":
         raise HTTPException(
             status_code=status.HTTP_403_FORBIDDEN,
@@ -34,81 +44,132 @@ async def get_current_admin_user(current_user: UserInDB = Depends(get_current_us
 
 @router.get("/users", response_model=List[UserMeProfile])
 async def read_all_users(
-    admin_user: UserInDB = Depends(get_current_admin_user),
+    response: Response,
+    q: Optional[str] = Query(None, min_length=1, max_length=50, description="Username or display name prefix (case-insensitive)."),
+    status_filter: Optional[str] = Query(None, alias="status", pattern="^(active|inactive)$"),
+    role: Optional[str] = Query(None, pattern="^(user|admin)$"),
+    is_hidden: Optional[bool] = None,
+    tags: List[str] = Query([], description="Users carrying all of these tags."),
+    registered_from: Optional[datetime] = None,
+    registered_to: Optional[datetime] = None,
+    active_from: Optional[datetime] = None,
+    active_to: Optional[datetime] = None,
+    sort: str = Query("registration_date", pattern="^(registration_date|last_active_date|username)$"),
+    order: str = Query("desc", pattern="^(asc|desc)$"),
+    limit: int = Query(50, ge=1, le=200),
+    cursor: Optional[str] = None,
+    admin_user: AuthUser = Depends(get_current_admin_user),
     db: AsyncIOMotorDatabase = Depends(get_db)
 ):
     """
-    Get a list of all users. Requires admin privileges.
+    Search users. Requires admin privileges.
+    Results are keyset-paginated: pass the `X-Next-Cursor` response header back as
+    `cursor` (with the same filters and sort) to get the next page; it is absent on
+    the last page.
     """
-    users_cursor = db.users.find()
-    users = await users_cursor.to_list(length=None)
-    
-    user_profiles = []
-    today_start_utc = get_current_day_start_in_utc()
-    tomorrow_start_utc = today_start_utc + timedelta(days=1)
-    
-    for user in users:
-        user_id_obj = user["_id"]
-        total_draws = await db.fortunes.count_documents({"user_id": user_id_obj})
-
-        todays_fortune_doc = await db.fortunes.find_one({
-            "user_id": user_id_obj,
-            "created_at": {
-                "$gte": today_start_utc,
-                "$lt": tomorrow_start_utc
-            }
-        })
+    query = build_user_query(
+        q=q, status=status_filter, role=role, is_hidden=is_hidden, tags=tags,
+        registered_from=registered_from, registered_to=registered_to,
+        active_from=active_from, active_to=active_to
+    )
+    try:
+        users, next_cursor = await search_users(db, query, sort=sort, descending=order == "desc", limit=limit, cursor=cursor)
+    except ValueError as e:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(e))
+    if next_cursor:
+        response.headers["X-Next-Cursor"] = next_cursor
 
-        has_drawn_today = todays_fortune_doc is not None
-        todays_fortune_value = todays_fortune_doc.get("value") if todays_fortune_doc else None
+    distribution = await luck_histogram.get(db)
 
-        user_profile_data = {
+    async def profile(user: dict) -> UserMeProfile:
+        user_id_obj = user["_id"]
+        total_draws, todays_fortune_value = await asyncio.gather(
+            count_user_fortunes(db, user_id_obj),
+            find_todays_fortune_value(
+                db, user_id_obj, user.get("timezone"), user.get("last_draw_date"), user.get("last_draw_at")
+            )
+        )
+        return UserMeProfile(**{
             **user,
             "id": str(user_id_obj),
             "total_draws": total_draws,
-            "has_drawn_today": has_drawn_today,
+            "has_drawn_today": todays_fortune_value is not None,
             "todays_fortune": todays_fortune_value,
             "is_hidden": user.get("is_hidden", False),
-            "tags": user.get("tags", [])
-        }
-        user_profiles.append(UserMeProfile(**user_profile_data))
-        
-    return user_profiles
+            "tags": user.get("tags", []),
+            **achievements_view(user.get("achievements"), user.get("timezone"), distribution)
+        })
+
+    return await asyncio.gather(*(profile(user) for user in users))
+
+@router.post("/users/import")
+async def import_users_in_bulk(
+    request: Request,
+    format: str = Query("csv", pattern="^(csv|ndjson)$"),
+    admin_user: AuthUser = Depends(get_current_admin_user),
+    db: AsyncIOMotorDatabase = Depends(get_db)
+):
+    """
+    Creates accounts from the request body: CSV with a `username,email,password`
+    header, or NDJSON objects with those fields. Invalid rows and rows that collide
+    with existing accounts (or earlier rows) are reported and skipped; the others
+    are imported. Registration being closed does not apply.
+    """
+    body = bytearray()
+    async for chunk in request.stream():
+        body += chunk
+        if len(body) > settings.USER_IMPORT_MAX_BYTES:
+            raise HTTPException(
+                status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
+                detail="Import too large; use `python -m app.cli users import`."
+            )
+    try:
+        text = body.decode("utf-8-sig")
+    except UnicodeDecodeError:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="The import must be UTF-8 encoded.")
+    return await import_users(db, read_rows(io.StringIO(text, newline=""), format), pool=shared_hash_pool.get())
 
 @router.post("/users/{user_id}/status", status_code=status.HTTP_204_NO_CONTENT)
 async def update_user_status(
     user_id: str,
     status_update: StatusUpdate,
-    admin_user: UserInDB = Depends(get_current_admin_user),
+    admin_user: AuthUser = Depends(get_current_admin_user),
     db: AsyncIOMotorDatabase = Depends(get_db)
 ):
     if status_update.status not in ["active", "inactive"]:
         raise HTTPException(status_code=400, detail="Invalid status value")
     
-    await db.users.update_one(
+    user_doc = await db.users.find_one_and_update(
         {"_id": ObjectId(user_id)},
-        {"$set": {"status": status_update.status}}
+        {"$set": {"status": status_update.status}},
+        projection={"_id": 0, "username": 1}
     )
+    if user_doc:
+        # Outage fallbacks must not keep serving the profile as it was.
+        forget_responses(f"/users/u/{user_doc['username']}")
     return
 
 @router.post("/users/{user_id}/visibility", status_code=status.HTTP_204_NO_CONTENT)
 async def update_user_visibility(
     user_id: str,
     visibility_update: VisibilityUpdate,
-    admin_user: UserInDB = Depends(get_current_admin_user),
+    admin_user: AuthUser = Depends(get_current_admin_user),
     db: AsyncIOMotorDatabase = Depends(get_db)
 ):
-    await db.users.update_one(
+    user_doc = await db.users.find_one_and_update(
         {"_id": ObjectId(user_id)},
-        {"$set": {"is_hidden": visibility_update.is_hidden}}
+        {"$set": {"is_hidden": visibility_update.is_hidden}},
+        projection={"_id": 0, "username": 1}
     )
+    if user_doc:
+        forget_responses(f"/users/u/{user_doc['username']}")
     return
 
 @router.post("/users/{user_id}/tags", status_code=status.HTTP_204_NO_CONTENT)
 async def update_user_tags(
     user_id: str,
     tags_update: TagsUpdate,
-    admin_user: UserInDB = Depends(get_current_admin_user),
+    admin_user: AuthUser = Depends(get_current_admin_user),
     db: AsyncIOMotorDatabase = Depends(get_db)
 ):
     await db.users.update_one(
@@ -1,24 +1,55 @@
 # /daily-fortune-api/app/routers/auth.py
 
-from fastapi import APIRouter, Depends, HTTPException, status, Request, Response
+from fastapi import APIRouter, Depends, HTTPException, status, Request, Response, Query
 from fastapi.responses import JSONResponse
 from fastapi.security import OAuth2PasswordRequestForm
 from motor.motor_asyncio import AsyncIOMotorDatabase
 from pymongo.errors import DuplicateKeyError
-from datetime import datetime, timezone, timedelta
+from bson import ObjectId
+from datetime import datetime, timezone
+from typing import Optional
+from pydantic import EmailStr
 
-from ..core.security import create_access_token, create_refresh_token, get_password_hash, verify_password
+from ..core.security import create_access_token, get_password_hash, run_password_hashing, verify_and_update_password
 from ..db import get_db
 from ..models.user import UserCreate, UserMeProfile, UserInDB
 from ..models.token import Token, RefreshTokenInput
 from ..core.rate_limiter import limiter_decorator
-from ..core.time_service import get_current_day_start_in_utc
-from ..core.config import settings
-from jose import jwt, JWTError
-from bson import ObjectId
+from ..services.fortune_service import find_todays_fortune_value
+from ..services.fortune_history import count_user_fortunes
+from ..services.availability import find_taken, taken_names
+from ..services.achievements import achievements_view
+from ..services.luck import luck_histogram
+from ..repository import duplicate_user_field, find_token_claims, find_user_fields, new_user_doc, touch_profile_user
+from ..services.refresh_tokens import (
+    RefreshTokenError, issue_refresh_token, revoke_refresh_token, rotate_refresh_token, set_refresh_cookie
+)
 
 router = APIRouter(prefix="/auth", tags=["Authentication"])
 
+@router.get("/availability")
+@limiter_decorator("60/minute")
+async def check_availability(
+    request: Request,
+    username: Optional[str] = Query(None, min_length=2, max_length=50, pattern=r"^[a-zA-Z0-9_]+$"),
+    email: Optional[EmailStr] = Query(None),
+    db: AsyncIOMotorDatabase = Depends(get_db)
+):
+    """
+    Live validation for the registration form. Advisory only: registration
+    itself re-checks and the unique indexes have the final say.
+    """
+    if username is None and email is None:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Provide a username or email to check.")
+
+    taken = await find_taken(db, username=username, email=email)
+    result = {}
+    if username is not None:
+        result["username"] = {"value": username, "available": not ({"username", "display_name"} & taken)}
+    if email is not None:
+        result["email"] = {"value": email, "available": "email" not in taken}
+    return result
+
 @router.post("/register", status_code=status.HTTP_201_CREATED)
 @limiter_decorator("5/minute")
 async def register_user(request: Request, response: Response, user: UserCreate, db: AsyncIOMotorDatabase = Depends(get_db)):
@@ -26,7 +57,17 @@ async def register_user(request: Request, response: Response, user: UserCreate,
     if not config or not config.get("value", False):
         raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Registration is currently closed.")
 
-    hashed_password = get_password_hash(user.password)
+    # Reject known conflicts before paying for bcrypt.
+    taken = await find_taken(db, username=user.username, email=user.email)
+    if "username" in taken:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="UserID already exists.")
+    if "email" in taken:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Email already exists.")
+    if "display_name" in taken:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Display name already exists.")
+
+    # bcrypt releases the GIL: on the hashing pool it neither blocks the loop nor other requests.
+    hashed_password = await run_password_hashing(get_password_hash, user.password)
     
     # --- FINAL FIX for Registration Race Condition ---
     # We truncate the microseconds to match the precision of JWT's `iat` claim.
@@ -34,46 +75,29 @@ async def register_user(request: Request, response: Response, user: UserCreate,
     # in the same second as registration.
     now_utc_truncated = datetime.now(timezone.utc).replace(microsecond=0)
     
-    user_doc = {
-        "username": user.username.lower(),
-        "display_name": user.username,
-        "email": user.email.lower(),
-        "password_hash": hashed_password,
-        "role": "user",
-        "status": "active",
-        "bio": "",
-        "avatar_url": "",
-        "background_url": "",
-        "language": "zh",
-        "registration_date": now_utc_truncated,
-        "last_active_date": now_utc_truncated,
-        "password_changed_at": now_utc_truncated, # Use the truncated timestamp
-        "is_hidden": False,
-        "tags": [],
-        "timezone": settings.USER_DEFAULT_TIMEZONE,
-        "qq": None,
-        "use_qq_avatar": False
-    }
+    user_doc = new_user_doc(user.username, user.email, hashed_password, now_utc_truncated)
+    # Still handled: another request may claim the name between the check and the insert.
     try:
         result = await db.users.insert_one(user_doc)
         new_user_id = result.inserted_id
     except DuplicateKeyError as e:
-        if 'username_unique' in e.details['errmsg']:
+        field = duplicate_user_field(e.details)
+        if field == "username":
             raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="UserID already exists.")
-        if 'email_unique' in e.details['errmsg']:
+        if field == "email":
             raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Email already exists.")
-        if 'display_name_unique' in e.details['errmsg']:
+        if field == "display_name":
             raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Display name already exists.")
         raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="A registration conflict occurred.")
-    
-    created_user_doc = await db.users.find_one({"_id": new_user_id})
+    taken_names.add(user_doc["username"], user_doc["display_name"])
+
     # The token generated here is for immediate use after registration.
     # The subsequent login will generate its own token.
-    access_token = create_access_token(data={"sub": str(new_user_id)})
-    refresh_token = create_refresh_token(data={"sub": str(new_user_id)})
+    access_token = create_access_token(data={"sub": str(new_user_id), "role": user_doc["role"]})
+    refresh_token = await issue_refresh_token(str(new_user_id), user_doc["role"])
     
-    created_user_doc['_id'] = str(created_user_doc['_id'])
-    user_in_db = UserInDB(**created_user_doc)
+    # The response is built from the document we just inserted; no need to read it back.
+    user_in_db = UserInDB(**{**user_doc, "_id": str(new_user_id)})
 
     user_profile = UserMeProfile(
         **user_in_db.model_dump(),
@@ -82,14 +106,7 @@ async def register_user(request: Request, response: Response, user: UserCreate,
         todays_fortune=None
     )
 
-    response.set_cookie(
-        key="refresh_token",
-        value=refresh_token,
-        httponly=True,
-        secure=False, # Set to True in production with HTTPS
-        samesite="lax",
-        max_age=settings.REFRESH_TOKEN_EXPIRE_DAYS * 24 * 60 * 60
-    )
+    set_refresh_cookie(response, refresh_token)
 
     return {
         "access_token": access_token,
@@ -101,56 +118,43 @@ async def register_user(request: Request, response: Response, user: UserCreate,
 @router.post("/login")
 @limiter_decorator("10/minute")
 async def login_for_access_token(request: Request, response: Response, form_data: OAuth2PasswordRequestForm = Depends(), db: AsyncIOMotorDatabase = Depends(get_db)):
-    user_doc = await db.users.find_one({"username": form_data.username.lower()})
-    if not user_doc or not verify_password(form_data.password, user_doc["password_hash"]):
+    credentials = await find_user_fields(db, form_data.username, "password_hash")
+    verified, upgraded_hash = (
+        await run_password_hashing(verify_and_update_password, form_data.password, credentials["password_hash"])
+        if credentials else (False, None)
+    )
+    if not verified:
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail="Incorrect username or password",
             headers={"WWW-Authenticate": "Bearer"},
         )
     
-    user_id_obj = user_doc["_id"]
-    await db.users.update_one({"_id": user_id_obj}, {"$set": {"last_active_date": datetime.now(timezone.utc)}})
-    
-    user_doc = await db.users.find_one({"_id": user_id_obj})
-    
-    access_token = create_access_token(data={"sub": str(user_id_obj)})
-    refresh_token = create_refresh_token(data={"sub": str(user_id_obj)})
-    total_draws = await db.fortunes.count_documents({"user_id": user_id_obj})
+    user_id_obj = credentials["_id"]
+    if upgraded_hash:
+        # Imported with a cheaper bcrypt cost; bring it up to the normal one.
+        await db.users.update_one({"_id": user_id_obj}, {"$set": {"password_hash": upgraded_hash}})
+    user_doc = await touch_profile_user(db, user_id_obj)
     
-    today_start_utc = get_current_day_start_in_utc()
-    tomorrow_start_utc = today_start_utc + timedelta(days=1)
+    access_token = create_access_token(data={"sub": str(user_id_obj), "role": user_doc["role"]})
+    refresh_token = await issue_refresh_token(str(user_id_obj), user_doc["role"])
+    total_draws = await count_user_fortunes(db, user_id_obj)
     
-    todays_fortune_doc = await db.fortunes.find_one({
-        "user_id": user_id_obj,
-        "created_at": {
-            "$gte": today_start_utc,
-            "$lt": tomorrow_start_utc
-        }
-    })
+    todays_fortune_value = await find_todays_fortune_value(
+        db, user_id_obj, user_doc.get("timezone"), user_doc.get("last_draw_date"), user_doc.get("last_draw_at")
+    )
     
-    has_drawn_today = todays_fortune_doc is not None
-    todays_fortune_value = todays_fortune_doc.get("value") if todays_fortune_doc else None
+    has_drawn_today = todays_fortune_value is not None
 
-    user_doc['_id'] = str(user_doc['_id'])
-    
-    user_in_db = UserInDB(**user_doc)
-    
     user_profile = UserMeProfile(
-        **user_in_db.model_dump(),
+        **{**user_doc, "id": str(user_id_obj)},
         total_draws=total_draws,
         has_drawn_today=has_drawn_today,
-        todays_fortune=todays_fortune_value
+        todays_fortune=todays_fortune_value,
+        **achievements_view(user_doc.get("achievements"), user_doc.get("timezone"), await luck_histogram.get(db))
     )
 
-    response.set_cookie(
-        key="refresh_token",
-        value=refresh_token,
-        httponly=True,
-        secure=False, # Set to True in production with HTTPS
-        samesite="lax",
-        max_age=settings.REFRESH_TOKEN_EXPIRE_DAYS * 24 * 60 * 60
-    )
+    set_refresh_cookie(response, refresh_token)
 
     return {
         "access_token": access_token,
@@ -161,35 +165,28 @@ async def login_for_access_token(request: Request, response: Response, form_data
 
 @router.post("/refresh")
 async def refresh_token(request: Request, response: Response, db: AsyncIOMotorDatabase = Depends(get_db)):
+    """
+    Exchanges the refresh cookie for an access token and the next refresh token of
+    its family. The user must still exist and be active; the role comes from the
+    user document, so a changed role takes effect at the next refresh.
+    """
     refresh_token_cookie = request.cookies.get("refresh_token")
     if not refresh_token_cookie:
         raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Refresh token missing")
 
     try:
-        payload = jwt.decode(refresh_token_cookie, settings.SECRET_KEY, algorithms=[settings.ALGORITHM])
-        if payload.get("type") != "refresh":
-             raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Invalid token type")
-        user_id = payload.get("sub")
-        if user_id is None:
-            raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Invalid token")
-    except JWTError:
-        raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Invalid token")
-        
-    user = await db.users.find_one({"_id": ObjectId(user_id)})
-    if not user:
-         raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="User not found")
-         
-    access_token = create_access_token(data={"sub": user_id})
-    new_refresh_token = create_refresh_token(data={"sub": user_id})
-    
-    response.set_cookie(
-        key="refresh_token",
-        value=new_refresh_token,
-        httponly=True,
-        secure=False, # Set to True in production with HTTPS
-        samesite="lax",
-        max_age=settings.REFRESH_TOKEN_EXPIRE_DAYS * 24 * 60 * 60
-    )
+        user_id, _, new_refresh_token = await rotate_refresh_token(refresh_token_cookie)
+    except RefreshTokenError as e:
+        raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail=str(e))
+
+    claims = await find_token_claims(db, ObjectId(user_id)) if ObjectId.is_valid(user_id) else None
+    if claims is None or claims.get("status", "active") != "active":
+        # Deleted or deactivated since login: end the session instead of renewing it.
+        await revoke_refresh_token(new_refresh_token)
+        raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="User is no longer active")
+
+    access_token = create_access_token(data={"sub": user_id, "role": claims.get("role", "user")})
+    set_refresh_cookie(response, new_refresh_token)
 
     return {
         "access_token": access_token, 
@@ -198,6 +195,7 @@ async def refresh_token(request: Request, response: Response, db: AsyncIOMotorDa
     }
 
 @router.post("/logout")
-async def logout(response: Response):
+async def logout(request: Request, response: Response):
+    await revoke_refresh_token(request.cookies.get("refresh_token"))
     response.delete_cookie("refresh_token")
     return {"message": "Logged out successfully"}
\ No newline at end of file
@@ -4,6 +4,7 @@ from fastapi import APIRouter, Depends, Request
 from motor.motor_asyncio import AsyncIOMotorDatabase
 from ..db import get_db
 from ..core.rate_limiter import limiter_decorator
+from ..core.resilience import remember_response
 
 router = APIRouter(prefix="/config", tags=["Config"])
 
@@ -12,4 +13,4 @@ router = APIRouter(prefix="/config", tags=["Config"])
 async def get_registration_status(request: Request, db: AsyncIOMotorDatabase = Depends(get_db)):
     config = await db.config.find_one({"key": "registration_status"})
     is_open = config.get("value", False) if config else False
-    return {"is_open": is_open}
\ No newline at end of file
+    return remember_response(request, {"is_open": is_open})
\ No newline at end of file
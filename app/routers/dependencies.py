@@ -8,11 +8,40 @@ from motor.motor_asyncio import AsyncIOMotorDatabase
 from jose import JWTError
 from bson import ObjectId
 from datetime import datetime, timezone
+from collections import OrderedDict
+from typing import Optional
 
 from ..core.security import oauth2_scheme, jwt, settings
 from ..db import get_db
 from ..models.token import TokenData
-from ..models.user import UserInDB
+from ..repository import AuthUser, find_auth_user
+
+# Users recently authenticated by get_current_user, so that a draw can still be
+# authenticated while the database is unreachable (see app/core/resilience.py).
+RECENT_USERS_MAX = 5000
+recent_users: "OrderedDict[str, AuthUser]" = OrderedDict()
+
+def remember_user(user: AuthUser) -> None:
+    recent_users[user.id] = user
+    recent_users.move_to_end(user.id)
+    if len(recent_users) > RECENT_USERS_MAX:
+        recent_users.popitem(last=False)
+
+def authenticate_from_recent(token: Optional[str]) -> Optional[AuthUser]:
+    """get_current_user's checks against the recently seen users instead of the database."""
+    if not token:
+        return None
+    try:
+        payload = jwt.decode(token, settings.SECRET_KEY, algorithms=[settings.ALGORITHM])
+    except JWTError:
+        return None
+    user = recent_users.get(payload.get("sub"))
+    issued_at_ts = payload.get("iat")
+    if user is None or issued_at_ts is None:
+        return None
+    if user.password_changed_at and datetime.fromtimestamp(issued_at_ts, tz=timezone.utc) < user.password_changed_at:
+        return None
+    return user
 
 credentials_exception = HTTPException(
     status_code=status.HTTP_401_UNAUTHORIZED,
@@ -20,7 +49,7 @@ credentials_exception = HTTPException(
     headers={"WWW-Authenticate": "Bearer"},
 )
 
-async def get_current_user(token: str = Depends(oauth2_scheme), db: AsyncIOMotorDatabase = Depends(get_db)) -> UserInDB:
+async def get_current_user(token: str = Depends(oauth2_scheme), db: AsyncIOMotorDatabase = Depends(get_db)) -> AuthUser:
     try:
         payload = jwt.decode(token, settings.SECRET_KEY, algorithms=[settings.ALGORITHM])
         user_id: str = payload.get("sub")
@@ -34,13 +63,14 @@ async def get_current_user(token: str = Depends(oauth2_scheme), db: AsyncIOMotor
         logger.warning(f"Token validation failed: {str(e)}")
         raise credentials_exception
     
-    user = await db.users.find_one({"_id": ObjectId(token_data.user_id)})
+    # Only the auth view: authorization never needs bios, URLs or the password hash.
+    user = await find_auth_user(db, ObjectId(token_data.user_id))
     if user is None:
         logger.warning(f"Token validation failed: User {token_data.user_id} not found in DB.")
         raise credentials_exception
     
     # --- FIX: 检查Token是否在密码修改前签发 ---
-    password_changed_at = user.get("password_changed_at")
+    password_changed_at = user.password_changed_at
     if password_changed_at:
         # 将iat时间戳转换为带时区的datetime对象以便精确比较
         token_issued_at_dt = datetime.fromtimestamp(issued_at_ts, tz=timezone.utc)
@@ -50,23 +80,16 @@ async def get_current_user(token: str = Depends(oauth2_scheme), db: AsyncIOMotor
             logger.warning(f"Token validation failed: Token issued at {token_issued_at_dt} is older than password change at {password_changed_at}.")
             raise credentials_exception
     
-    # --- THE CORRECT FIX ---
-    # The UserInDB model has a field `id: str` which is an alias for the input key `_id`.
-    # Pydantic expects the value associated with the key `_id` to be a string.
-    # Currently, `user['_id']` is an ObjectId. We just need to convert it.
-    # We modify the dictionary IN-PLACE before passing it to the model.
-    user['_id'] = str(user['_id'])
-    # --- END OF FIX ---
-    
-    return UserInDB(**user)
+    remember_user(user)
+    return user
 
-async def get_current_active_user(current_user: UserInDB = Depends(get_current_user)) -> UserInDB:
+async def get_current_active_user(current_user: AuthUser = Depends(get_current_user)) -> AuthUser:
     if current_user.status != "active":
         raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Account is deactivated. Read-only access.")
     return current_user
 
 # Optional authentication dependency
-async def get_optional_current_user(token: str = Depends(oauth2_scheme), db: AsyncIOMotorDatabase = Depends(get_db)) -> UserInDB | None:
+async def get_optional_current_user(token: str = Depends(oauth2_scheme), db: AsyncIOMotorDatabase = Depends(get_db)) -> AuthUser | None:
     if token is None:
         return None
     try:
@@ -0,0 +1,143 @@
+# app/routers/diagnostics.py
+#
+# Admin-only view into a worker's memory and event loop (app/core/diagnostics.py).
+# Answers 404 unless DIAGNOSTICS_ENABLED (the blocking-call report also with just
+# BLOCKING_DETECTOR_ENABLED); every response describes the worker that served it,
+# so with several workers compare the reported `pid`.
+
+import asyncio
+import os
+from typing import Optional
+
+from fastapi import APIRouter, Depends, HTTPException, Query, Request, status
+
+from ..core.admission import admission_controller
+from ..core.config import settings
+from ..core.diagnostics import (
+    GROUP_BY, allocation_tracer, blocking_detector, loop_lag_monitor, memory_usage, object_counts
+)
+from ..core.idempotency import idempotency_store
+from ..core.resilience import last_known_good
+from ..models.fortune import FortuneHistoryItem
+from ..models.user import UserInDB, UserMeProfile, UserPublicProfile
+from ..repository import AuthUser
+from ..services.avatar_proxy import avatar_proxy
+from ..services.draw_admission import deferred_draws, draw_coalescer, fortune_insert_queue
+from ..services.leaderboard import leaderboard_broadcaster, leaderboard_cache
+from ..services.luck import luck_histogram
+from ..services.refresh_tokens import refresh_token_store
+from .admin import get_current_admin_user
+from .dependencies import recent_users
+
+
+BLOCKING_PATH = "/admin/diagnostics/blocking"
+
+
+def diagnostics_enabled(request: Request) -> None:
+    """Checked per request (before authentication), so settings are not read at import."""
+    if not settings.DIAGNOSTICS_ENABLED and not (
+        settings.BLOCKING_DETECTOR_ENABLED and request.url.path == BLOCKING_PATH
+    ):
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Not Found")
+
+
+router = APIRouter(
+    prefix="/admin/diagnostics",
+    tags=["Administration"],
+    dependencies=[Depends(diagnostics_enabled), Depends(get_current_admin_user)]
+)
+
+MODEL_TYPES = (UserInDB, UserMeProfile, UserPublicProfile, FortuneHistoryItem, AuthUser)
+
+GROUP_BY_PATTERN = f"^({'|'.join(GROUP_BY)})$"
+
+
+def cache_sizes() -> dict:
+    """Entries held by the in-process caches and queues that grow with traffic."""
+    distribution = luck_histogram.cached
+    return {
+        "leaderboard_cache": len(leaderboard_cache),
+        "last_known_good": len(last_known_good),
+        "recent_users": len(recent_users),
+        "luck_histogram_bins": len(distribution.bins) if distribution is not None else 0,
+        "refresh_tokens_memory": len(refresh_token_store.memory),
+        "refresh_tokens_fallback": len(refresh_token_store.fallback),
+        "idempotency_memory": idempotency_store.memory_entries(),
+        "draw_coalescer_inflight": len(draw_coalescer),
+        "fortune_insert_queue": fortune_insert_queue.qsize(),
+        "deferred_draws": len(deferred_draws),
+        "leaderboard_subscribers": len(leaderboard_broadcaster),
+        "avatar_cache_files": len(avatar_proxy.cache),
+        "avatar_cache_bytes": avatar_proxy.cache.bytes,
+    }
+
+
+@router.get("")
+async def read_diagnostics():
+    """Process memory, event-loop lag, cache sizes, admission state and tracemalloc status."""
+    return {
+        "pid": os.getpid(),
+        "memory": await asyncio.to_thread(memory_usage),
+        "loop_lag": loop_lag_monitor.stats(),
+        "caches": cache_sizes(),
+        "admission": admission_controller.stats(),
+        "tracemalloc": allocation_tracer.status(),
+        "blocking_detector": blocking_detector.running,
+    }
+
+
+@router.get("/objects")
+async def read_object_counts(top: int = Query(0, ge=0, le=200)):
+    """Live instances of the app's model types; `top` adds the most common types in the heap."""
+    return {"pid": os.getpid(), **await asyncio.to_thread(object_counts, MODEL_TYPES, top)}
+
+
+@router.post("/tracemalloc/start")
+async def start_tracemalloc(frames: Optional[int] = Query(None, ge=1, le=100)):
+    """Starts tracing allocations. Costs CPU and memory until stopped."""
+    return allocation_tracer.start(frames or settings.DIAGNOSTICS_TRACEMALLOC_FRAMES)
+
+
+@router.post("/tracemalloc/stop")
+async def stop_tracemalloc():
+    return allocation_tracer.stop()
+
+
+@router.get("/tracemalloc/top")
+async def read_top_allocations(limit: int = Query(25, ge=1, le=500), group_by: str = Query("lineno", pattern=GROUP_BY_PATTERN)):
+    """Allocation sites holding the most memory right now."""
+    try:
+        return {"pid": os.getpid(), "top": await asyncio.to_thread(allocation_tracer.top, limit, group_by)}
+    except RuntimeError as e:
+        raise HTTPException(status_code=status.HTTP_409_CONFLICT, detail=str(e))
+
+
+@router.post("/tracemalloc/baseline")
+async def take_baseline():
+    """Stores a snapshot for /tracemalloc/diff to compare against, replacing the previous one."""
+    try:
+        return await asyncio.to_thread(allocation_tracer.set_baseline)
+    except RuntimeError as e:
+        raise HTTPException(status_code=status.HTTP_409_CONFLICT, detail=str(e))
+
+
+@router.get("/tracemalloc/diff")
+async def read_allocation_diff(limit: int = Query(25, ge=1, le=500), group_by: str = Query("lineno", pattern=GROUP_BY_PATTERN)):
+    """Allocation sites that grew the most since the baseline."""
+    try:
+        return {"pid": os.getpid(), "diff": await asyncio.to_thread(allocation_tracer.diff, limit, group_by)}
+    except RuntimeError as e:
+        raise HTTPException(status_code=status.HTTP_409_CONFLICT, detail=str(e))
+
+
+@router.get("/blocking")
+async def read_blocking_calls():
+    """Call sites that held the event loop longer than BLOCKING_THRESHOLD_MS (BLOCKING_DETECTOR_ENABLED)."""
+    if not blocking_detector.running:
+        raise HTTPException(status_code=status.HTTP_409_CONFLICT, detail="The blocking-call detector is not enabled.")
+    return {"pid": os.getpid(), "threshold_ms": blocking_detector.threshold * 1000, "sites": blocking_detector.report()}
+
+
+@router.delete("/blocking", status_code=status.HTTP_204_NO_CONTENT)
+async def reset_blocking_calls():
+    blocking_detector.reset()
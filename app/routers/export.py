@@ -0,0 +1,50 @@
+# app/routers/export.py
+
+from fastapi import APIRouter, Depends, Path, Query
+from fastapi.responses import StreamingResponse
+from motor.motor_asyncio import AsyncIOMotorDatabase
+from datetime import datetime, timezone
+from typing import Optional
+
+from ..db import get_db
+from ..repository import AuthUser
+from .admin import get_current_admin_user
+from ..services.export import export_stream, export_until
+
+router = APIRouter(prefix="/admin/export", tags=["Administration"])
+
+MEDIA_TYPES = {"ndjson": "application/x-ndjson", "csv": "text/csv; charset=utf-8"}
+
+@router.get("/{collection}")
+async def export_collection(
+    collection: str = Path(..., pattern="^(users|fortunes)$"),
+    format: str = Query("ndjson", pattern="^(ndjson|csv)$"),
+    gzip: bool = False,
+    since: Optional[datetime] = None,
+    batch_size: int = Query(1000, ge=1, le=10000),
+    admin_user: AuthUser = Depends(get_current_admin_user),
+    db: AsyncIOMotorDatabase = Depends(get_db)
+):
+    """
+    Streams `users` (without credentials) or `fortunes` as NDJSON or CSV, optionally
+    gzipped. `since` restricts the export to documents stamped at or after it; the
+    `X-Export-Watermark` response header is the `since` to use for the next run.
+    """
+    if since is not None and since.tzinfo is None:
+        since = since.replace(tzinfo=timezone.utc)
+    until = export_until()
+
+    filename = f"{collection}-{until.strftime('%Y%m%dT%H%M%SZ')}.{format}"
+    media_type = MEDIA_TYPES[format]
+    if gzip:
+        filename += ".gz"
+        media_type = "application/gzip"
+
+    return StreamingResponse(
+        export_stream(db, collection, format, since=since, until=until, compress=gzip, batch_size=batch_size),
+        media_type=media_type,
+        headers={
+            "Content-Disposition": f'attachment; filename="{filename}"',
+            "X-Export-Watermark": until.isoformat(),
+        }
+    )
@@ -1,113 +1,244 @@
 # app/routers/fortune.py
 
-from fastapi import APIRouter, Depends, HTTPException, Request
+from fastapi import APIRouter, Depends, HTTPException, Query, Request
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import JSONResponse, Response, StreamingResponse
 from motor.motor_asyncio import AsyncIOMotorDatabase
-from datetime import datetime, timedelta, timezone # <-- FIX: Add timezone here
+import asyncio
+from functools import partial
+from datetime import datetime, timezone
 from bson import ObjectId
-from typing import List
+from pymongo.errors import DuplicateKeyError
+from typing import List, Optional
 
-from ..db import get_db
-from ..services.fortune_service import draw_fortune_logic, FORTUNE_RANKS
-from ..models.user import UserInDB
+from ..db import get_database, get_db
+from ..services.fortune_service import derive_fortune, draw_fortune_logic, todays_day_key
+from ..services.achievements import record_draw_achievements
+from ..services.luck import luck_histogram, luck_score
+from ..services.leaderboard import build_delta, build_leaderboard, leaderboard_broadcaster, leaderboard_cache, leaderboard_match, sse_event
+from ..services.draw_admission import deferred_draws, draw_coalescer, insert_fortune, jittered_next_draw_at, record_fortune_in_background
+from ..repository import AuthUser, find_fortune_value
 from ..models.fortune import LeaderboardGroup
-from .dependencies import get_optional_current_user
+from .dependencies import authenticate_from_recent, get_optional_current_user
 from ..core.rate_limiter import limiter_decorator
-from ..core.time_service import get_current_day_start_in_utc, get_next_day_start_in_utc
+from ..core.resilience import DEGRADED_HEADER, degraded_handler, remember_body, remember_response
+from ..core.time_service import get_day_window, is_valid_timezone
+from ..core.config import settings
 
 router = APIRouter(prefix="/fortune", tags=["Fortune"])
 
+async def _after_recorded(db: AsyncIOMotorDatabase, current_user: AuthUser, fortune_doc: dict) -> None:
+    """Runs once per user and day, after the day's fortune document was created."""
+    achievements = await record_draw_achievements(
+        db, fortune_doc["user_id"], current_user.achievements, fortune_doc["date"], fortune_doc["value"]
+    )
+    distribution = await luck_histogram.get(db)
+    await leaderboard_broadcaster.publish(build_delta(
+        fortune_doc, current_user.username, current_user.display_name,
+        distribution.percentile(luck_score(achievements)) if distribution is not None else None
+    ))
+
+async def _draw_for_user(db: AsyncIOMotorDatabase, current_user: AuthUser) -> dict:
+    user_id_obj = ObjectId(current_user.id)
+    now_utc = datetime.now(timezone.utc)
+    # The business day is the user's local day, shared by everyone in their zone.
+    day_window = get_day_window(current_user.timezone)
+    today_key = day_window.key
+    next_draw_at = jittered_next_draw_at(str(user_id_obj), day_window.next)
+
+    if todays_day_key(day_window, current_user.last_draw_date, current_user.last_draw_at) != today_key:
+        # Drawn under another timezone inside this window: that draw stands.
+        if settings.FORTUNE_DERIVATION_ENABLED:
+            fortune_value = derive_fortune(str(user_id_obj), current_user.last_draw_date)
+        else:
+            fortune_value = await find_fortune_value(db, user_id_obj, current_user.last_draw_date)
+        return {
+            "fortune": fortune_value,
+            "next_draw_at": next_draw_at
+        }
+
+    user_update = {"last_active_date": now_utc}
+    if not settings.FORTUNE_DERIVATION_ENABLED:
+        user_update["last_draw_date"] = today_key
+        if current_user.last_draw_date != today_key:
+            user_update["last_draw_at"] = now_utc
+    await db.users.update_one({"_id": user_id_obj}, {"$set": user_update})
+
+    if settings.FORTUNE_DERIVATION_ENABLED:
+        # Nothing to read: the value is a function of (user, day). Only the first draw
+        # of the day leaves a history record, written off the request path; it also
+        # sets last_draw_date, so draws keep recording until one succeeds.
+        fortune_value = derive_fortune(str(user_id_obj), today_key)
+        if current_user.last_draw_date != today_key:
+            record_fortune_in_background(db, {
+                "user_id": user_id_obj,
+                "value": fortune_value,
+                "date": today_key,
+                "tz": day_window.tz_name,
+                "created_at": now_utc
+            }, on_recorded=partial(_after_recorded, db, current_user))
+        return {
+            "fortune": fortune_value,
+            "next_draw_at": next_draw_at
+        }
+
+    existing_value = await find_fortune_value(db, user_id_obj, today_key)
+    if existing_value:
+        return {
+            "fortune": existing_value,
+            "next_draw_at": next_draw_at
+        }
+
+    new_fortune_value = draw_fortune_logic()
+    fortune_doc = {
+        "user_id": user_id_obj,
+        "value": new_fortune_value,
+        "date": today_key,
+        "tz": day_window.tz_name,
+        "created_at": now_utc
+    }
+    try:
+        await insert_fortune(db, fortune_doc)
+    except DuplicateKeyError:
+        # A concurrent draw for the same business day won the race (user_date_unique).
+        new_fortune_value = await find_fortune_value(db, user_id_obj, today_key)
+    else:
+        await _after_recorded(db, current_user, fortune_doc)
+    return {
+        "fortune": new_fortune_value,
+        "next_draw_at": next_draw_at
+    }
+
 @router.post("/draw")
 @limiter_decorator("30/minute")
-async def draw(request: Request, db: AsyncIOMotorDatabase = Depends(get_db), current_user: UserInDB | None = Depends(get_optional_current_user)):
+async def draw(request: Request, db: AsyncIOMotorDatabase = Depends(get_db), current_user: AuthUser | None = Depends(get_optional_current_user)):
     if current_user:
         if current_user.status != "active":
             raise HTTPException(status_code=403, detail="Account is deactivated.")
 
-        user_id_obj = ObjectId(current_user.id)
-        
-        await db.users.update_one({"_id": user_id_obj}, {"$set": {"last_active_date": datetime.now(timezone.utc)}})
-        
-        today_start_utc = get_current_day_start_in_utc()
-        tomorrow_start_utc = today_start_utc + timedelta(days=1)
-        
-        existing_fortune = await db.fortunes.find_one({
-            "user_id": user_id_obj,
-            "created_at": {
-                "$gte": today_start_utc,
-                "$lt": tomorrow_start_utc
-            }
-        })
-        
-        if existing_fortune:
-            return {
-                "fortune": existing_fortune["value"],
-                "next_draw_at": get_next_day_start_in_utc()
-            }
-
-        new_fortune_value = draw_fortune_logic()
-        fortune_doc = {
-            "user_id": user_id_obj,
-            "value": new_fortune_value,
-            "created_at": datetime.now(timezone.utc)
-        }
-        await db.fortunes.insert_one(fortune_doc)
-        return {
-            "fortune": new_fortune_value,
-            "next_draw_at": get_next_day_start_in_utc()
-        }
+        if settings.DRAW_COALESCING_ENABLED:
+            # Duplicate in-flight draws for this user (double taps, reset-time retries) share one result.
+            return await draw_coalescer.run(current_user.id, lambda: _draw_for_user(db, current_user))
+        return await _draw_for_user(db, current_user)
     else:
         # For anonymous users, the response structure remains unchanged
         return {"fortune": draw_fortune_logic()}
 
+@degraded_handler("POST", "/fortune/draw")
+async def draw_during_outage(request: Request) -> Optional[Response]:
+    """
+    Answers a draw while the database is unreachable, where that is safe: in derivation
+    mode the value needs no read, and the token must belong to a recently authenticated
+    active user. The writes of the draw are replayed when the database is back.
+    """
+    if not settings.FORTUNE_DERIVATION_ENABLED:
+        return None
+    scheme, _, token = request.headers.get("authorization", "").partition(" ")
+    current_user = authenticate_from_recent(token if scheme.lower() == "bearer" else None)
+    if current_user is None or current_user.status != "active":
+        return None
+
+    day_window = get_day_window(current_user.timezone)
+    day_key = todays_day_key(day_window, current_user.last_draw_date, current_user.last_draw_at)
+    fortune_value = derive_fortune(current_user.id, day_key)
+    if current_user.last_draw_date != day_key:
+        fortune_doc = {
+            "user_id": ObjectId(current_user.id),
+            "value": fortune_value,
+            "date": day_window.key,
+            "tz": day_window.tz_name,
+            "created_at": datetime.now(timezone.utc)
+        }
+        if not deferred_draws.defer(fortune_doc, on_recorded=partial(_after_recorded, get_database(), current_user)):
+            return None
+    return JSONResponse(
+        jsonable_encoder({
+            "fortune": fortune_value,
+            "next_draw_at": jittered_next_draw_at(current_user.id, day_window.next)
+        }),
+        headers={DEGRADED_HEADER: "deferred"}
+    )
+
 @router.get("/leaderboard", response_model=List[LeaderboardGroup])
 @limiter_decorator("60/minute")
-async def get_todays_leaderboard(request: Request, db: AsyncIOMotorDatabase = Depends(get_db)):
-    today_start_utc = get_current_day_start_in_utc()
-    tomorrow_start_utc = today_start_utc + timedelta(days=1)
-
-    pipeline = [
-        {
-            "$match": { 
-                "created_at": {
-                    "$gte": today_start_utc,
-                    "$lt": tomorrow_start_utc
-                }
-            }
-        },
-        {
-            "$lookup": {
-                "from": "users",
-                "localField": "user_id",
-                "foreignField": "_id",
-                "as": "user_info"
-            }
-        },
-        {
-            "$unwind": "$user_info"
-        },
-        {
-            "$group": {
-                "_id": "$value",
-                "users": {
-                    "$push": {
-                        "username": "$user_info.username",
-                        "display_name": "$user_info.display_name"
-                    }
-                }
-            }
-        },
-        {
-            "$project": {
-                "_id": 0,
-                "fortune": "$_id",
-                "users": 1
-            }
-        }
-    ]
-    
-    leaderboard_cursor = db.fortunes.aggregate(pipeline)
-    leaderboard_data = await leaderboard_cursor.to_list(length=None)
-    
-    leaderboard_data.sort(key=lambda item: FORTUNE_RANKS.get(item['fortune'], 0), reverse=True)
-    
-    return [LeaderboardGroup(**item) for item in leaderboard_data]
\ No newline at end of file
+async def get_todays_leaderboard(
+    request: Request,
+    scope: str = Query("global", pattern="^(global|zone)$"),
+    tz: Optional[str] = None,
+    db: AsyncIOMotorDatabase = Depends(get_db)
+):
+    """
+    scope=global: everything drawn during the current APP_TIMEZONE business day.
+    scope=zone:   draws made on the current local day of timezone `tz` (default APP_TIMEZONE).
+    """
+    if tz is not None and not is_valid_timezone(tz):
+        raise HTTPException(status_code=400, detail="Unknown timezone.")
+
+    if settings.LEADERBOARD_CACHE_SECONDS <= 0:
+        leaderboard_data = await build_leaderboard(db, leaderboard_match(scope, tz))
+        return remember_response(request, [LeaderboardGroup(**item) for item in leaderboard_data])
+
+    day_window = get_day_window(tz if scope == "zone" else None)
+    cache_key = (scope, day_window.tz_name, day_window.key)
+    entry = leaderboard_cache.get(cache_key)
+    if entry is None:
+        leaderboard_data = await build_leaderboard(db, leaderboard_match(scope, tz))
+        rendered = JSONResponse(jsonable_encoder([LeaderboardGroup(**item) for item in leaderboard_data]))
+        entry = leaderboard_cache.put(cache_key, rendered.body, rendered.media_type, settings.LEADERBOARD_CACHE_SECONDS)
+        remember_body(request, rendered.body, rendered.media_type)
+    return entry.to_response(request)
+
+@router.get("/leaderboard/stream")
+@limiter_decorator("10/minute")
+async def stream_leaderboard(
+    request: Request,
+    scope: str = Query("global", pattern="^(global|zone)$"),
+    tz: Optional[str] = None,
+    db: AsyncIOMotorDatabase = Depends(get_db)
+):
+    """
+    Server-Sent Events: one `snapshot` event with the full leaderboard, then a `delta`
+    event per new draw. A delta racing the initial snapshot may repeat an entry that is
+    already in it, so clients should key entries by username. A fresh `snapshot` is sent
+    when the business day rolls over and when the client fell too far behind.
+    """
+    if tz is not None and not is_valid_timezone(tz):
+        raise HTTPException(status_code=400, detail="Unknown timezone.")
+
+    # Subscribe before reading the snapshot so no draw falls between the two.
+    subscription = leaderboard_broadcaster.subscribe(scope, tz)
+    heartbeat = settings.LEADERBOARD_PUSH_HEARTBEAT_SECONDS
+
+    async def snapshot_event() -> bytes:
+        leaderboard_data = await build_leaderboard(db, leaderboard_match(scope, tz))
+        return sse_event("snapshot", leaderboard_data)
+
+    async def events():
+        try:
+            day_key = get_day_window(tz if scope == "zone" else None).key
+            yield await snapshot_event()
+            while True:
+                current_day_key = get_day_window(tz if scope == "zone" else None).key
+                if subscription.needs_resync or current_day_key != day_key:
+                    if subscription.overflows > settings.LEADERBOARD_PUSH_MAX_RESYNCS:
+                        # Persistently slow consumer: drop it, the client will reconnect.
+                        return
+                    while not subscription.queue.empty():
+                        subscription.queue.get_nowait()
+                    subscription.needs_resync = False
+                    day_key = current_day_key
+                    yield await snapshot_event()
+                try:
+                    delta = await asyncio.wait_for(subscription.queue.get(), timeout=heartbeat)
+                except asyncio.TimeoutError:
+                    yield b": ping\n\n"
+                    continue
+                yield sse_event("delta", {"fortune": delta["fortune"], "user": delta["user"]})
+        finally:
+            leaderboard_broadcaster.unsubscribe(subscription)
+
+    return StreamingResponse(
+        events(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
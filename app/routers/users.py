@@ -1,19 +1,31 @@
 # /daily-fortune-api/app/routers/users.py
 
-from fastapi import APIRouter, Depends, HTTPException, status, Request
+from fastapi import APIRouter, Depends, HTTPException, Query, status, Request, Response
 from motor.motor_asyncio import AsyncIOMotorDatabase
 from datetime import datetime, timedelta, timezone
 import pytz
 
 from ..db import get_db
-from ..models.user import UserInDB, UserMeProfile, UserPublicProfile, UserUpdate, PasswordUpdate
+from ..models.user import UserMeProfile, UserPublicProfile, UserUpdate, PasswordUpdate, LuckRanking
 from ..models.fortune import FortuneHistoryItem
 from .dependencies import get_current_user, get_current_active_user, get_optional_current_user
 from bson import ObjectId
 from ..core.rate_limiter import limiter_decorator
-from ..core.time_service import get_current_day_start_in_utc, get_next_day_start_in_utc
+from ..core.resilience import DEGRADED_HEADER, remember_response
+from ..core.time_service import get_next_day_start_in_utc
+from ..services.fortune_service import find_todays_fortune_value
+from ..services.fortune_history import count_user_fortunes, find_fortune_history
 from ..core.config import settings
-from ..core.security import verify_password, get_password_hash, create_access_token
+from ..core.security import verify_password, get_password_hash, create_access_token, run_password_hashing
+from ..services.draw_admission import jittered_next_draw_at
+from ..services.availability import taken_names
+from ..services.achievements import achievements_view
+from ..services.luck import luck_histogram, luck_score
+from ..services.avatar_proxy import ImageUnavailable, avatar_proxy, image_url, standard_size
+from ..services.refresh_tokens import issue_refresh_token, revoke_user_refresh_tokens, set_refresh_cookie
+from ..repository import (
+    AuthUser, find_password_hash, find_public_user, find_user_fields, touch_profile_user, update_profile_user
+)
 from pymongo.errors import DuplicateKeyError
 
 router = APIRouter(prefix="/users", tags=["Users"])
@@ -22,40 +34,33 @@ router = APIRouter(prefix="/users", tags=["Users"])
 @limiter_decorator("100/minute")
 async def read_users_me(
     request: Request,
-    current_user: UserInDB = Depends(get_current_user),
+    current_user: AuthUser = Depends(get_current_user),
     db: AsyncIOMotorDatabase = Depends(get_db)
 ):
     user_id_obj = ObjectId(current_user.id)
     
-    await db.users.update_one(
-        {"_id": user_id_obj},
-        {"$set": {"last_active_date": datetime.now(timezone.utc)}}
-    )
+    user_doc = await touch_profile_user(db, user_id_obj)
 
-    total_draws = await db.fortunes.count_documents({"user_id": user_id_obj})
+    total_draws = await count_user_fortunes(db, user_id_obj)
     
-    today_start_utc = get_current_day_start_in_utc()
-    tomorrow_start_utc = today_start_utc + timedelta(days=1)
-    
-    todays_fortune_doc = await db.fortunes.find_one({
-        "user_id": user_id_obj,
-        "created_at": { "$gte": today_start_utc, "$lt": tomorrow_start_utc }
-    })
+    todays_fortune_value = await find_todays_fortune_value(
+        db, user_id_obj, current_user.timezone, current_user.last_draw_date, current_user.last_draw_at
+    )
     
-    has_drawn_today = todays_fortune_doc is not None
-    todays_fortune_value = todays_fortune_doc.get("value") if todays_fortune_doc else None
+    has_drawn_today = todays_fortune_value is not None
     
     user_profile = UserMeProfile(
-        **current_user.model_dump(),
+        **{**user_doc, "id": current_user.id},
         total_draws=total_draws,
         has_drawn_today=has_drawn_today,
-        todays_fortune=todays_fortune_value
+        todays_fortune=todays_fortune_value,
+        **achievements_view(current_user.achievements, current_user.timezone, await luck_histogram.get(db))
     )
     
     response_data = {"user": user_profile}
     
     if has_drawn_today:
-        response_data["next_draw_at"] = get_next_day_start_in_utc()
+        response_data["next_draw_at"] = jittered_next_draw_at(current_user.id, get_next_day_start_in_utc(current_user.timezone))
     
     return response_data
 
@@ -64,7 +69,7 @@ async def read_users_me(
 async def update_user_me(
     request: Request,
     user_update: UserUpdate,
-    current_user: UserInDB = Depends(get_current_active_user),
+    current_user: AuthUser = Depends(get_current_active_user),
     db: AsyncIOMotorDatabase = Depends(get_db)
 ):
     user_id_obj = ObjectId(current_user.id)
@@ -74,30 +79,23 @@ async def update_user_me(
         raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="No update data provided")
 
     try:
-        await db.users.update_one(
-            {"_id": user_id_obj},
-            {"$set": update_data}
-        )
+        updated_user_doc = await update_profile_user(db, user_id_obj, update_data)
     except DuplicateKeyError:
         raise HTTPException(
             status_code=status.HTTP_400_BAD_REQUEST,
             detail="Display name is already taken. Please choose another one."
         )
+    if "display_name" in update_data:
+        taken_names.add(update_data["display_name"])
     
-    updated_user_doc = await db.users.find_one({"_id": user_id_obj})
+    total_draws = await count_user_fortunes(db, user_id_obj)
     
-    total_draws = await db.fortunes.count_documents({"user_id": user_id_obj})
-    
-    today_start_utc = get_current_day_start_in_utc()
-    tomorrow_start_utc = today_start_utc + timedelta(days=1)
-    
-    todays_fortune_doc = await db.fortunes.find_one({
-        "user_id": user_id_obj,
-        "created_at": { "$gte": today_start_utc, "$lt": tomorrow_start_utc }
-    })
+    todays_fortune_value = await find_todays_fortune_value(
+        db, user_id_obj, updated_user_doc.get("timezone"), updated_user_doc.get("last_draw_date"),
+        updated_user_doc.get("last_draw_at")
+    )
 
-    has_drawn_today = todays_fortune_doc is not None
-    todays_fortune_value = todays_fortune_doc.get("value") if todays_fortune_doc else None
+    has_drawn_today = todays_fortune_value is not None
 
     user_profile_data = {
         "id": str(updated_user_doc["_id"]),
@@ -119,14 +117,15 @@ async def update_user_me(
         "has_drawn_today": has_drawn_today,
         "todays_fortune": todays_fortune_value,
         "qq": updated_user_doc.get("qq"),
-        "use_qq_avatar": updated_user_doc.get("use_qq_avatar", False)
+        "use_qq_avatar": updated_user_doc.get("use_qq_avatar", False),
+        **achievements_view(updated_user_doc.get("achievements"), updated_user_doc.get("timezone"), await luck_histogram.get(db))
     }
     user_profile = UserMeProfile(**user_profile_data)
     
     response_data = {"user": user_profile}
 
     if has_drawn_today:
-        response_data["next_draw_at"] = get_next_day_start_in_utc()
+        response_data["next_draw_at"] = jittered_next_draw_at(current_user.id, get_next_day_start_in_utc(user_profile.timezone))
 
     return response_data
 
@@ -135,19 +134,21 @@ async def update_user_me(
 @limiter_decorator("5/minute")
 async def update_user_password(
     request: Request,
+    response: Response,
     password_update: PasswordUpdate,
-    current_user: UserInDB = Depends(get_current_active_user),
+    current_user: AuthUser = Depends(get_current_active_user),
     db: AsyncIOMotorDatabase = Depends(get_db)
 ):
     user_id_obj = ObjectId(current_user.id)
     
-    if not verify_password(password_update.current_password, current_user.password_hash):
+    password_hash = await find_password_hash(db, user_id_obj)
+    if not password_hash or not await run_password_hashing(verify_password, password_update.current_password, password_hash):
         raise HTTPException(
             status_code=status.HTTP_400_BAD_REQUEST,
             detail="Incorrect current password."
         )
         
-    new_password_hash = get_password_hash(password_update.new_password)
+    new_password_hash = await run_password_hashing(get_password_hash, password_update.new_password)
     
     # --- FINAL FIX for Password Change Invalidation ---
     # We create a definitive invalidation boundary at the beginning of the NEXT second.
@@ -156,6 +157,9 @@ async def update_user_password(
     now = datetime.now(timezone.utc)
     invalidation_boundary = now.replace(microsecond=0) + timedelta(seconds=1)
 
+    # Same boundary for refresh tokens: every session's family dies. First, so that
+    # an unreachable token store (503) leaves the password unchanged.
+    await revoke_user_refresh_tokens(current_user.id, int(invalidation_boundary.timestamp()))
     await db.users.update_one(
         {"_id": user_id_obj},
         {"$set": {
@@ -166,9 +170,13 @@ async def update_user_password(
     
     # Issue the new token aligned exactly with this boundary, so it won't be self-invalidated.
     new_access_token = create_access_token(
-        data={"sub": current_user.id},
+        data={"sub": current_user.id, "role": current_user.role},
         issued_at=invalidation_boundary
     )
+    # This session starts a new family.
+    set_refresh_cookie(response, await issue_refresh_token(
+        current_user.id, current_user.role, issued_at=invalidation_boundary
+    ))
     
     return {
         "message": "Password updated successfully.",
@@ -180,20 +188,53 @@ async def update_user_password(
 @router.get("/u/{username}/fortune-history", response_model=list[FortuneHistoryItem])
 @limiter_decorator("60/minute")
 async def get_user_fortune_history(request: Request, username: str, db: AsyncIOMotorDatabase = Depends(get_db)):
-    user = await db.users.find_one({"username": username.lower()})
+    user = await find_user_fields(db, username)
     if not user:
         raise HTTPException(status_code=404, detail="User not found")
         
     one_year_ago = datetime.now(timezone.utc) - timedelta(days=365)
     
-    history_cursor = db.fortunes.find({
-        "user_id": user["_id"],
-        "created_at": {"$gte": one_year_ago}
-    })
+    history_docs = await find_fortune_history(db, user["_id"], one_year_ago)
     
-    history = [FortuneHistoryItem(**record) async for record in history_cursor]
+    history = [FortuneHistoryItem(**record) for record in history_docs]
         
-    return history
+    return remember_response(request, history)
+
+
+@router.get("/u/{username}/luck", response_model=LuckRanking)
+@limiter_decorator("60/minute")
+async def get_user_luck(
+    request: Request,
+    username: str,
+    db: AsyncIOMotorDatabase = Depends(get_db),
+    requester: AuthUser | None = Depends(get_optional_current_user)
+):
+    """
+    The user's luck score (mean fortune rank) and the share of users with a lower
+    one. Percentiles come from the maintained score histogram, not a global sort.
+    """
+    user_doc = await find_user_fields(db, username, "username", "display_name", "is_hidden", "achievements")
+    if not user_doc:
+        raise HTTPException(status_code=404, detail="User not found")
+
+    is_hidden = user_doc.get("is_hidden", False)
+    if is_hidden and not (requester and requester.role == "admin"):
+        raise HTTPException(status_code=404, detail="User not found")
+
+    achievements = user_doc.get("achievements") or {}
+    score = luck_score(achievements)
+    distribution = await luck_histogram.get(db)
+    ranking = LuckRanking(
+        username=user_doc["username"],
+        display_name=user_doc["display_name"],
+        draws=achievements.get("draws", 0),
+        luck_score=round(score, 3) if score is not None else None,
+        luck_percentile=distribution.percentile(score) if distribution is not None else None,
+        ranked_users=distribution.users if distribution is not None else 0,
+    )
+    if is_hidden:
+        return ranking
+    return remember_response(request, ranking)
 
 
 @router.get("/u/{username}", response_model=UserPublicProfile)
@@ -202,9 +243,9 @@ async def get_public_profile(
     request: Request,
     username: str,
     db: AsyncIOMotorDatabase = Depends(get_db),
-    requester: UserInDB | None = Depends(get_optional_current_user)
+    requester: AuthUser | None = Depends(get_optional_current_user)
 ):
-    user_doc = await db.users.find_one({"username": username.lower()})
+    user_doc = await find_public_user(db, username)
     if not user_doc:
         raise HTTPException(status_code=404, detail="User not found")
 
@@ -215,18 +256,13 @@ async def get_public_profile(
         raise HTTPException(status_code=404, detail="User not found")
 
     user_id_obj = user_doc["_id"]
-    total_draws = await db.fortunes.count_documents({"user_id": user_id_obj})
-    
-    today_start_utc = get_current_day_start_in_utc()
-    tomorrow_start_utc = today_start_utc + timedelta(days=1)
+    total_draws = await count_user_fortunes(db, user_id_obj)
     
-    todays_fortune_doc = await db.fortunes.find_one({
-        "user_id": user_id_obj,
-        "created_at": { "$gte": today_start_utc, "$lt": tomorrow_start_utc }
-    })
+    todays_fortune_value = await find_todays_fortune_value(
+        db, user_id_obj, user_doc.get("timezone"), user_doc.get("last_draw_date"), user_doc.get("last_draw_at")
+    )
 
-    has_drawn_today = todays_fortune_doc is not None
-    todays_fortune_value = todays_fortune_doc.get("value") if todays_fortune_doc else None
+    has_drawn_today = todays_fortune_value is not None
 
     use_qq = user_doc.get("use_qq_avatar", False)
     user_qq_number = user_doc.get("qq")
@@ -248,23 +284,89 @@ async def get_public_profile(
         "todays_fortune": todays_fortune_value,
         "qq": qq_to_return,
         "use_qq_avatar": use_qq,
+        **achievements_view(user_doc.get("achievements"), user_doc.get("timezone"), await luck_histogram.get(db)),
     }
     
-    return UserPublicProfile(**user_profile_data)
+    profile = UserPublicProfile(**user_profile_data)
+    if is_hidden:
+        return profile
+    # Only the view every requester gets is kept as the fallback for database outages.
+    return remember_response(request, profile)
 
 @router.get("/u/{username}/qq-public-status", response_model=dict)
 @limiter_decorator("100/minute")
 async def check_user_qq_publicity(
     request: Request,
     username: str,
-    current_user: UserInDB = Depends(get_current_user),
+    current_user: AuthUser = Depends(get_current_user),
     db: AsyncIOMotorDatabase = Depends(get_db)
 ):
-    target_user_doc = await db.users.find_one({"username": username.lower()})
+    target_user_doc = await find_user_fields(db, username, "qq", "use_qq_avatar")
     
     if not target_user_doc:
         raise HTTPException(status_code=404, detail="User not found")
         
     is_public = target_user_doc.get("use_qq_avatar", False) and target_user_doc.get("qq") is not None
     
-    return {"is_qq_public": is_public}
\ No newline at end of file
+    return {"is_qq_public": is_public}
+
+
+async def _proxied_image(request: Request, db: AsyncIOMotorDatabase, username: str, kind: str, size: int | None) -> Response:
+    """
+    The user's avatar or background through the caching proxy (app/services/avatar_proxy.py).
+    No authentication, so it works in <img> tags; hidden users' images are not served.
+    """
+    if not settings.AVATAR_PROXY_ENABLED:
+        raise HTTPException(status_code=404, detail="Not Found")
+    user_doc = await find_user_fields(
+        db, username, "is_hidden", "avatar_url", "background_url", "qq", "use_qq_avatar"
+    )
+    if not user_doc:
+        raise HTTPException(status_code=404, detail="User not found")
+    if user_doc.get("is_hidden", False):
+        raise HTTPException(status_code=404, detail="User not found")
+
+    url = image_url(user_doc, kind)
+    if url is None:
+        raise HTTPException(status_code=404, detail=f"No {kind} set")
+    try:
+        image = await avatar_proxy.get(url, standard_size(kind, size), request.headers.get("if-none-match", ""))
+    except ImageUnavailable as e:
+        raise HTTPException(status_code=status.HTTP_502_BAD_GATEWAY, detail=str(e))
+
+    # A stale copy is kept briefly so clients come back for the refreshed one.
+    max_age = 60 if image.stale else settings.AVATAR_PROXY_MAX_AGE_SECONDS
+    headers = {
+        "ETag": f'"{image.entry.etag}"',
+        "Cache-Control": f"public, max-age={max_age}",
+        "X-Content-Type-Options": "nosniff",
+    }
+    if image.stale:
+        headers[DEGRADED_HEADER] = "stale"
+    if image.content is None:
+        return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers=headers)
+    return Response(content=image.content, media_type=image.entry.content_type, headers=headers)
+
+
+@router.get("/u/{username}/avatar", response_class=Response)
+@limiter_decorator("600/minute")
+async def get_user_avatar(
+    request: Request,
+    username: str,
+    size: int | None = Query(None, ge=1, le=4096, description="Longest side in px, rounded up to a standard size."),
+    db: AsyncIOMotorDatabase = Depends(get_db)
+):
+    """The QQ avatar (when `use_qq_avatar`) or `avatar_url`, cached and resized; honours If-None-Match."""
+    return await _proxied_image(request, db, username, "avatar", size)
+
+
+@router.get("/u/{username}/background", response_class=Response)
+@limiter_decorator("600/minute")
+async def get_user_background(
+    request: Request,
+    username: str,
+    size: int | None = Query(None, ge=1, le=4096, description="Longest side in px, rounded up to a standard size."),
+    db: AsyncIOMotorDatabase = Depends(get_db)
+):
+    """`background_url`, cached and resized; honours If-None-Match."""
+    return await _proxied_image(request, db, username, "background", size)
@@ -0,0 +1,152 @@
+# app/services/achievements.py
+#
+# Streaks, the luckiest month and the luck score, kept on the user document so
+# profiles never scan fortune history:
+#
+#     achievements: {streak_day, current_streak, longest_streak,
+#                    month, month_good, month_score,
+#                    luckiest_month, luckiest_good, luckiest_score,
+#                    draws, rank_sum}
+#
+# `apply_draw` folds one business day's fortune into that state in O(1); the
+# draw path calls it once per user and day. `recompute_achievements` rebuilds
+# the state from the full (hot and archived) history, a batch of users at a time.
+#
+# A streak counts consecutive business-day keys. The luckiest month is the one
+# with the most good fortunes, ties broken by the sum of fortune ranks, then by
+# the earlier month. The luck score (rank_sum / draws) is ranked against everyone
+# else's through the histogram in app/services/luck.py.
+
+from datetime import date, timedelta
+from typing import Awaitable, Callable, Dict, List, Optional
+
+from bson import ObjectId
+from motor.motor_asyncio import AsyncIOMotorDatabase
+from pymongo import ASCENDING, UpdateOne
+
+from ..core.time_service import get_day_window
+from .fortune_history import get_archive_cutoff, user_id_batches
+from .fortune_service import FORTUNE_RANKS, GOOD_FORTUNES
+from .luck import LuckDistribution, luck_histogram, luck_score
+
+
+def previous_day(day_key: str) -> str:
+    return (date.fromisoformat(day_key) - timedelta(days=1)).isoformat()
+
+
+def apply_draw(state: Optional[dict], day_key: str, value: str) -> dict:
+    """The achievements after the fortune `value` of business day `day_key`."""
+    state = dict(state or {})
+    last_day = state.get("streak_day")
+    if last_day is not None and day_key <= last_day:
+        return state  # Already counted (or older than what is counted).
+
+    current = state.get("current_streak", 0) + 1 if last_day == previous_day(day_key) else 1
+    state["streak_day"] = day_key
+    state["current_streak"] = current
+    state["longest_streak"] = max(state.get("longest_streak", 0), current)
+
+    state["draws"] = state.get("draws", 0) + 1
+    state["rank_sum"] = state.get("rank_sum", 0) + FORTUNE_RANKS.get(value, 0)
+
+    month = day_key[:7]
+    if state.get("month") != month:
+        state["month"], state["month_good"], state["month_score"] = month, 0, 0
+    state["month_good"] += value in GOOD_FORTUNES
+    state["month_score"] += FORTUNE_RANKS.get(value, 0)
+    if (state["month_good"], state["month_score"]) > (state.get("luckiest_good", 0), state.get("luckiest_score", 0)):
+        state["luckiest_month"] = month
+        state["luckiest_good"] = state["month_good"]
+        state["luckiest_score"] = state["month_score"]
+    return state
+
+
+def achievements_view(
+    state: Optional[dict], tz_name: Optional[str], distribution: Optional[LuckDistribution] = None
+) -> dict:
+    """
+    Profile fields. A streak whose last day is before yesterday (user-local) is broken.
+    `luck_percentile` needs the histogram (`await luck_histogram.get(db)`).
+    """
+    state = state or {}
+    today = get_day_window(tz_name).key
+    last_day = state.get("streak_day")
+    current = state.get("current_streak", 0) if last_day in (today, previous_day(today)) else 0
+    score = luck_score(state)
+    return {
+        "current_streak": current,
+        "longest_streak": state.get("longest_streak", 0),
+        "luckiest_month": state.get("luckiest_month"),
+        "luck_score": round(score, 3) if score is not None else None,
+        "luck_percentile": distribution.percentile(score) if distribution is not None else None,
+    }
+
+
+async def record_draw_achievements(
+    db: AsyncIOMotorDatabase, user_id_obj: ObjectId, previous: Optional[dict], day_key: str, value: str
+) -> dict:
+    """
+    Applies a recorded draw on top of `previous` (the state the request read). The
+    write is conditional on that state being unchanged, so a concurrent or repeated
+    call for the same day cannot count it twice. Only a write that went through
+    moves the user's luck score in the histogram. Returns the state after the draw.
+    """
+    state = apply_draw(previous, day_key, value)
+    if state == (previous or {}):
+        return state
+    result = await db.users.update_one(
+        {"_id": user_id_obj, "achievements.streak_day": (previous or {}).get("streak_day")},
+        {"$set": {"achievements": state}}
+    )
+    if result.modified_count:
+        await luck_histogram.record_move(db, previous, state)
+    return state
+
+
+async def _achievements_for(db: AsyncIOMotorDatabase, user_ids: List[ObjectId]) -> Dict[ObjectId, dict]:
+    """Folds the full history of these users, oldest day first: archived months, then hot days."""
+    states: Dict[ObjectId, dict] = {user_id: {} for user_id in user_ids}
+    cutoff = await get_archive_cutoff(db)
+    if cutoff is not None:
+        async for bucket in db.fortune_archive.find(
+            {"user_id": {"$in": user_ids}, "month": {"$lt": cutoff}},
+            {"_id": 0, "user_id": 1, "month": 1, "days": 1}
+        ).sort([("user_id", ASCENDING), ("month", ASCENDING)]):
+            state = states[bucket["user_id"]]
+            for day in sorted(bucket["days"]):
+                state = apply_draw(state, f"{bucket['month']}-{day}", bucket["days"][day]["value"])
+            states[bucket["user_id"]] = state
+
+    hot_query = {"user_id": {"$in": user_ids}}
+    if cutoff is not None:
+        hot_query["date"] = {"$gte": cutoff}
+    async for doc in db.fortunes.find(hot_query, {"_id": 0, "user_id": 1, "date": 1, "value": 1}).sort(
+        [("user_id", ASCENDING), ("date", ASCENDING)]
+    ):
+        states[doc["user_id"]] = apply_draw(states[doc["user_id"]], doc["date"], doc["value"])
+    return states
+
+
+async def recompute_achievements(
+    db: AsyncIOMotorDatabase,
+    batch_size: int = 500,
+    start_after: Optional[ObjectId] = None,
+    on_batch: Optional[Callable[[ObjectId, int], Awaitable[None]]] = None,
+) -> int:
+    """
+    Rebuilds `achievements` for every user from their fortune history, `batch_size`
+    users at a time in _id order, so memory is bounded by one batch. `on_batch(last_id,
+    processed)` runs after each batch (checkpointing). Returns the number of users.
+    Draws made while a batch is being rebuilt may be overwritten; rerunning fixes them.
+    """
+    processed = 0
+    async for user_ids in user_id_batches(db, batch_size, start_after=start_after):
+        states = await _achievements_for(db, user_ids)
+        await db.users.bulk_write([
+            UpdateOne({"_id": user_id}, {"$set": {"achievements": state}} if state else {"$unset": {"achievements": ""}})
+            for user_id, state in states.items()
+        ], ordered=False)
+        processed += len(user_ids)
+        if on_batch is not None:
+            await on_batch(user_ids[-1], processed)
+    return processed
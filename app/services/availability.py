@@ -0,0 +1,187 @@
+# app/services/availability.py
+#
+# Availability checks for registration identifiers, run before the password is
+# hashed. Username and email lookups project only the indexed field so they are
+# answered from the unique indexes; an in-memory Bloom filter of taken names
+# answers "definitely free" without a query at all. The unique indexes remain the
+# authority: a name the filter has not seen yet (taken by another worker since its
+# last catch-up, or renamed to there since its last rebuild) still fails at insert
+# time with DuplicateKeyError.
+
+import asyncio
+import hashlib
+import logging
+import math
+import time
+import unicodedata
+from datetime import datetime, timedelta, timezone
+from typing import List, Optional, Set
+
+from bson import ObjectId
+from motor.motor_asyncio import AsyncIOMotorDatabase
+from pymongo.collation import Collation
+
+from ..core.config import settings
+
+logger = logging.getLogger("api_logger")
+
+# Must match the collation of the display_name_unique index (see app/core/migrations.py).
+DISPLAY_NAME_COLLATION = Collation(locale="en", strength=2)
+
+# ObjectIds are generated by the clients: a catch-up rescans this far back so a user
+# inserted by a worker whose clock runs behind is not skipped.
+CATCH_UP_OVERLAP = timedelta(minutes=5)
+
+
+def name_key(name: str) -> str:
+    """
+    Filter key of a name: NFKC plus case folding, which maps the case and width /
+    compatibility variants the strength-2 collation ignores ("Ｋevin", "ﬁne") onto
+    plain letters. It still does not reproduce the collation for every script,
+    which is why the filter only answers for ASCII names (see `might_be_taken`).
+    """
+    return unicodedata.normalize("NFKC", unicodedata.normalize("NFKC", name).casefold()).casefold()
+
+
+class BloomFilter:
+    """Fixed-size Bloom filter over strings (double hashing on one blake2b digest)."""
+
+    def __init__(self, capacity: int, error_rate: float):
+        capacity = max(1, capacity)
+        self.capacity = capacity
+        self.size = max(64, int(-capacity * math.log(error_rate) / (math.log(2) ** 2)))
+        self.hash_count = max(1, round(self.size / capacity * math.log(2)))
+        self.count = 0
+        self._bits = bytearray((self.size + 7) // 8)
+
+    def _positions(self, item: str):
+        digest = hashlib.blake2b(item.encode(), digest_size=16).digest()
+        h1 = int.from_bytes(digest[:8], "little")
+        h2 = int.from_bytes(digest[8:], "little") | 1
+        return ((h1 + i * h2) % self.size for i in range(self.hash_count))
+
+    def add(self, item: str) -> None:
+        positions = list(self._positions(item))
+        if all(self._bits[position >> 3] & (1 << (position & 7)) for position in positions):
+            return  # Already in (or a false positive): re-adding must not count it twice.
+        for position in positions:
+            self._bits[position >> 3] |= 1 << (position & 7)
+        self.count += 1
+
+    def __contains__(self, item: str) -> bool:
+        return all(self._bits[position >> 3] & (1 << (position & 7)) for position in self._positions(item))
+
+
+class TakenNames:
+    """
+    Bloom filter of every username and display name in use, keyed by `name_key`.
+    Built in the background on first use; every AVAILABILITY_BLOOM_REFRESH_SECONDS
+    it catches up with the users created since (by other workers or imports) with
+    an _id range read, and it is rebuilt from a full scan only every
+    AVAILABILITY_BLOOM_REBUILD_SECONDS or once it holds more names than it was
+    sized for, which also drops freed names and picks up renames made elsewhere.
+    Until the first build finishes every name counts as possibly taken.
+    """
+
+    def __init__(self):
+        self._filter: Optional[BloomFilter] = None
+        self._built_at = 0.0
+        self._caught_up_at = 0.0
+        self._scanned_from: Optional[datetime] = None
+        self._task: Optional[asyncio.Task] = None
+        self._rebuilding = False
+        self._pending: List[str] = []
+
+    def might_be_taken(self, name: str) -> bool:
+        # Outside ASCII the key may miss a collation match: only the index can say "free".
+        return self._filter is None or not name.isascii() or name_key(name) in self._filter
+
+    def add(self, *names: str) -> None:
+        for name in names:
+            key = name_key(name)
+            if self._filter is not None:
+                self._filter.add(key)
+            if self._rebuilding:
+                self._pending.append(key)
+
+    def refresh_if_stale(self, db: AsyncIOMotorDatabase) -> None:
+        if self._task is not None:
+            return
+        now = time.monotonic()
+        if (self._filter is None or now - self._built_at > settings.AVAILABILITY_BLOOM_REBUILD_SECONDS
+                or self._filter.count > self._filter.capacity):
+            self._rebuilding = True
+            self._task = asyncio.create_task(self._build(db))
+        elif now - self._caught_up_at > settings.AVAILABILITY_BLOOM_REFRESH_SECONDS:
+            self._task = asyncio.create_task(self._catch_up(db))
+
+    async def _add_users(self, db: AsyncIOMotorDatabase, bloom: BloomFilter, query: dict) -> None:
+        async for doc in db.users.find(query, {"_id": 0, "username": 1, "display_name": 1}):
+            bloom.add(name_key(doc["username"]))
+            if doc.get("display_name"):
+                bloom.add(name_key(doc["display_name"]))
+
+    async def _build(self, db: AsyncIOMotorDatabase) -> None:
+        try:
+            started = time.perf_counter()
+            scanned_from = datetime.now(timezone.utc)
+            user_count = await db.users.estimated_document_count()
+            # Two names per user, with headroom for registrations until the next rebuild.
+            bloom = BloomFilter(
+                max(settings.AVAILABILITY_BLOOM_CAPACITY, user_count * 4),
+                settings.AVAILABILITY_BLOOM_ERROR_RATE
+            )
+            await self._add_users(db, bloom, {})
+            for key in self._pending:
+                bloom.add(key)
+            self._filter = bloom
+            self._built_at = self._caught_up_at = time.monotonic()
+            self._scanned_from = scanned_from
+            logger.info(
+                f"Availability filter built: {bloom.count} names, {bloom.size // 8192} KiB "
+                f"in {(time.perf_counter() - started) * 1000:.1f}ms."
+            )
+        except Exception as e:
+            logger.warning(f"Availability filter build failed, falling back to index lookups: {e}")
+        finally:
+            self._pending = []
+            self._rebuilding = False
+            self._task = None
+
+    async def _catch_up(self, db: AsyncIOMotorDatabase) -> None:
+        try:
+            scanned_from = datetime.now(timezone.utc)
+            since = ObjectId.from_datetime(self._scanned_from - CATCH_UP_OVERLAP)
+            await self._add_users(db, self._filter, {"_id": {"$gte": since}})
+            self._scanned_from = scanned_from
+        except Exception as e:
+            logger.warning(f"Availability filter catch-up failed, retrying at the next refresh: {e}")
+        finally:
+            self._caught_up_at = time.monotonic()
+            self._task = None
+
+
+taken_names = TakenNames()
+
+
+async def find_taken(db: AsyncIOMotorDatabase, username: Optional[str] = None, email: Optional[str] = None) -> Set[str]:
+    """
+    Returns which of "username", "display_name" and "email" are already in use
+    for a registration with this username/email. A new account's display name
+    is its username, so the username is also checked against display names.
+    """
+    checks = {}
+    if username is not None:
+        taken_names.refresh_if_stale(db)
+        if taken_names.might_be_taken(username):
+            checks["username"] = db.users.find_one({"username": username.lower()}, {"_id": 0, "username": 1})
+            checks["display_name"] = db.users.find_one(
+                {"display_name": username}, {"_id": 1}, collation=DISPLAY_NAME_COLLATION
+            )
+    if email is not None:
+        checks["email"] = db.users.find_one({"email": email.lower()}, {"_id": 0, "email": 1})
+    if not checks:
+        return set()
+
+    results = await asyncio.gather(*checks.values())
+    return {field for field, doc in zip(checks, results) if doc is not None}
@@ -0,0 +1,490 @@
+# app/services/avatar_proxy.py
+#
+# Proxy for the third-party images on user profiles: the QQ avatar (when
+# `use_qq_avatar`), `avatar_url` and `background_url`, served by
+# GET /users/u/{username}/avatar and /background. An upstream image is fetched
+# once per AVATAR_CACHE_TTL_SECONDS (concurrent misses share the fetch) and kept,
+# with the smaller standard sizes derived from it, in a disk cache under
+# AVATAR_CACHE_DIR bounded to AVATAR_CACHE_MAX_BYTES by LRU eviction. A cached
+# file is named
+#
+#     <key>.<etag>.<stored at, unix ts>.<ext>
+#
+# so the index is rebuilt from a directory listing at startup and conditional
+# requests (If-None-Match) are answered without touching the file.
+#
+# Fetching is done by `avatar_proxy.fetcher`, an ImageFetcher; the default one
+# only talks to public http(s) hosts: every address the host resolves to, at each
+# redirect, must be globally routable, the body is capped at AVATAR_PROXY_MAX_BYTES
+# and must be a JPEG, PNG, GIF, WebP or AVIF image by its magic bytes. Tests and
+# development can swap in another fetcher or set AVATAR_PROXY_ALLOW_PRIVATE_HOSTS
+# to point profiles at a local stand-in server.
+
+import asyncio
+import hashlib
+import io
+import ipaddress
+import logging
+import os
+import secrets
+import socket
+import time
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+from functools import lru_cache
+from typing import Dict, List, NamedTuple, Optional, Tuple
+from urllib.parse import urljoin, urlsplit
+
+from ..core.config import settings
+from .draw_admission import RequestCoalescer
+
+logger = logging.getLogger("api_logger")
+
+MAX_REDIRECTS = 3
+FAILURE_CACHE_MAX_ENTRIES = 4096
+TEMP_SUFFIX = ".tmp"
+
+# Content type -> (file extension, Pillow format of resized copies).
+IMAGE_TYPES = {
+    "image/jpeg": ("jpg", "JPEG"),
+    "image/png": ("png", "PNG"),
+    "image/gif": ("gif", "PNG"),
+    "image/webp": ("webp", "WEBP"),
+    "image/avif": ("avif", "PNG"),
+}
+FORMAT_TYPES = {"JPEG": "image/jpeg", "PNG": "image/png", "WEBP": "image/webp"}
+EXTENSION_TYPES = {extension: content_type for content_type, (extension, _) in IMAGE_TYPES.items()}
+
+
+class ImageUnavailable(Exception):
+    """The upstream image cannot be served; the message is the response detail."""
+
+
+def sniff_image_type(content: bytes) -> Optional[str]:
+    """Content type from the magic bytes; upstream Content-Type headers are not trusted."""
+    if content.startswith(b"\xff\xd8\xff"):
+        return "image/jpeg"
+    if content.startswith(b"\x89PNG\r\n\x1a\n"):
+        return "image/png"
+    if content.startswith((b"GIF87a", b"GIF89a")):
+        return "image/gif"
+    if content[:4] == b"RIFF" and content[8:12] == b"WEBP":
+        return "image/webp"
+    if content[4:12] in (b"ftypavif", b"ftypavis"):
+        return "image/avif"
+    return None
+
+
+def image_url(user_doc: dict, kind: str) -> Optional[str]:
+    """Upstream URL of the user's avatar or background, if one is set."""
+    if kind == "avatar" and user_doc.get("use_qq_avatar") and user_doc.get("qq"):
+        return settings.AVATAR_PROXY_QQ_URL.format(qq=user_doc["qq"])
+    url = (user_doc.get(f"{kind}_url") or "").strip()
+    return url if urlsplit(url).scheme in ("http", "https") else None
+
+
+def standard_sizes(kind: str) -> List[int]:
+    setting = settings.AVATAR_PROXY_AVATAR_SIZES if kind == "avatar" else settings.AVATAR_PROXY_BACKGROUND_SIZES
+    return sorted(int(size) for size in setting.split(",") if size.strip())
+
+
+def standard_size(kind: str, requested: Optional[int]) -> Optional[int]:
+    """The smallest standard size covering `requested` (the largest one beyond it); None for the original."""
+    if requested is None:
+        return None
+    sizes = standard_sizes(kind)
+    if not sizes:
+        return None
+    return next((size for size in sizes if size >= requested), sizes[-1])
+
+
+def cache_key(url: str, size: Optional[int] = None, source_etag: str = "") -> str:
+    """Originals are keyed by URL; resized copies also by the original's etag, so they follow its content."""
+    return hashlib.sha256(f"{url}\n{size or ''}\n{source_etag}".encode()).hexdigest()[:32]
+
+
+# --- Resizing (optional: needs Pillow) ---
+
+@lru_cache(maxsize=None)
+def _pillow():
+    try:
+        from PIL import Image
+    except ImportError:
+        logger.warning("Pillow is not installed: proxied images are served at their original size.")
+        return None
+    return Image
+
+
+def resizing_available() -> bool:
+    return _pillow() is not None
+
+
+def resize(content: bytes, size: int) -> Optional[Tuple[bytes, str]]:
+    """
+    (image, content type) scaled to fit `size` x `size`; None when the original
+    already fits, is animated, or is not worth decoding (too large, corrupt).
+    """
+    Image = _pillow()
+    try:
+        with Image.open(io.BytesIO(content)) as image:
+            if max(image.size) <= size or getattr(image, "is_animated", False):
+                return None
+            if image.width * image.height > settings.AVATAR_PROXY_MAX_PIXELS:
+                return None
+            format = IMAGE_TYPES.get(Image.MIME.get(image.format, ""), (None, "PNG"))[1]
+            # JPEG only: decodes at the smallest power-of-two scale still >= size.
+            image.draft(image.mode, (size, size))
+            image.thumbnail((size, size), Image.LANCZOS)
+            if format == "JPEG" and image.mode not in ("RGB", "L"):
+                image = image.convert("RGB")
+            out = io.BytesIO()
+            if format == "PNG":
+                image.save(out, format, optimize=True)
+            else:
+                image.save(out, format, quality=85)
+    except (OSError, ValueError, Image.DecompressionBombError) as e:
+        logger.warning(f"Could not resize a proxied image: {e}")
+        return None
+    return out.getvalue(), FORMAT_TYPES[format]
+
+
+# --- Fetching ---
+
+class UpstreamImage(NamedTuple):
+    content: bytes
+    content_type: str
+
+
+class ImageFetcher(ABC):
+    """Downloads an upstream image. Raises ImageUnavailable when it cannot."""
+
+    @abstractmethod
+    async def fetch(self, url: str) -> UpstreamImage:
+        ...
+
+    async def close(self) -> None:
+        pass
+
+
+async def check_public_host(url: str) -> None:
+    """Refuses URLs that are not http(s) on the default ports of a host with only global addresses."""
+    parts = urlsplit(url)
+    if parts.scheme not in ("http", "https") or not parts.hostname:
+        raise ImageUnavailable("Unsupported image URL.")
+    if settings.AVATAR_PROXY_ALLOW_PRIVATE_HOSTS:
+        return
+    try:
+        port = parts.port
+    except ValueError:
+        raise ImageUnavailable("Unsupported image URL.")
+    if port not in (None, 80, 443):
+        raise ImageUnavailable("Image host is not allowed.")
+    try:
+        infos = await asyncio.get_running_loop().getaddrinfo(
+            parts.hostname, port or (443 if parts.scheme == "https" else 80), type=socket.SOCK_STREAM
+        )
+    except socket.gaierror:
+        raise ImageUnavailable("Image host does not resolve.")
+    for info in infos:
+        address = ipaddress.ip_address(info[4][0].split("%")[0])
+        if isinstance(address, ipaddress.IPv6Address) and address.ipv4_mapped is not None:
+            address = address.ipv4_mapped
+        if not address.is_global or address.is_multicast:
+            raise ImageUnavailable("Image host is not allowed.")
+
+
+class HttpImageFetcher(ImageFetcher):
+    """
+    httpx-based fetcher with the checks above, following at most MAX_REDIRECTS
+    redirects itself so each hop is checked. The host is resolved again when
+    connecting; egress filtering is still advisable against DNS rebinding.
+    """
+
+    def __init__(self):
+        self._client = None
+
+    def _get_client(self):
+        if self._client is None:
+            import httpx
+            self._client = httpx.AsyncClient(
+                follow_redirects=False,
+                headers={"Accept": "image/*", "User-Agent": "DailyFortune-ImageProxy"},
+                timeout=settings.AVATAR_PROXY_TIMEOUT_SECONDS,
+            )
+        return self._client
+
+    async def fetch(self, url: str) -> UpstreamImage:
+        try:
+            return await asyncio.wait_for(self._fetch(url), settings.AVATAR_PROXY_TIMEOUT_SECONDS)
+        except asyncio.TimeoutError:
+            raise ImageUnavailable("Image host timed out.")
+
+    async def _fetch(self, url: str) -> UpstreamImage:
+        import httpx
+
+        for _ in range(MAX_REDIRECTS + 1):
+            await check_public_host(url)
+            try:
+                async with self._get_client().stream("GET", url) as response:
+                    if response.is_redirect:
+                        url = urljoin(url, response.headers.get("location", ""))
+                        continue
+                    if response.status_code != 200:
+                        raise ImageUnavailable(f"Image host answered {response.status_code}.")
+                    limit = settings.AVATAR_PROXY_MAX_BYTES
+                    if int(response.headers.get("content-length") or 0) > limit:
+                        raise ImageUnavailable("Image is too large.")
+                    body = bytearray()
+                    async for chunk in response.aiter_bytes():
+                        body += chunk
+                        if len(body) > limit:
+                            raise ImageUnavailable("Image is too large.")
+                    return UpstreamImage(bytes(body), response.headers.get("content-type", ""))
+            except httpx.HTTPError as e:
+                raise ImageUnavailable(f"Image host unreachable ({type(e).__name__}).")
+        raise ImageUnavailable("Too many redirects.")
+
+    async def close(self) -> None:
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+
+
+# --- Disk cache ---
+
+class CachedImage(NamedTuple):
+    name: str
+    size: int
+    etag: str
+    content_type: str
+    stored_at: int
+
+    @classmethod
+    def parse(cls, name: str, size: int) -> Optional[Tuple[str, "CachedImage"]]:
+        """(key, entry) for a cache file name; None for anything else in the directory."""
+        parts = name.split(".")
+        if len(parts) != 4 or parts[3] not in EXTENSION_TYPES or not parts[2].isdigit():
+            return None
+        return parts[0], cls(name, size, parts[1], EXTENSION_TYPES[parts[3]], int(parts[2]))
+
+
+class DiskImageCache:
+    """
+    LRU index of the files under AVATAR_CACHE_DIR, kept on the event loop; file
+    reads and writes run in threads. Files are written under a temporary name and
+    renamed, so a reader never sees a partial image. A file that disappeared (evicted
+    by another worker) counts as a miss.
+    """
+
+    def __init__(self):
+        self.entries: "OrderedDict[str, CachedImage]" = OrderedDict()
+        self.bytes = 0
+        self._loaded = False
+        self._load_lock = asyncio.Lock()
+
+    def __len__(self) -> int:
+        return len(self.entries)
+
+    def _path(self, name: str) -> str:
+        return os.path.join(settings.AVATAR_CACHE_DIR, name)
+
+    async def load(self) -> None:
+        """Indexes the files already on disk, least recently used first, on first use."""
+        if self._loaded:
+            return
+        async with self._load_lock:
+            if self._loaded:
+                return
+            for key, entry in await asyncio.to_thread(self._scan):
+                self._add(key, entry)
+            self._loaded = True
+            await self._evict()
+
+    def _scan(self) -> List[Tuple[str, CachedImage]]:
+        os.makedirs(settings.AVATAR_CACHE_DIR, exist_ok=True)
+        found = []
+        with os.scandir(settings.AVATAR_CACHE_DIR) as it:
+            for item in it:
+                if not item.is_file():
+                    continue
+                stat = item.stat()
+                if item.name.endswith(TEMP_SUFFIX) and stat.st_mtime < time.time() - 60:
+                    os.remove(item.path)
+                    continue
+                parsed = CachedImage.parse(item.name, stat.st_size)
+                if parsed is not None:
+                    found.append((stat.st_mtime, parsed))
+        found.sort(key=lambda item: item[0])
+        return [parsed for _, parsed in found]
+
+    def _add(self, key: str, entry: CachedImage) -> None:
+        previous = self.entries.pop(key, None)
+        if previous is not None:
+            self.bytes -= previous.size
+        self.entries[key] = entry
+        self.bytes += entry.size
+
+    def lookup(self, key: str) -> Optional[CachedImage]:
+        entry = self.entries.get(key)
+        if entry is not None:
+            self.entries.move_to_end(key)
+        return entry
+
+    async def read(self, key: str, entry: CachedImage) -> Optional[bytes]:
+        try:
+            return await asyncio.to_thread(self._read, entry.name)
+        except FileNotFoundError:
+            if self.entries.get(key) is entry:
+                del self.entries[key]
+                self.bytes -= entry.size
+            return None
+
+    def _read(self, name: str) -> bytes:
+        path = self._path(name)
+        with open(path, "rb") as f:
+            content = f.read()
+        # The mtime orders the LRU index rebuilt at the next startup.
+        os.utime(path)
+        return content
+
+    async def store(self, key: str, content: bytes, content_type: str, stored_at: int) -> CachedImage:
+        etag = hashlib.sha256(content).hexdigest()[:16]
+        entry = CachedImage(
+            f"{key}.{etag}.{stored_at}.{IMAGE_TYPES[content_type][0]}", len(content), etag, content_type, stored_at
+        )
+        previous = self.entries.get(key)
+        await asyncio.to_thread(self._write, entry.name, content)
+        self._add(key, entry)
+        if previous is not None and previous.name != entry.name:
+            await asyncio.to_thread(self._remove, [previous.name])
+        await self._evict()
+        return entry
+
+    def _write(self, name: str, content: bytes) -> None:
+        os.makedirs(settings.AVATAR_CACHE_DIR, exist_ok=True)
+        temp = self._path(f"{name}.{secrets.token_hex(4)}{TEMP_SUFFIX}")
+        with open(temp, "wb") as f:
+            f.write(content)
+        os.replace(temp, self._path(name))
+
+    async def _evict(self) -> None:
+        victims = []
+        while self.bytes > settings.AVATAR_CACHE_MAX_BYTES and len(self.entries) > 1:
+            _, entry = self.entries.popitem(last=False)
+            self.bytes -= entry.size
+            victims.append(entry.name)
+        if victims:
+            await asyncio.to_thread(self._remove, victims)
+
+    def _remove(self, names: List[str]) -> None:
+        for name in names:
+            try:
+                os.remove(self._path(name))
+            except FileNotFoundError:
+                pass
+
+
+# --- Proxy ---
+
+class ProxiedImage(NamedTuple):
+    entry: CachedImage
+    # None when the client's If-None-Match already matches `entry.etag`.
+    content: Optional[bytes]
+    # Served past AVATAR_CACHE_TTL_SECONDS because the upstream could not be reached.
+    stale: bool
+
+
+class AvatarProxy:
+    def __init__(self, fetcher: ImageFetcher):
+        self.fetcher = fetcher
+        self.cache = DiskImageCache()
+        self._fetches = RequestCoalescer()
+        self._failures: Dict[str, Tuple[float, str]] = {}
+
+    async def get(self, url: str, size: Optional[int], if_none_match: str = "") -> ProxiedImage:
+        """
+        The image at `url`, scaled to `size` when smaller than the original. The
+        body is read only when `if_none_match` does not match its etag.
+        """
+        await self.cache.load()
+        for _ in range(2):
+            key, entry, content, stale = await self._original(url)
+            if size is not None and resizing_available():
+                key, entry, content = await self._resized(url, size, key, entry, content)
+            if etag_matches(if_none_match, entry.etag):
+                return ProxiedImage(entry, None, stale)
+            if content is None:
+                content = await self.cache.read(key, entry)
+            if content is not None:
+                return ProxiedImage(entry, content, stale)
+            # Evicted between lookup and read: look again (the original is refetched if it went too).
+        raise ImageUnavailable("Image is not available right now.")
+
+    async def _original(self, url: str) -> Tuple[str, CachedImage, Optional[bytes], bool]:
+        key = cache_key(url)
+        entry = self.cache.lookup(key)
+        if entry is not None and time.time() - entry.stored_at < settings.AVATAR_CACHE_TTL_SECONDS:
+            return key, entry, None, False
+        try:
+            entry, content = await self._fetches.run(url, lambda: self._refresh(url, key))
+        except ImageUnavailable:
+            entry = self.cache.lookup(key)
+            if entry is None:
+                raise
+            return key, entry, None, True
+        return key, entry, content, False
+
+    async def _refresh(self, url: str, key: str) -> Tuple[CachedImage, bytes]:
+        failure = self._failures.get(url)
+        if failure is not None and failure[0] > time.monotonic():
+            raise ImageUnavailable(failure[1])
+        try:
+            image = await self.fetcher.fetch(url)
+            content_type = sniff_image_type(image.content)
+            if content_type is None:
+                raise ImageUnavailable("Upstream content is not a supported image.")
+        except ImageUnavailable as e:
+            if len(self._failures) >= FAILURE_CACHE_MAX_ENTRIES:
+                self._failures.clear()
+            self._failures[url] = (time.monotonic() + settings.AVATAR_PROXY_FAILURE_TTL_SECONDS, str(e))
+            raise
+        self._failures.pop(url, None)
+        entry = await self.cache.store(key, image.content, content_type, int(time.time()))
+        return entry, image.content
+
+    async def _resized(
+        self, url: str, size: int, key: str, entry: CachedImage, content: Optional[bytes]
+    ) -> Tuple[str, CachedImage, Optional[bytes]]:
+        """The cached copy at `size`, made from the original on a miss; the original if it already fits."""
+        resized_key = cache_key(url, size, entry.etag)
+        resized = self.cache.lookup(resized_key)
+        if resized is not None:
+            return resized_key, resized, None
+        if content is None:
+            content = await self.cache.read(key, entry)
+            if content is None:
+                return key, entry, None
+        made = await self._fetches.run(resized_key, lambda: self._resize(resized_key, content, size, entry.stored_at))
+        if made is None:
+            return key, entry, content
+        return resized_key, made[0], made[1]
+
+    async def _resize(self, key: str, content: bytes, size: int, stored_at: int) -> Optional[Tuple[CachedImage, bytes]]:
+        scaled = await asyncio.to_thread(resize, content, size)
+        if scaled is None:
+            return None
+        return await self.cache.store(key, scaled[0], scaled[1], stored_at), scaled[0]
+
+    async def close(self) -> None:
+        await self.fetcher.close()
+
+
+def etag_matches(if_none_match: str, etag: str) -> bool:
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == "*":
+        return True
+    return any(tag.strip().removeprefix("W/").strip('"') == etag for tag in if_none_match.split(","))
+
+
+avatar_proxy = AvatarProxy(HttpImageFetcher())
@@ -0,0 +1,252 @@
+# app/services/draw_admission.py
+#
+# Admission layer for POST /fortune/draw. At the day-reset boundary every active
+# client retries at once; this module spreads the retries out (jittered hints),
+# collapses duplicate in-flight draws per user, and optionally batches the
+# resulting inserts into insert_many calls with bounded latency. Draws answered
+# while the database is unreachable are kept in `deferred_draws` and replayed
+# once it is back (see app/core/resilience.py).
+
+import asyncio
+import hashlib
+import logging
+from datetime import datetime, timedelta
+from collections import OrderedDict
+from typing import Awaitable, Callable, Dict, List, Optional, Set, Tuple
+
+from motor.motor_asyncio import AsyncIOMotorDatabase
+from pymongo.errors import BulkWriteError, DuplicateKeyError
+
+from ..core.config import settings
+
+logger = logging.getLogger("api_logger")
+
+DUPLICATE_KEY_ERROR_CODE = 11000
+
+
+def jittered_next_draw_at(user_id: str, next_draw_at: datetime) -> datetime:
+    """
+    Spreads clients that retry exactly at `next_draw_at` over a window of
+    DRAW_NEXT_AT_JITTER_SECONDS. The offset is stable per user so repeated
+    polls return the same hint.
+    """
+    window = settings.DRAW_NEXT_AT_JITTER_SECONDS
+    if window <= 0:
+        return next_draw_at
+    digest = hashlib.blake2b(user_id.encode(), digest_size=4).digest()
+    offset_ms = int.from_bytes(digest, "big") % (window * 1000)
+    return next_draw_at + timedelta(milliseconds=offset_ms)
+
+
+class RequestCoalescer:
+    """
+    Per-process single-flight: concurrent calls with the same key share the
+    result of the first one. A waiter that is cancelled (client went away)
+    does not cancel the shared execution.
+    """
+
+    def __init__(self):
+        self._inflight: Dict[str, asyncio.Future] = {}
+
+    def __len__(self) -> int:
+        return len(self._inflight)
+
+    async def run(self, key: str, factory: Callable[[], Awaitable]):
+        future = self._inflight.get(key)
+        if future is None:
+            future = asyncio.ensure_future(factory())
+            self._inflight[key] = future
+            future.add_done_callback(lambda f: self._forget(key, f))
+        return await asyncio.shield(future)
+
+    def _forget(self, key: str, future: asyncio.Future) -> None:
+        if self._inflight.get(key) is future:
+            del self._inflight[key]
+        if not future.cancelled() and future.exception() is not None:
+            # Retrieved by the waiters; silences "exception was never retrieved" if all of them left.
+            future.exception()
+
+
+class FortuneInsertQueue:
+    """
+    Smooths bursts of fortune inserts into `insert_many` batches. An insert waits
+    at most DRAW_INSERT_MAX_DELAY_MS before its batch is flushed. Per-document
+    duplicate-key failures are reported back to the caller as DuplicateKeyError,
+    exactly like a direct insert_one.
+    """
+
+    def __init__(self):
+        self._queue: Optional[asyncio.Queue] = None
+        self._task: Optional[asyncio.Task] = None
+        self._db: Optional[AsyncIOMotorDatabase] = None
+
+    @property
+    def running(self) -> bool:
+        return self._task is not None and not self._task.done()
+
+    def qsize(self) -> int:
+        return self._queue.qsize() if self._queue is not None else 0
+
+    def start(self, db: AsyncIOMotorDatabase) -> None:
+        self._db = db
+        self._queue = asyncio.Queue(maxsize=settings.DRAW_INSERT_QUEUE_MAX)
+        self._task = asyncio.create_task(self._run())
+        logger.info(
+            f"Fortune insert batching ENABLED (batch={settings.DRAW_INSERT_BATCH_SIZE}, "
+            f"max_delay={settings.DRAW_INSERT_MAX_DELAY_MS}ms)."
+        )
+
+    async def stop(self) -> None:
+        if not self.running:
+            return
+        await self._queue.join()
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        self._task = None
+
+    async def insert(self, doc: dict) -> None:
+        future = asyncio.get_running_loop().create_future()
+        await self._queue.put((doc, future))
+        await future
+
+    async def _run(self) -> None:
+        max_delay = settings.DRAW_INSERT_MAX_DELAY_MS / 1000
+        batch_size = settings.DRAW_INSERT_BATCH_SIZE
+        loop = asyncio.get_running_loop()
+        while True:
+            batch: List[Tuple[dict, asyncio.Future]] = [await self._queue.get()]
+            deadline = loop.time() + max_delay
+            while len(batch) < batch_size:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    batch.append(await asyncio.wait_for(self._queue.get(), timeout))
+                except asyncio.TimeoutError:
+                    break
+            try:
+                await self._flush(batch)
+            finally:
+                for _ in batch:
+                    self._queue.task_done()
+
+    async def _flush(self, batch: List[Tuple[dict, asyncio.Future]]) -> None:
+        failed: Dict[int, Exception] = {}
+        try:
+            await self._db.fortunes.insert_many([doc for doc, _ in batch], ordered=False)
+        except BulkWriteError as e:
+            for error in e.details.get("writeErrors", []):
+                if error.get("code") == DUPLICATE_KEY_ERROR_CODE:
+                    failed[error["index"]] = DuplicateKeyError(error.get("errmsg", "duplicate key"), DUPLICATE_KEY_ERROR_CODE, error)
+                else:
+                    failed[error["index"]] = e
+        except Exception as e:
+            logger.error(f"Batched fortune insert of {len(batch)} documents failed: {e}")
+            failed = {index: e for index in range(len(batch))}
+
+        for index, (_, future) in enumerate(batch):
+            if future.done():
+                continue
+            if index in failed:
+                future.set_exception(failed[index])
+            else:
+                future.set_result(None)
+
+
+draw_coalescer = RequestCoalescer()
+fortune_insert_queue = FortuneInsertQueue()
+
+
+async def insert_fortune(db: AsyncIOMotorDatabase, fortune_doc: dict) -> None:
+    """Inserts through the batching queue when it is running, directly otherwise."""
+    if fortune_insert_queue.running:
+        await fortune_insert_queue.insert(fortune_doc)
+    else:
+        await db.fortunes.insert_one(fortune_doc)
+
+
+_background_records: Set[asyncio.Task] = set()
+
+
+def record_fortune_in_background(
+    db: AsyncIOMotorDatabase,
+    fortune_doc: dict,
+    on_recorded: Optional[Callable[[dict], Awaitable]] = None
+) -> None:
+    """
+    Fire-and-forget `insert_fortune` for the derived draw mode, where the stored
+    document is history only. The user's last_draw_date/last_draw_at move to the
+    record only once it exists: until then the user's next draw records it again,
+    so a failed insert is retried rather than lost. `on_recorded` runs when this
+    call created the record.
+    """
+    async def record() -> None:
+        try:
+            await insert_fortune(db, fortune_doc)
+            await db.users.update_one(
+                {"_id": fortune_doc["user_id"]},
+                {"$max": {"last_draw_date": fortune_doc["date"], "last_draw_at": fortune_doc["created_at"]}}
+            )
+        except DuplicateKeyError:
+            return  # Already recorded by a concurrent draw.
+        except Exception as e:
+            logger.error(f"Failed to record fortune for user {fortune_doc['user_id']} on {fortune_doc['date']}: {e}")
+            return
+        if on_recorded is not None:
+            await on_recorded(fortune_doc)
+
+    task = asyncio.create_task(record())
+    _background_records.add(task)
+    task.add_done_callback(_background_records.discard)
+
+
+async def drain_background_records() -> None:
+    """Waits for pending background records; called on shutdown before the insert queue stops."""
+    if _background_records:
+        await asyncio.gather(*list(_background_records), return_exceptions=True)
+
+
+class DeferredDraws:
+    """
+    Draws answered during a database outage (derivation mode only: the value needs
+    no read). Each keeps the writes the normal path would have made, at most one per
+    user and day; `replay` applies them once the database is reachable again.
+    """
+
+    def __init__(self):
+        self._pending: "OrderedDict[Tuple[str, str], Tuple[dict, Optional[Callable[[dict], Awaitable]]]]" = OrderedDict()
+
+    def __len__(self) -> int:
+        return len(self._pending)
+
+    def __contains__(self, key: Tuple[str, str]) -> bool:
+        return key in self._pending
+
+    def defer(self, fortune_doc: dict, on_recorded: Optional[Callable[[dict], Awaitable]] = None) -> bool:
+        """Returns False when the queue is full and the draw cannot be accepted."""
+        key = (str(fortune_doc["user_id"]), fortune_doc["date"])
+        if key in self._pending:
+            return True
+        if len(self._pending) >= settings.DEGRADED_DRAW_QUEUE_MAX:
+            return False
+        self._pending[key] = (fortune_doc, on_recorded)
+        return True
+
+    async def replay(self, db: AsyncIOMotorDatabase) -> None:
+        if not self._pending:
+            return
+        logger.info(f"Replaying {len(self._pending)} draws deferred during the database outage.")
+        while self._pending:
+            key, (fortune_doc, on_recorded) = next(iter(self._pending.items()))
+            await db.users.update_one(
+                {"_id": fortune_doc["user_id"]}, {"$max": {"last_active_date": fortune_doc["created_at"]}}
+            )
+            record_fortune_in_background(db, fortune_doc, on_recorded=on_recorded)
+            # Dropped only once applied: a failure mid-replay leaves the rest for the next recovery.
+            del self._pending[key]
+
+
+deferred_draws = DeferredDraws()
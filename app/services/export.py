@@ -0,0 +1,171 @@
+# app/services/export.py
+#
+# Streaming exports of `users` and `fortunes` for analytics (GET /admin/export/...
+# and `python -m app.cli export`). Documents are read through server-side cursors
+# with a fixed projection and encoded batch by batch, so memory does not grow with
+# the collection. An export covers [since, until): `until` is fixed when the export
+# starts and is handed back as the watermark for the next incremental run.
+
+import csv
+import io
+import json
+import zlib
+from datetime import datetime, timedelta, timezone
+from typing import AsyncIterator, Dict, List, Optional
+
+from bson import ObjectId
+from motor.motor_asyncio import AsyncIOMotorDatabase
+
+from .fortune_history import get_archive_cutoff, shift_month
+
+EXPORT_FORMATS = ("ndjson", "csv")
+
+# Explicit allowlists: a field added to the documents later is not exported by accident.
+EXPORT_FIELDS: Dict[str, List[str]] = {
+    "users": [
+        "_id", "username", "display_name", "email", "role", "status", "is_hidden", "tags",
+        "bio", "avatar_url", "background_url", "language", "timezone", "qq", "use_qq_avatar",
+        "registration_date", "last_active_date", "last_draw_date",
+    ],
+    "fortunes": ["user_id", "date", "value", "tz", "created_at"],
+}
+
+# Incremental exports select on these fields: new draws, and users who registered or were active.
+WATERMARK_FIELDS = {"users": "last_active_date", "fortunes": "created_at"}
+
+# Documents stamped just before `until` may still be in flight; leave them to the next run.
+WATERMARK_LAG = timedelta(seconds=5)
+
+# Spreadsheets evaluate a cell starting with one of these as a formula.
+CSV_FORMULA_PREFIXES = ("=", "+", "-", "@", "\t", "\r")
+
+
+def export_until() -> datetime:
+    return datetime.now(timezone.utc).replace(microsecond=0) - WATERMARK_LAG
+
+
+def _plain(value):
+    if isinstance(value, ObjectId):
+        return str(value)
+    if isinstance(value, datetime):
+        if value.tzinfo is None:
+            value = value.replace(tzinfo=timezone.utc)
+        return value.isoformat()
+    return value
+
+
+def _csv_cell(value):
+    """Text of a CSV cell; user-written text that would run as a formula is quoted with `'`."""
+    if value is None:
+        return ""
+    if isinstance(value, (list, dict)):
+        value = json.dumps(value, ensure_ascii=False)
+    value = _plain(value)
+    if isinstance(value, str) and value.startswith(CSV_FORMULA_PREFIXES):
+        return "'" + value
+    return value
+
+
+def _window(field: str, since: Optional[datetime], until: datetime) -> dict:
+    window = {"$lt": until}
+    if since is not None:
+        window["$gte"] = since
+    return {field: window}
+
+
+async def _archived_fortunes(
+    db: AsyncIOMotorDatabase, since: Optional[datetime], until: datetime, batch_size: int
+) -> AsyncIterator[dict]:
+    """Fortunes compacted into `fortune_archive` (see app/services/fortune_history.py)."""
+    cutoff = await get_archive_cutoff(db)
+    if cutoff is None:
+        return
+    query = {"month": {"$lt": cutoff}}
+    if since is not None:
+        # Bucket months are user-local; start one month early and filter entries below.
+        query["month"]["$gte"] = shift_month(since.strftime("%Y-%m"), -1)
+    cursor = db.fortune_archive.find(query, {"_id": 0, "user_id": 1, "month": 1, "days": 1}).batch_size(batch_size)
+    async for bucket in cursor:
+        for day in sorted(bucket["days"]):
+            entry = bucket["days"][day]
+            created_at = entry["created_at"]
+            if (since is None or created_at >= since) and created_at < until:
+                yield {
+                    "user_id": bucket["user_id"],
+                    "date": f"{bucket['month']}-{day}",
+                    "value": entry["value"],
+                    "tz": entry.get("tz"),
+                    "created_at": created_at,
+                }
+
+
+async def export_documents(
+    db: AsyncIOMotorDatabase,
+    collection: str,
+    since: Optional[datetime],
+    until: datetime,
+    batch_size: int = 1000,
+) -> AsyncIterator[dict]:
+    fields = EXPORT_FIELDS[collection]
+    projection = {field: 1 for field in fields}
+    if "_id" not in fields:
+        projection["_id"] = 0
+    query = _window(WATERMARK_FIELDS[collection], since, until)
+
+    if collection == "fortunes":
+        async for doc in _archived_fortunes(db, since, until, batch_size):
+            yield doc
+        cutoff = await get_archive_cutoff(db)
+        if cutoff is not None:
+            query["date"] = {"$gte": cutoff}
+
+    async for doc in db[collection].find(query, projection).batch_size(batch_size):
+        yield doc
+
+
+async def export_stream(
+    db: AsyncIOMotorDatabase,
+    collection: str,
+    fmt: str = "ndjson",
+    since: Optional[datetime] = None,
+    until: Optional[datetime] = None,
+    compress: bool = False,
+    batch_size: int = 1000,
+) -> AsyncIterator[bytes]:
+    """
+    Encoded export as a stream of byte chunks, one per `batch_size` documents. With
+    `compress` the chunks together form a single gzip stream.
+    """
+    until = until or export_until()
+    fields = EXPORT_FIELDS[collection]
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 31) if compress else None
+    buffer = io.StringIO()
+    writer = csv.writer(buffer) if fmt == "csv" else None
+    if writer is not None:
+        writer.writerow(fields)
+
+    def take() -> bytes:
+        data = buffer.getvalue().encode()
+        buffer.seek(0)
+        buffer.truncate()
+        return compressor.compress(data) if compressor else data
+
+    pending = 0
+    async for doc in export_documents(db, collection, since, until, batch_size):
+        if writer is not None:
+            writer.writerow([_csv_cell(doc.get(field)) for field in fields])
+        else:
+            buffer.write(json.dumps({field: _plain(doc.get(field)) for field in fields}, ensure_ascii=False))
+            buffer.write("\n")
+        pending += 1
+        if pending >= batch_size:
+            chunk = take()
+            pending = 0
+            if chunk:
+                yield chunk
+
+    chunk = take()
+    if compressor:
+        chunk += compressor.flush()
+    if chunk:
+        yield chunk
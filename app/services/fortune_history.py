@@ -0,0 +1,207 @@
+# app/services/fortune_history.py
+#
+# Hot/cold layout for fortune history. `fortunes` keeps one document per user per
+# day and stays the write path (the user_date_unique index guards double draws).
+# Months before the archive cutoff are compacted into `fortune_archive`, one bucket
+# document per user per month:
+#
+#     {user_id, month: "YYYY-MM", count: N, days: {"DD": {value, tz, created_at}}}
+#
+# The cutoff ("YYYY-MM", stored in `config`) splits the two exactly: reads take
+# `fortunes` with date >= cutoff and buckets with month < cutoff, so a fortune is
+# counted once whether or not its hot copy has been deleted yet.
+
+import asyncio
+import logging
+import re
+import time
+from collections import defaultdict
+from datetime import datetime, timezone
+from typing import Dict, List, Optional, Tuple
+
+from bson import ObjectId
+from motor.motor_asyncio import AsyncIOMotorDatabase
+from pymongo import ASCENDING, UpdateOne
+
+from ..core.config import settings
+
+logger = logging.getLogger("api_logger")
+
+ARCHIVE_CUTOFF_KEY = "fortune_archive_cutoff"
+_MONTH_KEY = re.compile(r"^\d{4}-(0[1-9]|1[0-2])$")
+
+_cutoff_cache: Tuple[Optional[str], float] = (None, 0.0)
+
+
+def shift_month(month: str, delta: int) -> str:
+    year, month_number = int(month[:4]), int(month[5:7])
+    index = year * 12 + month_number - 1 + delta
+    return f"{index // 12:04d}-{index % 12 + 1:02d}"
+
+
+def latest_archivable_month(now_utc: Optional[datetime] = None) -> str:
+    """
+    The furthest the cutoff may advance: the previous UTC month stays hot, so no
+    zone's current business day can fall behind the cutoff.
+    """
+    now_utc = now_utc or datetime.now(timezone.utc)
+    return shift_month(now_utc.strftime("%Y-%m"), -1)
+
+
+async def get_archive_cutoff(db: AsyncIOMotorDatabase, refresh: bool = False) -> Optional[str]:
+    """
+    Months before the returned "YYYY-MM" live in `fortune_archive`; None when nothing
+    was ever archived. Cached for FORTUNE_ARCHIVE_CUTOFF_CACHE_SECONDS.
+    """
+    global _cutoff_cache
+    cutoff, fetched_at = _cutoff_cache
+    if refresh or time.monotonic() - fetched_at > settings.FORTUNE_ARCHIVE_CUTOFF_CACHE_SECONDS:
+        config = await db.config.find_one({"key": ARCHIVE_CUTOFF_KEY})
+        cutoff = config.get("value") if config else None
+        _cutoff_cache = (cutoff, time.monotonic())
+    return cutoff
+
+
+async def count_user_fortunes(db: AsyncIOMotorDatabase, user_id_obj: ObjectId) -> int:
+    """`total_draws`: hot documents plus archived bucket counts."""
+    cutoff = await get_archive_cutoff(db)
+    if cutoff is None:
+        return await db.fortunes.count_documents({"user_id": user_id_obj})
+
+    hot_count, buckets = await asyncio.gather(
+        db.fortunes.count_documents({"user_id": user_id_obj, "date": {"$gte": cutoff}}),
+        db.fortune_archive.find(
+            {"user_id": user_id_obj, "month": {"$lt": cutoff}}, {"_id": 0, "count": 1}
+        ).to_list(length=None)
+    )
+    return hot_count + sum(bucket["count"] for bucket in buckets)
+
+
+async def find_fortune_history(db: AsyncIOMotorDatabase, user_id_obj: ObjectId, since: datetime) -> List[dict]:
+    """Fortunes drawn at or after `since` as {created_at, value}, archived months first."""
+    projection = {"_id": 0, "created_at": 1, "value": 1}
+    hot_query = {"user_id": user_id_obj, "created_at": {"$gte": since}}
+    # Day keys are user-local, so the month before `since` may hold qualifying entries.
+    first_month = shift_month(since.strftime("%Y-%m"), -1)
+    cutoff = await get_archive_cutoff(db)
+    if cutoff is not None:
+        hot_query["date"] = {"$gte": cutoff}
+    if cutoff is None or cutoff <= first_month:
+        return await db.fortunes.find(hot_query, projection).to_list(length=None)
+
+    hot, buckets = await asyncio.gather(
+        db.fortunes.find(hot_query, projection).to_list(length=None),
+        db.fortune_archive.find(
+            {"user_id": user_id_obj, "month": {"$gte": first_month, "$lt": cutoff}},
+            {"_id": 0, "month": 1, "days": 1}
+        ).to_list(length=None)
+    )
+    history = []
+    for bucket in sorted(buckets, key=lambda b: b["month"]):
+        for day in sorted(bucket["days"]):
+            entry = bucket["days"][day]
+            if entry["created_at"] >= since:
+                history.append({"created_at": entry["created_at"], "value": entry["value"]})
+    return history + hot
+
+
+# --- Archival ---
+
+async def _archive_users(db: AsyncIOMotorDatabase, user_ids: List[ObjectId], cutoff: str) -> Tuple[int, int]:
+    """Writes the buckets for these users' fortunes before `cutoff`. Returns (fortunes, buckets)."""
+    groups: Dict[Tuple[ObjectId, str], Dict[str, dict]] = defaultdict(dict)
+    async for doc in db.fortunes.find(
+        {"user_id": {"$in": user_ids}, "date": {"$lt": cutoff}},
+        {"_id": 0, "user_id": 1, "date": 1, "value": 1, "tz": 1, "created_at": 1}
+    ):
+        groups[(doc["user_id"], doc["date"][:7])][doc["date"][8:10]] = {
+            "value": doc["value"],
+            "tz": doc.get("tz"),
+            "created_at": doc["created_at"]
+        }
+    if not groups:
+        return 0, 0
+
+    # Merge with buckets left by an earlier, interrupted run so reruns are idempotent.
+    months = sorted({month for _, month in groups})
+    async for bucket in db.fortune_archive.find(
+        {"user_id": {"$in": user_ids}, "month": {"$in": months}},
+        {"_id": 0, "user_id": 1, "month": 1, "days": 1}
+    ):
+        key = (bucket["user_id"], bucket["month"])
+        if key in groups:
+            groups[key] = {**bucket["days"], **groups[key]}
+
+    await db.fortune_archive.bulk_write([
+        UpdateOne(
+            {"user_id": user_id, "month": month},
+            {"$set": {"count": len(days), "days": days}},
+            upsert=True
+        )
+        for (user_id, month), days in groups.items()
+    ], ordered=False)
+    return sum(len(days) for days in groups.values()), len(groups)
+
+
+async def user_id_batches(db: AsyncIOMotorDatabase, batch_size: int, start_after: Optional[ObjectId] = None):
+    last_id = start_after
+    while True:
+        query = {"_id": {"$gt": last_id}} if last_id is not None else {}
+        docs = await db.users.find(query, {"_id": 1}).sort("_id", ASCENDING).limit(batch_size).to_list(length=batch_size)
+        if not docs:
+            return
+        yield [doc["_id"] for doc in docs]
+        last_id = docs[-1]["_id"]
+
+
+async def archive_fortunes(
+    db: AsyncIOMotorDatabase,
+    before_month: str,
+    batch_size: int = 500,
+    grace_seconds: Optional[float] = None
+) -> dict:
+    """
+    Moves fortunes of months before `before_month` into `fortune_archive`:
+
+    1. write the monthly buckets (not yet visible to reads);
+    2. advance the cutoff, which switches reads over to the buckets;
+    3. wait until every worker's cached cutoff has expired;
+    4. delete the archived hot documents.
+
+    Every step is idempotent, so an interrupted run is completed by running it again.
+    """
+    if not _MONTH_KEY.match(before_month):
+        raise ValueError(f"Expected a month as YYYY-MM, got {before_month!r}.")
+    if before_month > latest_archivable_month():
+        raise ValueError(f"Cannot archive {before_month} or later; the latest allowed cutoff is {latest_archivable_month()}.")
+
+    current = await get_archive_cutoff(db, refresh=True)
+    cutoff = max(before_month, current) if current else before_month
+    stats = {"cutoff": cutoff, "users": 0, "archived": 0, "buckets": 0, "deleted": 0}
+
+    logger.info(f"Fortune archive: compacting fortunes before {cutoff} (current cutoff: {current or 'none'}).")
+    async for user_ids in user_id_batches(db, batch_size):
+        archived, buckets = await _archive_users(db, user_ids, cutoff)
+        stats["users"] += len(user_ids)
+        stats["archived"] += archived
+        stats["buckets"] += buckets
+        logger.info(f"Fortune archive: {stats['users']} users scanned, {stats['archived']} fortunes in {stats['buckets']} buckets.")
+
+    if cutoff != current:
+        await db.config.update_one(
+            {"key": ARCHIVE_CUTOFF_KEY},
+            {"$set": {"value": cutoff, "updated_at": datetime.now(timezone.utc)}},
+            upsert=True
+        )
+        await get_archive_cutoff(db, refresh=True)
+        if grace_seconds is None:
+            grace_seconds = settings.FORTUNE_ARCHIVE_CUTOFF_CACHE_SECONDS + 5
+        if grace_seconds > 0:
+            logger.info(f"Fortune archive: cutoff set to {cutoff}; waiting {grace_seconds:.0f}s for workers to pick it up.")
+            await asyncio.sleep(grace_seconds)
+
+    async for user_ids in user_id_batches(db, batch_size):
+        result = await db.fortunes.delete_many({"user_id": {"$in": user_ids}, "date": {"$lt": cutoff}})
+        stats["deleted"] += result.deleted_count
+    logger.info(f"Fortune archive: done, {stats['deleted']} hot documents removed.")
+    return stats
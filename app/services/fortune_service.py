@@ -1,6 +1,18 @@
 # app/services/fortune_service.py
 
+import hashlib
+import hmac
 import random
+from datetime import datetime
+from functools import lru_cache
+from typing import Optional
+
+from bson import ObjectId
+from motor.motor_asyncio import AsyncIOMotorDatabase
+
+from ..core.config import settings
+from ..core.time_service import DayWindow, get_day_window
+from ..repository import find_fortune_value
 
 FORTUNE_TYPES = {
     'S_KICHI': '諭吉',
@@ -22,21 +34,73 @@ FORTUNE_RANKS = {
     FORTUNE_TYPES['DAI_KYO']: 1,   # <-- 更新
 }
 
+GOOD_FORTUNES = [
+    FORTUNE_TYPES['S_KICHI'],
+    FORTUNE_TYPES['DAI_KICHI'],
+    FORTUNE_TYPES['KICHI'],
+    FORTUNE_TYPES['CHU_KICHI'], # <-- 新增
+    FORTUNE_TYPES['SHO_KICHI']
+]
+BAD_FORTUNES = [FORTUNE_TYPES['KYO'], FORTUNE_TYPES['DAI_KYO']]
+# First stage: probability of drawing from the good pool.
+GOOD_POOL_PROBABILITY = 0.8
+
 def draw_fortune_logic() -> str:
     """Implements the two-stage probability model for drawing a fortune."""
-    good_fortunes = [
-        FORTUNE_TYPES['S_KICHI'], 
-        FORTUNE_TYPES['DAI_KICHI'], 
-        FORTUNE_TYPES['KICHI'], 
-        FORTUNE_TYPES['CHU_KICHI'], # <-- 新增
-        FORTUNE_TYPES['SHO_KICHI']
-    ]
-    bad_fortunes = [FORTUNE_TYPES['KYO'], FORTUNE_TYPES['DAI_KYO']]
-
     # First stage: 80% chance for a good fortune pool
-    if random.random() <= 0.8:
+    if random.random() <= GOOD_POOL_PROBABILITY:
         # Second stage: Equal chance within the good pool
-        return random.choice(good_fortunes)
+        return random.choice(GOOD_FORTUNES)
     else:
         # Second stage: Equal chance within the bad pool
-        return random.choice(bad_fortunes)
\ No newline at end of file
+        return random.choice(BAD_FORTUNES)
+
+@lru_cache(maxsize=None)
+def _derivation_key() -> bytes:
+    secret = settings.FORTUNE_DERIVATION_SECRET or settings.SECRET_KEY
+    return hashlib.sha256(b"daily-fortune-derivation:" + secret.encode()).digest()
+
+def derive_fortune(user_id: str, day_key: str) -> str:
+    """
+    Deterministic variant of `draw_fortune_logic`: the same two-stage model, driven
+    by HMAC-SHA256(key, "user_id:day_key") instead of the process RNG. The first
+    8 bytes pick the pool, the next 8 the fortune within it.
+    """
+    digest = hmac.new(_derivation_key(), f"{user_id}:{day_key}".encode(), hashlib.sha256).digest()
+    stage_one = int.from_bytes(digest[:8], "big") / 2**64
+    stage_two = int.from_bytes(digest[8:16], "big")
+    pool = GOOD_FORTUNES if stage_one <= GOOD_POOL_PROBABILITY else BAD_FORTUNES
+    return pool[stage_two % len(pool)]
+
+def todays_day_key(
+    day_window: DayWindow, last_draw_date: Optional[str] = None, last_draw_at: Optional[datetime] = None
+) -> str:
+    """
+    The day key of the user's fortune for `day_window`: the window's own key, unless
+    the latest draw was made under another timezone (another key) inside this window.
+    That draw stands until the window ends, so switching zones yields no second one.
+    """
+    if (
+        last_draw_date not in (None, day_window.key)
+        and last_draw_at is not None
+        and day_window.contains(last_draw_at)
+    ):
+        return last_draw_date
+    return day_window.key
+
+async def find_todays_fortune_value(
+    db: AsyncIOMotorDatabase,
+    user_id_obj: ObjectId,
+    tz_name: Optional[str] = None,
+    last_draw_date: Optional[str] = None,
+    last_draw_at: Optional[datetime] = None
+) -> Optional[str]:
+    """
+    Today's fortune value, or None if the user has not drawn yet. In the derived
+    mode (FORTUNE_DERIVATION_ENABLED) this needs no query: `last_draw_date` from
+    the user document says whether they drew, and the value is recomputed.
+    """
+    day_key = todays_day_key(get_day_window(tz_name), last_draw_date, last_draw_at)
+    if settings.FORTUNE_DERIVATION_ENABLED:
+        return derive_fortune(str(user_id_obj), day_key) if last_draw_date == day_key else None
+    return await find_fortune_value(db, user_id_obj, day_key)
@@ -0,0 +1,223 @@
+# app/services/leaderboard.py
+
+import asyncio
+import json
+import logging
+from datetime import datetime, timezone
+from typing import List, Optional, Set
+
+from motor.motor_asyncio import AsyncIOMotorDatabase
+
+from ..core.compression import ResponseCache
+from ..core.config import settings
+from ..core.redis_client import get_redis
+from ..core.time_service import get_day_window
+from .fortune_service import FORTUNE_RANKS
+from .luck import luck_histogram
+
+logger = logging.getLogger("api_logger")
+
+REDIS_CHANNEL = "leaderboard:deltas"
+
+# Rendered GET /fortune/leaderboard bodies (with their compressed variants), keyed by
+# (scope, zone, day key). Every delta this worker sees clears it.
+leaderboard_cache = ResponseCache(max_entries=128)
+
+
+# --- Snapshot ---
+
+def leaderboard_match(scope: str, tz_name: Optional[str] = None) -> dict:
+    """
+    scope=global: everything drawn during the current APP_TIMEZONE business day.
+    scope=zone:   draws made on the current local day of `tz_name` (default APP_TIMEZONE).
+    """
+    if scope == "zone":
+        day_window = get_day_window(tz_name)
+        return {"tz": day_window.tz_name, "date": day_window.key}
+    day_window = get_day_window()
+    return {"created_at": {"$gte": day_window.start, "$lt": day_window.next}}
+
+
+async def build_leaderboard(db: AsyncIOMotorDatabase, match: dict) -> List[dict]:
+    pipeline = [
+        {
+            "$match": match
+        },
+        {
+            "$lookup": {
+                "from": "users",
+                "localField": "user_id",
+                "foreignField": "_id",
+                "as": "user_info"
+            }
+        },
+        {
+            "$unwind": "$user_info"
+        },
+        {
+            "$group": {
+                "_id": "$value",
+                "users": {
+                    "$push": {
+                        "username": "$user_info.username",
+                        "display_name": "$user_info.display_name",
+                        "rank_sum": "$user_info.achievements.rank_sum",
+                        "draws": "$user_info.achievements.draws"
+                    }
+                }
+            }
+        },
+        {
+            "$project": {
+                "_id": 0,
+                "fortune": "$_id",
+                "users": 1
+            }
+        }
+    ]
+
+    leaderboard_cursor = db.fortunes.aggregate(pipeline)
+    leaderboard_data = await leaderboard_cursor.to_list(length=None)
+
+    leaderboard_data.sort(key=lambda item: FORTUNE_RANKS.get(item['fortune'], 0), reverse=True)
+
+    # Each user's luck percentile, from the histogram: O(1) per user, no global sort.
+    distribution = await luck_histogram.get(db)
+    for group in leaderboard_data:
+        for user in group["users"]:
+            rank_sum, draws = user.pop("rank_sum", None), user.pop("draws", None)
+            if distribution is not None and draws:
+                user["luck_percentile"] = distribution.percentile(rank_sum / draws)
+    return leaderboard_data
+
+
+def build_delta(
+    fortune_doc: dict, username: str, display_name: str, luck_percentile: Optional[float] = None
+) -> dict:
+    """The incremental leaderboard event broadcast for one new draw."""
+    return {
+        "fortune": fortune_doc["value"],
+        "user": {"username": username, "display_name": display_name, "luck_percentile": luck_percentile},
+        "date": fortune_doc["date"],
+        "tz": fortune_doc["tz"],
+        "global_date": get_day_window().key,
+    }
+
+
+# --- Push Channel ---
+
+class LeaderboardSubscription:
+    """
+    One connected client. Deltas are buffered in a bounded queue; when a slow
+    consumer lets it fill up, further deltas are dropped and the client is told
+    to resync from a fresh snapshot instead of the server buffering without bound.
+    """
+
+    def __init__(self, scope: str, tz_name: Optional[str], max_queue: int):
+        self.scope = scope
+        self.tz_name = tz_name
+        self.queue: asyncio.Queue = asyncio.Queue(maxsize=max_queue)
+        self.needs_resync = False
+        self.overflows = 0
+
+    def wants(self, delta: dict) -> bool:
+        if self.scope == "zone":
+            day_window = get_day_window(self.tz_name)
+            return delta["tz"] == day_window.tz_name and delta["date"] == day_window.key
+        return delta["global_date"] == get_day_window().key
+
+    def offer(self, delta: dict) -> None:
+        if self.needs_resync:
+            return
+        try:
+            self.queue.put_nowait(delta)
+        except asyncio.QueueFull:
+            self.needs_resync = True
+            self.overflows += 1
+
+
+class LeaderboardBroadcaster:
+    """
+    Fans draw deltas out to every subscriber of this worker. With the "redis"
+    backend deltas go through Redis pub/sub so every worker sees every draw.
+    """
+
+    def __init__(self):
+        self._subscribers: Set[LeaderboardSubscription] = set()
+        self._listener: Optional[asyncio.Task] = None
+
+    def __len__(self) -> int:
+        return len(self._subscribers)
+
+    @property
+    def uses_redis(self) -> bool:
+        return settings.LEADERBOARD_PUSH_BACKEND == "redis"
+
+    def subscribe(self, scope: str, tz_name: Optional[str] = None) -> LeaderboardSubscription:
+        subscription = LeaderboardSubscription(scope, tz_name, settings.LEADERBOARD_PUSH_QUEUE_SIZE)
+        self._subscribers.add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription: LeaderboardSubscription) -> None:
+        self._subscribers.discard(subscription)
+
+    async def publish(self, delta: dict) -> None:
+        if self.uses_redis:
+            try:
+                await get_redis().publish(REDIS_CHANNEL, json.dumps(delta, ensure_ascii=False))
+                return
+            except Exception as e:
+                logger.warning(f"Leaderboard publish to Redis failed, delivering locally only: {e}")
+        self._fanout(delta)
+
+    def _fanout(self, delta: dict) -> None:
+        leaderboard_cache.clear()
+        for subscription in self._subscribers:
+            if subscription.wants(delta):
+                subscription.offer(delta)
+
+    def start(self) -> None:
+        if self.uses_redis and self._listener is None:
+            self._listener = asyncio.create_task(self._listen())
+
+    async def stop(self) -> None:
+        if self._listener is not None:
+            self._listener.cancel()
+            try:
+                await self._listener
+            except asyncio.CancelledError:
+                pass
+            self._listener = None
+
+    async def _listen(self) -> None:
+        while True:
+            pubsub = get_redis().pubsub()
+            try:
+                await pubsub.subscribe(REDIS_CHANNEL)
+                async for message in pubsub.listen():
+                    if message.get("type") == "message":
+                        self._fanout(json.loads(message["data"]))
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.warning(f"Leaderboard Redis subscription lost, retrying: {e}")
+                # Deltas may have been missed: make every client resync.
+                leaderboard_cache.clear()
+                for subscription in self._subscribers:
+                    subscription.needs_resync = True
+                await asyncio.sleep(1)
+            finally:
+                await pubsub.aclose()
+
+
+leaderboard_broadcaster = LeaderboardBroadcaster()
+
+
+def sse_event(event: str, data) -> bytes:
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False, default=_json_default)}\n\n".encode()
+
+
+def _json_default(value):
+    if isinstance(value, datetime):
+        return value.astimezone(timezone.utc).isoformat()
+    raise TypeError(f"{type(value).__name__} is not JSON serializable")
@@ -0,0 +1,191 @@
+# app/services/luck.py
+#
+# "Luckier than X% of users". A user's luck score is the mean fortune rank over
+# their whole history (rank_sum / draws in their achievements state, see
+# app/services/achievements.py), so it lies in [1, 7]. Percentiles come from a
+# histogram of every user's score over LUCK_HISTOGRAM_BINS fixed-width bins,
+# kept in `config`:
+#
+#     {key: "luck_histogram", bin_count: N, bins: [count, ...], users: U, built_at}
+#
+# Each draw moves its user from the old bin to the new one with a single `$inc`;
+# `rebuild_luck_histogram` recounts it exactly from the users collection, which
+# runs periodically to wash out drift (draws racing a rebuild, failed writes).
+# Workers cache the histogram with its cumulative counts for
+# LUCK_HISTOGRAM_CACHE_SECONDS, so a percentile lookup is O(1) after an O(bins) load.
+
+import asyncio
+import logging
+import time
+from datetime import datetime, timedelta, timezone
+from itertools import accumulate
+from typing import List, Optional
+
+from motor.motor_asyncio import AsyncIOMotorDatabase
+
+from ..core.config import settings
+from .fortune_service import FORTUNE_RANKS
+
+logger = logging.getLogger("api_logger")
+
+LUCK_HISTOGRAM_KEY = "luck_histogram"
+MIN_RANK = min(FORTUNE_RANKS.values())
+MAX_RANK = max(FORTUNE_RANKS.values())
+
+
+def luck_score(state: Optional[dict]) -> Optional[float]:
+    """Mean fortune rank of a user's history; None before their first draw."""
+    draws = (state or {}).get("draws", 0)
+    if not draws:
+        return None
+    return state["rank_sum"] / draws
+
+
+def luck_bin(score: float, bin_count: int) -> int:
+    # Same arithmetic as the rebuild pipeline, so both put a score in the same bin.
+    return min(max(int((score - MIN_RANK) * (bin_count / (MAX_RANK - MIN_RANK))), 0), bin_count - 1)
+
+
+class LuckDistribution:
+    """One loaded histogram with its running totals."""
+
+    def __init__(self, bins: List[int], built_at: Optional[datetime] = None):
+        self.bins = bins
+        self.built_at = built_at
+        self.cumulative = list(accumulate(bins, initial=0))
+
+    @property
+    def users(self) -> int:
+        return self.cumulative[-1]
+
+    def percentile(self, score: Optional[float]) -> Optional[float]:
+        """
+        Share of the other users with a lower score, in percent, for a user counted
+        in the histogram. The others in the same bin count as half below, half above.
+        """
+        if score is None or self.users <= 0:
+            return None
+        others = self.users - 1
+        if others == 0:
+            return 0.0
+        index = luck_bin(score, len(self.bins))
+        below = self.cumulative[index] + max(self.bins[index] - 1, 0) / 2
+        return round(min(100 * below / others, 100.0), 1)
+
+
+class LuckHistogram:
+    """The per-worker cached copy of the histogram plus its periodic rebuild."""
+
+    def __init__(self):
+        self._cached: Optional[LuckDistribution] = None
+        self._fetched_at = 0.0
+        self._task: Optional[asyncio.Task] = None
+
+    async def get(self, db: AsyncIOMotorDatabase) -> Optional[LuckDistribution]:
+        """The cached distribution; None when no histogram for the current bin count exists yet."""
+        if time.monotonic() - self._fetched_at > settings.LUCK_HISTOGRAM_CACHE_SECONDS:
+            doc = await db.config.find_one(
+                {"key": LUCK_HISTOGRAM_KEY, "bin_count": settings.LUCK_HISTOGRAM_BINS},
+                {"_id": 0, "bins": 1, "built_at": 1}
+            )
+            self._cached = LuckDistribution(doc["bins"], doc.get("built_at")) if doc else None
+            self._fetched_at = time.monotonic()
+        return self._cached
+
+    @property
+    def cached(self) -> Optional[LuckDistribution]:
+        """The copy held right now, without refreshing it."""
+        return self._cached
+
+    def invalidate(self) -> None:
+        self._fetched_at = 0.0
+
+    async def record_move(self, db: AsyncIOMotorDatabase, previous: Optional[dict], state: dict) -> None:
+        """Moves one user between bins after a draw changed their state from `previous` to `state`."""
+        bin_count = settings.LUCK_HISTOGRAM_BINS
+        old_score, new_score = luck_score(previous), luck_score(state)
+        new_bin = luck_bin(new_score, bin_count)
+        increments = {f"bins.{new_bin}": 1}
+        if old_score is None:
+            increments["users"] = 1
+        else:
+            old_bin = luck_bin(old_score, bin_count)
+            if old_bin == new_bin:
+                return
+            increments[f"bins.{old_bin}"] = -1
+        # No upsert: until the first rebuild there is nothing to keep current.
+        await db.config.update_one(
+            {"key": LUCK_HISTOGRAM_KEY, "bin_count": bin_count},
+            {"$inc": increments}
+        )
+
+    def start(self, db: AsyncIOMotorDatabase) -> None:
+        if settings.LUCK_HISTOGRAM_REBUILD_SECONDS > 0 and self._task is None:
+            self._task = asyncio.create_task(self._rebuild_periodically(db))
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def _rebuild_periodically(self, db: AsyncIOMotorDatabase) -> None:
+        interval = settings.LUCK_HISTOGRAM_REBUILD_SECONDS
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                if await _claim_rebuild(db, interval):
+                    await rebuild_luck_histogram(db)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.warning(f"Luck histogram rebuild failed: {e}")
+
+
+luck_histogram = LuckHistogram()
+
+
+async def _claim_rebuild(db: AsyncIOMotorDatabase, interval: float) -> bool:
+    """Only the worker that moves `built_at` forward rebuilds; the others see a fresh snapshot."""
+    now = datetime.now(timezone.utc)
+    result = await db.config.update_one(
+        {"key": LUCK_HISTOGRAM_KEY, "built_at": {"$lt": now - timedelta(seconds=interval * 0.9)}},
+        {"$set": {"built_at": now}}
+    )
+    if result.modified_count:
+        return True
+    return await db.config.count_documents({"key": LUCK_HISTOGRAM_KEY}) == 0
+
+
+async def rebuild_luck_histogram(db: AsyncIOMotorDatabase) -> dict:
+    """Recounts the histogram exactly from every user's achievements. Returns the stored document."""
+    bin_count = settings.LUCK_HISTOGRAM_BINS
+    bins = [0] * bin_count
+    pipeline = [
+        {"$match": {"achievements.draws": {"$gt": 0}}},
+        {"$project": {
+            "_id": 0,
+            "bin": {"$floor": {"$multiply": [
+                {"$subtract": [{"$divide": ["$achievements.rank_sum", "$achievements.draws"]}, MIN_RANK]},
+                bin_count / (MAX_RANK - MIN_RANK)
+            ]}}
+        }},
+        {"$group": {"_id": "$bin", "users": {"$sum": 1}}}
+    ]
+    async for group in db.users.aggregate(pipeline):
+        bins[min(max(int(group["_id"]), 0), bin_count - 1)] += group["users"]
+
+    doc = {
+        "key": LUCK_HISTOGRAM_KEY,
+        "bin_count": bin_count,
+        "bins": bins,
+        "users": sum(bins),
+        "built_at": datetime.now(timezone.utc),
+    }
+    await db.config.replace_one({"key": LUCK_HISTOGRAM_KEY}, doc, upsert=True)
+    luck_histogram.invalidate()
+    logger.info(f"Luck histogram rebuilt: {doc['users']} users over {bin_count} bins.")
+    return doc
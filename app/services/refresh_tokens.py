@@ -0,0 +1,247 @@
+# app/services/refresh_tokens.py
+#
+# Rotating refresh tokens. Every refresh JWT carries a `jti` and the id of its
+# family (`fam`, one per login); POST /auth/refresh spends the presented token and
+# issues the next one of the same family. State lives in a revocation store with
+# compact keys that expire together with the tokens they describe:
+#
+#     rt:j:<jti>   "1" while unspent, "u:<unix ts>" once spent
+#     rt:f:<fam>   present when the family was revoked (logout, reuse)
+#     rt:u:<user>  unix ts; refresh tokens issued before it are dead (password change)
+#
+# A refresh is one round trip (a pipeline) and never touches MongoDB. Presenting
+# an already spent token means it was copied: the whole family is revoked, which
+# also kills the descendant the legitimate client holds. Spending within
+# REFRESH_TOKEN_REUSE_GRACE_SECONDS is treated as a client race (two tabs
+# refreshing at once) and only rejected.
+#
+# REFRESH_TOKEN_STORE_BACKEND="redis" shares the store between workers; "memory" is
+# for single-worker setups. While Redis is unreachable the store fails closed:
+# logins, refreshes and logouts answer 503. REFRESH_TOKEN_OUTAGE_FALLBACK opts into
+# an in-process store that trusts unknown (but correctly signed) tokens instead,
+# which keeps users logged in through the outage but also accepts tokens revoked
+# before it, until they expire.
+
+import logging
+import secrets
+import time
+from datetime import datetime
+from typing import Dict, Optional, Tuple
+
+from fastapi import Response
+from jose import JWTError, jwt
+
+from ..core.config import settings
+from ..core.redis_client import get_redis
+from ..core.security import create_refresh_token
+
+logger = logging.getLogger("api_logger")
+
+LIVE = "1"
+SPENT_PREFIX = "u:"
+FALLBACK_LOG_INTERVAL_SECONDS = 10.0
+
+
+class RefreshTokenError(Exception):
+    """The refresh token cannot be used; the message is the response detail."""
+
+
+class RefreshTokenStoreUnavailable(Exception):
+    """Redis is unreachable and REFRESH_TOKEN_OUTAGE_FALLBACK is off."""
+
+
+def _token_ttl() -> int:
+    return settings.REFRESH_TOKEN_EXPIRE_DAYS * 24 * 60 * 60
+
+
+# --- Stores ---
+
+class RedisTokenStore:
+    async def issue(self, jti: str, ttl: int) -> None:
+        await get_redis().set(f"rt:j:{jti}", LIVE, ex=ttl)
+
+    async def exchange(self, jti: str, family: str, user_id: str, new_jti: str, now: int, ttl: int) -> Tuple:
+        """Spends `jti` and registers `new_jti`. Returns (previous jti state, family state, user cutoff)."""
+        pipe = get_redis().pipeline(transaction=False)
+        pipe.set(f"rt:j:{jti}", f"{SPENT_PREFIX}{now}", xx=True, get=True, keepttl=True)
+        pipe.get(f"rt:f:{family}")
+        pipe.get(f"rt:u:{user_id}")
+        pipe.set(f"rt:j:{new_jti}", LIVE, ex=ttl)
+        previous, family_state, cutoff, _ = await pipe.execute()
+        return previous, family_state, cutoff
+
+    async def discard(self, jti: str) -> None:
+        await get_redis().delete(f"rt:j:{jti}")
+
+    async def revoke_family(self, family: str, ttl: int) -> None:
+        await get_redis().set(f"rt:f:{family}", LIVE, ex=ttl)
+
+    async def revoke_user(self, user_id: str, before: int, ttl: int) -> None:
+        await get_redis().set(f"rt:u:{user_id}", before, ex=ttl)
+
+
+class MemoryTokenStore:
+    """
+    The same keys in a dict of (value, expires_at). Expired entries are swept
+    whenever the dict has doubled since the last sweep.
+    """
+
+    def __init__(self, trust_unknown: bool = False):
+        self.trust_unknown = trust_unknown
+        self._entries: Dict[str, Tuple[str, float]] = {}
+        self._sweep_at = 1024
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def _get(self, key: str) -> Optional[str]:
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        if entry[1] <= time.monotonic():
+            del self._entries[key]
+            return None
+        return entry[0]
+
+    def _set(self, key: str, value: str, ttl: float) -> None:
+        self._entries[key] = (value, time.monotonic() + ttl)
+        if len(self._entries) >= self._sweep_at:
+            now = time.monotonic()
+            self._entries = {k: entry for k, entry in self._entries.items() if entry[1] > now}
+            self._sweep_at = max(1024, 2 * len(self._entries))
+
+    async def issue(self, jti: str, ttl: int) -> None:
+        self._set(f"rt:j:{jti}", LIVE, ttl)
+
+    async def exchange(self, jti: str, family: str, user_id: str, new_jti: str, now: int, ttl: int) -> Tuple:
+        key = f"rt:j:{jti}"
+        previous = self._get(key)
+        if previous is None and self.trust_unknown:
+            previous = LIVE
+        if previous is not None:
+            remaining = self._entries[key][1] - time.monotonic() if key in self._entries else ttl
+            self._set(key, f"{SPENT_PREFIX}{now}", remaining)
+        self._set(f"rt:j:{new_jti}", LIVE, ttl)
+        return previous, self._get(f"rt:f:{family}"), self._get(f"rt:u:{user_id}")
+
+    async def discard(self, jti: str) -> None:
+        self._entries.pop(f"rt:j:{jti}", None)
+
+    async def revoke_family(self, family: str, ttl: int) -> None:
+        self._set(f"rt:f:{family}", LIVE, ttl)
+
+    async def revoke_user(self, user_id: str, before: int, ttl: int) -> None:
+        self._set(f"rt:u:{user_id}", str(before), ttl)
+
+
+class RefreshTokenStore:
+    """The configured backend; while Redis fails, the in-process fallback if enabled."""
+
+    def __init__(self):
+        self.redis = RedisTokenStore()
+        self.memory = MemoryTokenStore()
+        self.fallback = MemoryTokenStore(trust_unknown=True)
+        self._last_fallback_log = 0.0
+
+    async def call(self, operation: str, *args):
+        if settings.REFRESH_TOKEN_STORE_BACKEND != "redis":
+            return await getattr(self.memory, operation)(*args)
+        try:
+            return await getattr(self.redis, operation)(*args)
+        except Exception as e:
+            fallback = settings.REFRESH_TOKEN_OUTAGE_FALLBACK
+            now = time.monotonic()
+            if now - self._last_fallback_log >= FALLBACK_LOG_INTERVAL_SECONDS:
+                self._last_fallback_log = now
+                logger.warning(
+                    f"Refresh token store: Redis unavailable, "
+                    f"{'using the in-process fallback' if fallback else 'refusing token operations'}: {e}"
+                )
+            if not fallback:
+                raise RefreshTokenStoreUnavailable() from e
+            return await getattr(self.fallback, operation)(*args)
+
+
+refresh_token_store = RefreshTokenStore()
+
+
+# --- Tokens ---
+
+def _new_id() -> str:
+    return secrets.token_urlsafe(12)
+
+
+async def issue_refresh_token(user_id: str, role: Optional[str], issued_at: Optional[datetime] = None) -> str:
+    """
+    The first token of a new family (a login). `role` rides along so refreshed access
+    tokens carry the `role` claim (an admission priority hint) without a database read.
+    """
+    jti = _new_id()
+    await refresh_token_store.call("issue", jti, _token_ttl())
+    return create_refresh_token(
+        data={"sub": user_id, "role": role, "jti": jti, "fam": _new_id()}, issued_at=issued_at
+    )
+
+
+def _decode(token: str) -> dict:
+    try:
+        payload = jwt.decode(token, settings.SECRET_KEY, algorithms=[settings.ALGORITHM])
+    except JWTError:
+        raise RefreshTokenError("Invalid token")
+    if payload.get("type") != "refresh":
+        raise RefreshTokenError("Invalid token type")
+    if not all(payload.get(claim) for claim in ("sub", "jti", "fam", "iat")):
+        # Also refresh tokens issued before rotation existed: their holders log in again.
+        raise RefreshTokenError("Invalid token")
+    return payload
+
+
+async def rotate_refresh_token(token: str) -> Tuple[str, Optional[str], str]:
+    """Spends `token` and returns (user id, role, the next token of its family)."""
+    payload = _decode(token)
+    user_id, role, jti, family = payload["sub"], payload.get("role"), payload["jti"], payload["fam"]
+    now, ttl = int(time.time()), _token_ttl()
+    new_jti = _new_id()
+
+    previous, family_state, cutoff = await refresh_token_store.call(
+        "exchange", jti, family, user_id, new_jti, now, ttl
+    )
+    if previous == LIVE and family_state is None and (cutoff is None or payload["iat"] >= int(cutoff)):
+        return user_id, role, create_refresh_token(
+            data={"sub": user_id, "role": role, "jti": new_jti, "fam": family}
+        )
+
+    await refresh_token_store.call("discard", new_jti)
+    if previous is not None and previous.startswith(SPENT_PREFIX) and family_state is None:
+        spent_at = int(previous[len(SPENT_PREFIX):])
+        if now - spent_at > settings.REFRESH_TOKEN_REUSE_GRACE_SECONDS:
+            await refresh_token_store.call("revoke_family", family, ttl)
+            logger.warning(f"Refresh token reuse detected for user {user_id}; token family revoked.")
+            raise RefreshTokenError("Refresh token reuse detected")
+    raise RefreshTokenError("Refresh token revoked")
+
+
+async def revoke_refresh_token(token: Optional[str]) -> None:
+    """Logout: ends the token's family. Invalid or missing tokens are ignored."""
+    try:
+        payload = _decode(token) if token else None
+    except RefreshTokenError:
+        return
+    if payload is not None:
+        await refresh_token_store.call("revoke_family", payload["fam"], _token_ttl())
+
+
+async def revoke_user_refresh_tokens(user_id: str, before: int) -> None:
+    """Kills every refresh token of the user issued before the unix time `before`."""
+    await refresh_token_store.call("revoke_user", user_id, before, _token_ttl())
+
+
+def set_refresh_cookie(response: Response, refresh_token: str) -> None:
+    response.set_cookie(
+        key="refresh_token",
+        value=refresh_token,
+        httponly=True,
+        secure=False, # Set to True in production with HTTPS
+        samesite="lax",
+        max_age=settings.REFRESH_TOKEN_EXPIRE_DAYS * 24 * 60 * 60
+    )
@@ -0,0 +1,234 @@
+# app/services/user_import.py
+#
+# Bulk account creation for admins (POST /admin/users/import and
+# `python -m app.cli users import`). The input is CSV with a header row or NDJSON,
+# one user per row with the registration fields (username, email, password);
+# other columns are ignored. Rows are processed USER_IMPORT_BATCH_SIZE at a time:
+#
+#   1. validation with UserCreate; a username or email repeated in the input is
+#      rejected at its second occurrence;
+#   2. one query for usernames and emails that already exist, so re-running a
+#      partly applied import does not pay bcrypt for the rows already in;
+#   3. bcrypt on a process pool, in slices of HASH_SLICE passwords per task, at
+#      USER_IMPORT_BCRYPT_ROUNDS; hashes below the normal cost are upgraded at the
+#      user's first login. The CLI gets a pool of USER_IMPORT_HASH_WORKERS; the
+#      HTTP endpoint shares one small pool (USER_IMPORT_API_HASH_WORKERS) per
+#      worker between all imports, so serving requests keeps some CPU;
+#   4. an unordered insert_many, where a unique-index conflict fails only its row.
+#
+# The insert of one batch overlaps the hashing of the next. Rejected rows are
+# reported with their row number (1 = the first user) and never abort the import.
+
+import asyncio
+import csv
+import json
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime, timezone
+from typing import Any, Awaitable, Callable, Iterable, Iterator, List, Optional, Tuple
+
+from motor.motor_asyncio import AsyncIOMotorDatabase
+from pydantic import ValidationError
+from pymongo.errors import BulkWriteError
+
+from ..core.config import settings
+from ..core.security import hash_passwords
+from ..models.user import UserCreate
+from ..repository import duplicate_user_field, new_user_doc
+from .availability import taken_names
+
+IMPORT_FORMATS = ("csv", "ndjson")
+IMPORT_FIELDS = ("username", "email", "password")
+HASH_SLICE = 32
+
+Row = Tuple[int, UserCreate]
+
+
+def read_rows(lines: Iterable[str], format: str) -> Iterator[Tuple[int, Any]]:
+    """(row number, fields dict) per input row; a string instead of the dict when it cannot be parsed."""
+    if format == "csv":
+        yield from enumerate(csv.DictReader(lines), start=1)
+        return
+    number = 0
+    for line in lines:
+        if not line.strip():
+            continue
+        number += 1
+        try:
+            fields = json.loads(line)
+        except ValueError as e:
+            yield number, f"Invalid JSON: {e}"
+            continue
+        yield number, fields if isinstance(fields, dict) else "Expected a JSON object."
+
+
+def _validate(fields: Any) -> Tuple[Optional[UserCreate], Optional[str]]:
+    if isinstance(fields, str):
+        return None, fields
+    try:
+        return UserCreate(**{field: fields.get(field) for field in IMPORT_FIELDS}), None
+    except ValidationError as e:
+        return None, "; ".join(f"{'.'.join(map(str, error['loc']))}: {error['msg']}" for error in e.errors())
+
+
+def _new_report() -> dict:
+    return {"rows": 0, "imported": 0, "invalid": [], "conflicts": []}
+
+
+def _conflict(report: dict, number: int, user: UserCreate, field: str, source: str) -> None:
+    report["conflicts"].append({"row": number, "username": user.username, "field": field, "source": source})
+
+
+async def _drop_existing(db: AsyncIOMotorDatabase, batch: List[Row], report: dict) -> List[Row]:
+    usernames = [user.username.lower() for _, user in batch]
+    emails = [user.email.lower() for _, user in batch]
+    taken_usernames, taken_emails = set(), set()
+    cursor = db.users.find(
+        {"$or": [{"username": {"$in": usernames}}, {"email": {"$in": emails}}]},
+        {"_id": 0, "username": 1, "email": 1}
+    )
+    async for doc in cursor:
+        taken_usernames.add(doc["username"])
+        taken_emails.add(doc["email"])
+
+    candidates = []
+    for number, user in batch:
+        if user.username.lower() in taken_usernames:
+            _conflict(report, number, user, "username", "existing")
+        elif user.email.lower() in taken_emails:
+            _conflict(report, number, user, "email", "existing")
+        else:
+            candidates.append((number, user))
+    return candidates
+
+
+async def _hash(pool: ProcessPoolExecutor, passwords: List[str], rounds: int) -> List[str]:
+    loop = asyncio.get_running_loop()
+    slices = await asyncio.gather(*(
+        loop.run_in_executor(pool, hash_passwords, passwords[i:i + HASH_SLICE], rounds)
+        for i in range(0, len(passwords), HASH_SLICE)
+    ))
+    return [password_hash for hashes in slices for password_hash in hashes]
+
+
+async def _insert(db: AsyncIOMotorDatabase, candidates: List[Row], hashes: List[str], report: dict) -> None:
+    if not candidates:
+        return
+    now = datetime.now(timezone.utc).replace(microsecond=0)
+    docs = [new_user_doc(user.username, user.email, password_hash, now)
+            for (_, user), password_hash in zip(candidates, hashes)]
+    failed = {}
+    try:
+        await db.users.insert_many(docs, ordered=False)
+    except BulkWriteError as e:
+        failed = {error["index"]: error for error in e.details.get("writeErrors", [])}
+
+    for index, ((number, user), doc) in enumerate(zip(candidates, docs)):
+        error = failed.get(index)
+        if error is None:
+            report["imported"] += 1
+            taken_names.add(doc["username"], doc["display_name"])
+        elif error.get("code") == 11000:
+            _conflict(report, number, user, duplicate_user_field(error) or "unknown", "existing")
+        else:
+            report["invalid"].append({"row": number, "error": error.get("errmsg", "Write failed.")})
+
+
+def _new_pool(workers: int) -> ProcessPoolExecutor:
+    # spawn: forking a process that runs an event loop and driver threads is unsafe.
+    return ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn"))
+
+
+class SharedHashPool:
+    """
+    The hashing pool of POST /admin/users/import: started by the first import,
+    shared by the ones that follow (and run concurrently), shut down with the app.
+    """
+
+    def __init__(self):
+        self._pool: Optional[ProcessPoolExecutor] = None
+
+    def get(self) -> ProcessPoolExecutor:
+        if self._pool is None:
+            self._pool = _new_pool(settings.USER_IMPORT_API_HASH_WORKERS)
+        return self._pool
+
+    async def close(self) -> None:
+        pool, self._pool = self._pool, None
+        if pool is not None:
+            await asyncio.to_thread(pool.shutdown)
+
+
+shared_hash_pool = SharedHashPool()
+
+
+async def import_users(
+    db: AsyncIOMotorDatabase,
+    rows: Iterable[Tuple[int, Any]],
+    batch_size: Optional[int] = None,
+    workers: Optional[int] = None,
+    rounds: Optional[int] = None,
+    on_batch: Optional[Callable[[dict], Awaitable[None]]] = None,
+    pool: Optional[ProcessPoolExecutor] = None,
+) -> dict:
+    """
+    Imports the rows of `read_rows` and returns the report: counts of rows and
+    imported users, and the rejected rows under `invalid` and `conflicts`.
+    `on_batch(report)` runs after each batch is inserted. Hashes on `pool` if
+    given, otherwise on a pool of `workers` processes started for this import.
+    """
+    batch_size = batch_size or settings.USER_IMPORT_BATCH_SIZE
+    rounds = rounds or settings.USER_IMPORT_BCRYPT_ROUNDS
+    report = _new_report()
+    seen_usernames, seen_emails = set(), set()
+
+    def valid_batches() -> Iterator[List[Row]]:
+        batch: List[Row] = []
+        for number, fields in rows:
+            report["rows"] += 1
+            user, error = _validate(fields)
+            if user is None:
+                report["invalid"].append({"row": number, "error": error})
+                continue
+            username, email = user.username.lower(), user.email.lower()
+            if username in seen_usernames:
+                _conflict(report, number, user, "username", "input")
+                continue
+            if email in seen_emails:
+                _conflict(report, number, user, "email", "input")
+                continue
+            seen_usernames.add(username)
+            seen_emails.add(email)
+            batch.append((number, user))
+            if len(batch) >= batch_size:
+                yield batch
+                batch = []
+        if batch:
+            yield batch
+
+    own_pool = pool is None
+    if own_pool:
+        pool = _new_pool(workers or settings.USER_IMPORT_HASH_WORKERS or os.cpu_count() or 1)
+    try:
+        inserting: Optional[asyncio.Task] = None
+        for batch in valid_batches():
+            candidates = await _drop_existing(db, batch, report)
+            hashes = await _hash(pool, [user.password for _, user in candidates], rounds)
+            if inserting is not None:
+                await inserting
+                if on_batch is not None:
+                    await on_batch(report)
+            inserting = asyncio.create_task(_insert(db, candidates, hashes, report))
+        if inserting is not None:
+            await inserting
+            if on_batch is not None:
+                await on_batch(report)
+    finally:
+        if own_pool:
+            # shutdown() waits for the workers to exit; not on the event loop.
+            await asyncio.to_thread(pool.shutdown)
+
+    report["invalid"].sort(key=lambda item: item["row"])
+    report["conflicts"].sort(key=lambda item: item["row"])
+    return report
@@ -0,0 +1,378 @@
+# benchmarks/access_log.py
+#
+# Offline tools for the access log RequestContextMiddleware writes (api.log):
+#
+#     ... - INFO - user="<sub>" ip="1.2.3.4" method="GET" path="/users/me" status=200 duration=12.34ms request_id="..."
+#
+#   analyze  streams any number of log files (plain or .gz; --rotated adds the
+#            RotatingFileHandler backups api.log.N) into per-endpoint request
+#            counts, error rates and latency percentiles, plus the busiest users
+#            and IPs. Memory stays constant: latencies go into log-scale
+#            histograms (about 1% relative error) and the top-N tables are lossy
+#            counters that keep a bounded number of keys.
+#   replay   sends the logged traffic to a running instance, at the original
+#            pace divided by --speed. Bodies are not logged, so only GET/HEAD are
+#            replayed unless --include-writes (sent without a body). With
+#            --secret-key, requests carry an access token for the logged user.
+#            The replayed requests are reported like `analyze` does.
+#
+#     python -m benchmarks.access_log analyze api.log --rotated --top 10 --output report.json
+#     python -m benchmarks.access_log replay api.log.1.gz --target http://127.0.0.1:8000 --speed 10
+
+import argparse
+import asyncio
+import gzip
+import json
+import math
+import os
+import re
+import sys
+import time
+from datetime import datetime, timedelta, timezone
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
+
+LINE = re.compile(
+    r'^(?:(?P<ts>\d{4}-\d\d-\d\d \d\d:\d\d:\d\d,\d{3}) - \w+ - )?'
+    r'user="(?P<user>[^"]*)" ip="(?P<ip>[^"]*)" method="(?P<method>[A-Z]+)" path="(?P<path>[^"]*)" '
+    r'status=(?P<status>\d+) duration=(?P<duration>[\d.]+)ms'
+)
+TIMESTAMP_FORMAT = "%Y-%m-%d %H:%M:%S,%f"
+
+# Path segments that vary per request, folded so that an endpoint is one row.
+ROUTE_PATTERNS = (
+    (re.compile(r"^/users/u/[^/]+"), "/users/u/{username}"),
+    (re.compile(r"/[0-9a-f]{24}(?=/|$)"), "/{id}"),
+    (re.compile(r"/\d+(?=/|$)"), "/{n}"),
+)
+ANONYMOUS_USERS = frozenset({"anonymous", "invalid_token", "unknown"})
+REPLAYED_METHODS = frozenset({"GET", "HEAD"})
+
+
+# --- Reading ---
+
+class Entry:
+    __slots__ = ("started_at", "user", "ip", "method", "path", "status", "duration_ms")
+
+    def __init__(self, started_at: Optional[datetime], user: str, ip: str, method: str, path: str,
+                 status: int, duration_ms: float):
+        self.started_at = started_at
+        self.user = user
+        self.ip = ip
+        self.method = method
+        self.path = path
+        self.status = status
+        self.duration_ms = duration_ms
+
+
+def with_rotated(paths: Iterable[str]) -> List[str]:
+    """Each path preceded by its existing backups (api.log.5[.gz] ... api.log.1[.gz]), oldest first."""
+    ordered = []
+    for path in paths:
+        backups = []
+        for name in os.listdir(os.path.dirname(path) or "."):
+            match = re.fullmatch(re.escape(os.path.basename(path)) + r"\.(\d+)(\.gz)?", name)
+            if match:
+                backups.append((int(match.group(1)), os.path.join(os.path.dirname(path), name)))
+        ordered.extend(name for _, name in sorted(backups, reverse=True))
+        ordered.append(path)
+    return ordered
+
+
+def read_lines(paths: Iterable[str]) -> Iterator[str]:
+    for path in paths:
+        if path == "-":
+            yield from sys.stdin
+            continue
+        opener = gzip.open if path.endswith(".gz") else open
+        with opener(path, "rt", encoding="utf-8", errors="replace") as f:
+            yield from f
+
+
+def parse_entries(lines: Iterable[str], since: Optional[datetime] = None,
+                  until: Optional[datetime] = None) -> Iterator[Entry]:
+    """Access-log entries; other log lines are skipped. Times are request starts (completion - duration)."""
+    for line in lines:
+        if 'path="' not in line:
+            continue
+        match = LINE.match(line)
+        if match is None:
+            continue
+        duration_ms = float(match["duration"])
+        started_at = None
+        if match["ts"]:
+            started_at = datetime.strptime(match["ts"], TIMESTAMP_FORMAT) - timedelta(milliseconds=duration_ms)
+            if (since is not None and started_at < since) or (until is not None and started_at >= until):
+                continue
+        yield Entry(started_at, match["user"], match["ip"], match["method"], match["path"],
+                    int(match["status"]), duration_ms)
+
+
+def route_of(path: str) -> str:
+    for pattern, replacement in ROUTE_PATTERNS:
+        path = pattern.sub(replacement, path)
+    return path
+
+
+# --- Aggregation ---
+
+class LatencyHistogram:
+    """Log-scale buckets: each covers a (1 + PRECISION) ratio of latencies, so percentiles are within ~1%."""
+
+    PRECISION = 0.02
+    _LOG_BASE = math.log1p(PRECISION)
+
+    def __init__(self):
+        self.buckets: Dict[int, int] = {}
+        self.count = 0
+        self.total_ms = 0.0
+        self.max_ms = 0.0
+
+    def add(self, ms: float) -> None:
+        index = math.floor(math.log(max(ms, 0.001)) / self._LOG_BASE)
+        self.buckets[index] = self.buckets.get(index, 0) + 1
+        self.count += 1
+        self.total_ms += ms
+        self.max_ms = max(self.max_ms, ms)
+
+    def percentile(self, pct: float) -> float:
+        if not self.count:
+            return 0.0
+        rank = max(1, math.ceil(self.count * pct / 100))
+        seen = 0
+        for index in sorted(self.buckets):
+            seen += self.buckets[index]
+            if seen >= rank:
+                # Bucket midpoint, capped by the exact maximum.
+                return min(math.exp((index + 0.5) * self._LOG_BASE), self.max_ms)
+        return self.max_ms
+
+
+class TopCounter:
+    """
+    Approximate heavy hitters in bounded memory (lossy counting): once more than
+    `capacity` keys are tracked, the less frequent half is dropped. Counts of the
+    keys reported are low by at most `error`, the largest count ever dropped.
+    """
+
+    def __init__(self, capacity: int = 10000):
+        self.capacity = capacity
+        self.counts: Dict[str, int] = {}
+        self.error = 0
+
+    def add(self, key: str) -> None:
+        self.counts[key] = self.counts.get(key, 0) + 1
+        if len(self.counts) > self.capacity:
+            kept = sorted(self.counts.items(), key=lambda item: item[1], reverse=True)
+            self.error = max(self.error, kept[self.capacity // 2][1])
+            self.counts = dict(kept[:self.capacity // 2])
+
+    def top(self, n: int) -> List[Tuple[str, int]]:
+        return sorted(self.counts.items(), key=lambda item: item[1], reverse=True)[:n]
+
+
+class EndpointStats:
+    __slots__ = ("latency", "client_errors", "server_errors")
+
+    def __init__(self):
+        self.latency = LatencyHistogram()
+        self.client_errors = 0
+        self.server_errors = 0
+
+    def add(self, status: int, duration_ms: float) -> None:
+        self.latency.add(duration_ms)
+        if status >= 500:
+            self.server_errors += 1
+        elif status >= 400:
+            self.client_errors += 1
+
+
+class TrafficReport:
+    def __init__(self):
+        self.endpoints: Dict[str, EndpointStats] = {}
+        self.users = TopCounter()
+        self.ips = TopCounter()
+        self.first: Optional[datetime] = None
+        self.last: Optional[datetime] = None
+
+    def add(self, entry: Entry) -> None:
+        key = f"{entry.method} {route_of(entry.path)}"
+        stats = self.endpoints.get(key)
+        if stats is None:
+            stats = self.endpoints[key] = EndpointStats()
+        stats.add(entry.status, entry.duration_ms)
+        if entry.user not in ANONYMOUS_USERS:
+            self.users.add(entry.user)
+        self.ips.add(entry.ip)
+        if entry.started_at is not None:
+            if self.first is None or entry.started_at < self.first:
+                self.first = entry.started_at
+            if self.last is None or entry.started_at > self.last:
+                self.last = entry.started_at
+
+    def summary(self, top: int) -> dict:
+        span = (self.last - self.first).total_seconds() if self.first and self.last else 0.0
+        endpoints = {}
+        for key, stats in sorted(self.endpoints.items(), key=lambda item: item[1].latency.count, reverse=True):
+            latency = stats.latency
+            endpoints[key] = {
+                "count": latency.count,
+                "rps": round(latency.count / span, 2) if span else None,
+                "client_error_rate": round(stats.client_errors / latency.count, 4),
+                "server_error_rate": round(stats.server_errors / latency.count, 4),
+                "mean_ms": round(latency.total_ms / latency.count, 2),
+                "p50_ms": round(latency.percentile(50), 2),
+                "p90_ms": round(latency.percentile(90), 2),
+                "p99_ms": round(latency.percentile(99), 2),
+                "max_ms": round(latency.max_ms, 2),
+            }
+        return {
+            "requests": sum(stats.latency.count for stats in self.endpoints.values()),
+            "from": self.first.isoformat() if self.first else None,
+            "to": self.last.isoformat() if self.last else None,
+            "endpoints": endpoints,
+            "top_users": [{"user": key, "requests": count} for key, count in self.users.top(top)],
+            "top_users_max_undercount": self.users.error,
+            "top_ips": [{"ip": key, "requests": count} for key, count in self.ips.top(top)],
+            "top_ips_max_undercount": self.ips.error,
+        }
+
+
+def print_summary(summary: dict) -> None:
+    print(f"{summary['requests']} requests from {summary['from']} to {summary['to']}\n")
+    header = (f"{'endpoint':<40}{'count':>9}{'4xx %':>8}{'5xx %':>8}"
+              f"{'p50 ms':>10}{'p90 ms':>10}{'p99 ms':>10}{'max ms':>10}")
+    print(header)
+    print("-" * len(header))
+    for key, row in summary["endpoints"].items():
+        print(
+            f"{key[:39]:<40}{row['count']:>9}{row['client_error_rate'] * 100:>8.2f}{row['server_error_rate'] * 100:>8.2f}"
+            f"{row['p50_ms']:>10.2f}{row['p90_ms']:>10.2f}{row['p99_ms']:>10.2f}{row['max_ms']:>10.2f}"
+        )
+    for title, rows, field in (("users", summary["top_users"], "user"), ("IPs", summary["top_ips"], "ip")):
+        if rows:
+            print(f"\ntop {title}:")
+            for row in rows:
+                print(f"  {row['requests']:>9}  {row[field]}")
+
+
+# --- Replay ---
+
+def _access_token(user: str, secret_key: str, algorithm: str) -> str:
+    from jose import jwt
+    now = datetime.now(timezone.utc)
+    return jwt.encode({"sub": user, "iat": now, "exp": now + timedelta(hours=1)}, secret_key, algorithm=algorithm)
+
+
+async def replay(entries: Iterable[Entry], args: argparse.Namespace) -> Tuple[TrafficReport, dict]:
+    """Sends each entry at its original offset / speed; returns the report of what was sent."""
+    import httpx
+
+    report = TrafficReport()
+    in_flight = asyncio.Semaphore(args.max_in_flight)
+    tokens: Dict[str, str] = {}
+    counters = {"sent": 0, "skipped": 0, "failed": 0, "max_behind_ms": 0.0}
+    tasks = set()
+
+    async def send(client: httpx.AsyncClient, entry: Entry) -> None:
+        headers = {}
+        if args.secret_key and entry.user not in ANONYMOUS_USERS:
+            token = tokens.get(entry.user)
+            if token is None:
+                token = tokens[entry.user] = _access_token(entry.user, args.secret_key, args.algorithm)
+            headers["Authorization"] = f"Bearer {token}"
+        started = time.perf_counter()
+        try:
+            response = await client.request(entry.method, entry.path, headers=headers)
+            status = response.status_code
+        except httpx.HTTPError:
+            counters["failed"] += 1
+            status = 599
+        finally:
+            in_flight.release()
+        report.add(Entry(datetime.now(timezone.utc).replace(tzinfo=None), entry.user, entry.ip, entry.method,
+                         entry.path, status, (time.perf_counter() - started) * 1000))
+
+    limits = httpx.Limits(max_connections=args.max_in_flight, max_keepalive_connections=args.max_in_flight)
+    async with httpx.AsyncClient(base_url=args.target, limits=limits, timeout=args.timeout) as client:
+        trace_start: Optional[datetime] = None
+        clock_start = time.perf_counter()
+        for entry in entries:
+            if entry.method not in REPLAYED_METHODS and not args.include_writes:
+                counters["skipped"] += 1
+                continue
+            if entry.started_at is not None:
+                if trace_start is None:
+                    trace_start = entry.started_at
+                due = (entry.started_at - trace_start).total_seconds() / args.speed
+                delay = due - (time.perf_counter() - clock_start)
+                if delay > 0:
+                    await asyncio.sleep(delay)
+                else:
+                    counters["max_behind_ms"] = max(counters["max_behind_ms"], -delay * 1000)
+            await in_flight.acquire()
+            counters["sent"] += 1
+            task = asyncio.create_task(send(client, entry))
+            tasks.add(task)
+            task.add_done_callback(tasks.discard)
+        if tasks:
+            await asyncio.gather(*tasks)
+    counters["max_behind_ms"] = round(counters["max_behind_ms"], 1)
+    return report, counters
+
+
+# --- CLI ---
+
+def _timestamp(value: str) -> datetime:
+    """Log timestamps are naive local time, like the ones written by the logging module."""
+    return datetime.fromisoformat(value)
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(prog="python -m benchmarks.access_log", description="Access-log analysis and replay.")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    def add_input_arguments(sub: argparse.ArgumentParser) -> None:
+        sub.add_argument("files", nargs="+", help="Log files, plain or .gz, oldest first ('-' for stdin).")
+        sub.add_argument("--rotated", action="store_true", help="Also read each file's backups (FILE.N, FILE.N.gz).")
+        sub.add_argument("--since", type=_timestamp, default=None, help="Only requests started at or after (ISO, log local time).")
+        sub.add_argument("--until", type=_timestamp, default=None, help="Only requests started before (ISO, log local time).")
+        sub.add_argument("--top", type=int, default=10, help="Rows in the top users / IPs tables.")
+        sub.add_argument("--output", help="Write the report as JSON to this file.")
+
+    analyze = subparsers.add_parser("analyze", help="Latency percentiles, error rates and top users/IPs.")
+    add_input_arguments(analyze)
+
+    replay_parser = subparsers.add_parser("replay", help="Send the logged traffic to a running instance.")
+    add_input_arguments(replay_parser)
+    replay_parser.add_argument("--target", default="http://127.0.0.1:8000", help="Base URL of the instance.")
+    replay_parser.add_argument("--speed", type=float, default=1.0, help="Time compression: 10 replays an hour in 6 minutes.")
+    replay_parser.add_argument("--max-in-flight", type=int, default=100, help="Concurrent requests at most.")
+    replay_parser.add_argument("--timeout", type=float, default=30.0, help="Per-request timeout in seconds.")
+    replay_parser.add_argument("--include-writes", action="store_true", help="Also replay POST/PUT/PATCH/DELETE (without bodies).")
+    replay_parser.add_argument("--secret-key", default=None, help="SECRET_KEY of the target, to act as the logged users.")
+    replay_parser.add_argument("--algorithm", default="HS256")
+
+    args = parser.parse_args(argv)
+    paths = with_rotated(args.files) if args.rotated else args.files
+    entries = parse_entries(read_lines(paths), since=args.since, until=args.until)
+
+    if args.command == "analyze":
+        report = TrafficReport()
+        for entry in entries:
+            report.add(entry)
+        summary = report.summary(args.top)
+    else:
+        report, counters = asyncio.run(replay(entries, args))
+        summary = {**report.summary(args.top), "replay": counters}
+        print(f"replayed {counters['sent']} requests ({counters['skipped']} writes skipped, "
+              f"{counters['failed']} failed to connect); at most {counters['max_behind_ms']} ms behind schedule\n")
+
+    print_summary(summary)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(summary, f, indent=2)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,169 @@
+# benchmarks/avatar_proxy.py
+#
+# Avatar proxy (app/services/avatar_proxy.py) against a local stand-in for the
+# image hosts: a threaded HTTP server answering every image after
+# --upstream-latency-ms with a --image-px square PNG, counting its requests.
+#
+#   - direct: clients fetching the upstream images themselves;
+#   - cold:   the first proxied request per user (upstream fetch + resize);
+#   - warm:   the same requests again, served from the disk cache;
+#   - 304:    revalidation with If-None-Match;
+#   - the stand-in must have been asked once per image, and with the SSRF guard
+#     on, a profile pointing at it must be refused.
+#
+#     python -m benchmarks.avatar_proxy --users 200 --size 64 --output avatars.json
+#
+# Without Pillow the proxy serves originals, so cold/warm bytes equal direct.
+
+import argparse
+import asyncio
+import json
+import os
+import struct
+import sys
+import tempfile
+import threading
+import time
+import zlib
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from benchmarks.harness import (
+    RequestSpec, booted_app, configure_environment, print_report, run_requests, seed, summarize
+)
+
+
+def build_png(px: int) -> bytes:
+    """A px x px RGB gradient, compressing about as well as a photo avatar."""
+    def chunk(kind: bytes, data: bytes) -> bytes:
+        return struct.pack(">I", len(data)) + kind + data + struct.pack(">I", zlib.crc32(kind + data))
+
+    rows = b"".join(
+        b"\x00" + bytes((x * 7 + y * 3) % 256 if c == 0 else (x ^ y) % 256 if c == 1 else (x * y) % 256
+                        for x in range(px) for c in range(3))
+        for y in range(px)
+    )
+    header = struct.pack(">IIBBBBB", px, px, 8, 2, 0, 0, 0)
+    return b"\x89PNG\r\n\x1a\n" + chunk(b"IHDR", header) + chunk(b"IDAT", zlib.compress(rows, 6)) + chunk(b"IEND", b"")
+
+
+class StandIn:
+    """Image host on 127.0.0.1: every GET answers `image` after `latency` seconds."""
+
+    def __init__(self, image: bytes, latency: float):
+        self.requests = 0
+        stand_in = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                stand_in.requests += 1
+                time.sleep(latency)
+                self.send_response(200)
+                self.send_header("Content-Type", "image/png")
+                self.send_header("Content-Length", str(len(image)))
+                self.end_headers()
+                self.wfile.write(image)
+
+            def log_message(self, *args):
+                pass
+
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.server.daemon_threads = True
+        self.url = f"http://127.0.0.1:{self.server.server_address[1]}"
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+
+    def close(self) -> None:
+        self.server.shutdown()
+
+
+async def run(args: argparse.Namespace) -> dict:
+    configure_environment()
+    os.environ["AVATAR_CACHE_DIR"] = tempfile.mkdtemp(prefix="avatar-cache-")
+    os.environ["AVATAR_PROXY_ALLOW_PRIVATE_HOSTS"] = "True"
+    image = build_png(args.image_px)
+    stand_in = StandIn(image, args.upstream_latency_ms / 1000)
+
+    try:
+        async with booted_app() as (http, db):
+            import httpx
+            from app.core.config import settings
+            from app.services.avatar_proxy import resizing_available
+
+            users = await seed(db, users=args.users, history_days=0, drawn_today_fraction=0.0)
+            for user in users:
+                await db.users.update_one(
+                    {"_id": user.user_id}, {"$set": {"avatar_url": f"{stand_in.url}/avatars/{user.username}.png"}}
+                )
+
+            async with httpx.AsyncClient(base_url=stand_in.url) as direct:
+                started = time.perf_counter()
+                samples = await run_requests(direct, [
+                    RequestSpec("direct", "GET", f"/avatars/{user.username}.png") for user in users
+                ], args.concurrency)
+            upstream_after_direct = stand_in.requests
+
+            def proxied(label: str, headers=None):
+                return [
+                    RequestSpec(label, "GET", f"/users/u/{user.username}/avatar", params={"size": args.size},
+                                headers=headers or {})
+                    for user in users
+                ]
+
+            for label in ("cold", "warm"):
+                samples.update(await run_requests(http, proxied(label), args.concurrency))
+            sample = await http.get(f"/users/u/{users[0].username}/avatar", params={"size": args.size})
+            samples.update(await run_requests(
+                http, proxied("304", {"If-None-Match": sample.headers["etag"]})[:1] * args.users, args.concurrency
+            ))
+            elapsed = time.perf_counter() - started
+            upstream_fetches = stand_in.requests - upstream_after_direct
+
+            settings.AVATAR_PROXY_ALLOW_PRIVATE_HOSTS = False
+            await db.users.update_one(
+                {"_id": users[0].user_id}, {"$set": {"avatar_url": f"{stand_in.url}/elsewhere.png"}}
+            )
+            guarded = await http.get(f"/users/u/{users[0].username}/avatar")
+    finally:
+        stand_in.close()
+
+    report = summarize(samples, elapsed)
+    print_report(report, elapsed)
+    result = {
+        "users": args.users,
+        "resizing": resizing_available(),
+        "direct_bytes": len(image),
+        "proxied_bytes": len(sample.content),
+        "upstream_fetches": upstream_fetches,
+        "private_host_status": guarded.status_code,
+        "report": report,
+    }
+    for key, value in result.items():
+        if key != "report":
+            print(f"{key:<24} {value}")
+    return result
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--users", type=int, default=200)
+    parser.add_argument("--size", type=int, default=64, help="Requested avatar size (px).")
+    parser.add_argument("--image-px", type=int, default=640, help="Side of the upstream images (px).")
+    parser.add_argument("--upstream-latency-ms", type=float, default=150.0)
+    parser.add_argument("--concurrency", type=int, default=20)
+    parser.add_argument("--output", help="Write the report as JSON to this file.")
+    args = parser.parse_args(argv)
+
+    result = asyncio.run(run(args))
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(result, f, indent=2)
+    report = result["report"]
+    ok = (
+        result["upstream_fetches"] == args.users
+        and all(report[label]["errors"] == 0 for label in ("cold", "warm", "304"))
+        and result["private_host_status"] == 502
+    )
+    return 0 if ok else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
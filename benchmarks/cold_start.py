@@ -0,0 +1,170 @@
+# benchmarks/cold_start.py
+#
+# Cold-start regression benchmark. Measures, in fresh interpreters:
+#   - the import cost of `main` (python -X importtime), broken down by top-level package
+#     and by slowest module. It runs with no environment variables at all, so it fails
+#     if importing reads settings;
+#   - time-to-first-request: spawn a uvicorn worker and poll `GET /` until it answers.
+#
+#     python -m benchmarks.cold_start --output benchmarks/baselines/cold_start.json
+#     python -m benchmarks.cold_start --compare benchmarks/baselines/cold_start.json
+#
+# With the default `--mongo mock` the worker is started against mongomock-motor, so no
+# database is needed; pass a mongodb:// URL to include real connection setup.
+
+import argparse
+import json
+import os
+import platform
+import re
+import socket
+import statistics
+import subprocess
+import sys
+import time
+from collections import defaultdict
+from datetime import datetime, timezone
+
+from benchmarks.harness import BENCH_ENV, configure_environment
+
+IMPORTTIME_LINE = re.compile(r"^import time:\s+(\d+)\s+\|\s+(\d+)\s+\|(\s*)(\S+)$")
+
+MOCK_WORKER = """
+import sys, time
+t0 = time.perf_counter()
+import main
+print(f"IMPORT_MAIN {time.perf_counter() - t0}", flush=True)
+from mongomock_motor import AsyncMongoMockClient
+import app.db
+app.db.set_client(AsyncMongoMockClient(tz_aware=True))
+import uvicorn
+uvicorn.run(main.app, host="127.0.0.1", port=int(sys.argv[1]), log_level="warning")
+"""
+
+
+def _free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def measure_imports(env: dict) -> dict:
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", "import main"],
+        env=env, capture_output=True, text=True, check=True
+    )
+    modules = []
+    for line in result.stderr.splitlines():
+        match = IMPORTTIME_LINE.match(line)
+        if match:
+            self_us, cumulative_us, indent, name = match.groups()
+            modules.append((name, int(self_us), int(cumulative_us), len(indent)))
+
+    by_package = defaultdict(int)
+    for name, self_us, _, _ in modules:
+        by_package[name.split(".")[0]] += self_us
+    return {
+        "total_ms": sum(self_us for _, self_us, _, _ in modules) / 1000,
+        "module_count": len(modules),
+        "by_package_ms": {name: us / 1000 for name, us in sorted(by_package.items(), key=lambda kv: -kv[1])},
+        "slowest_modules_ms": [
+            {"module": name, "self_ms": self_us / 1000, "cumulative_ms": cumulative_us / 1000}
+            for name, self_us, cumulative_us, _ in sorted(modules, key=lambda m: -m[1])[:15]
+        ],
+    }
+
+
+def measure_first_request(env: dict, mongo: str, timeout: float = 30.0) -> dict:
+    import httpx
+
+    port = _free_port()
+    if mongo == "mock":
+        command = [sys.executable, "-c", MOCK_WORKER, str(port)]
+    else:
+        command = [sys.executable, "-m", "uvicorn", "main:app", "--port", str(port), "--log-level", "warning"]
+
+    start = time.perf_counter()
+    process = subprocess.Popen(command, env=env, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, text=True)
+    try:
+        while True:
+            if process.poll() is not None:
+                raise RuntimeError("worker exited before serving a request")
+            if time.perf_counter() - start > timeout:
+                raise RuntimeError("worker did not answer in time")
+            try:
+                if httpx.get(f"http://127.0.0.1:{port}/", timeout=0.5).status_code == 200:
+                    break
+            except httpx.TransportError:
+                time.sleep(0.005)
+        ttfr = time.perf_counter() - start
+    finally:
+        process.terminate()
+        output, _ = process.communicate(timeout=10)
+
+    import_main = re.search(r"IMPORT_MAIN ([\d.]+)", output or "")
+    return {
+        "ttfr_ms": ttfr * 1000,
+        "import_main_ms": float(import_main.group(1)) * 1000 if import_main else None,
+    }
+
+
+def run(args: argparse.Namespace) -> dict:
+    configure_environment(args.mongo, redis=BENCH_ENV["REDIS_URL"])
+    env = dict(os.environ)
+    env["PYTHONPATH"] = os.getcwd() + os.pathsep + env.get("PYTHONPATH", "")
+
+    bare_env = {"PATH": env.get("PATH", ""), "PYTHONPATH": env["PYTHONPATH"]}
+    import_runs = [measure_imports(bare_env) for _ in range(args.runs)]
+    request_runs = [measure_first_request(env, args.mongo) for _ in range(args.runs)]
+    median_import = sorted(import_runs, key=lambda r: r["total_ms"])[len(import_runs) // 2]
+
+    return {
+        "meta": {
+            "runs": args.runs,
+            "mongo": "mongomock" if args.mongo == "mock" else "mongod",
+            "python": platform.python_version(),
+            "timestamp": datetime.now(timezone.utc).isoformat(),
+        },
+        "import_total_ms": round(median_import["total_ms"], 2),
+        "ttfr_ms": round(statistics.median(r["ttfr_ms"] for r in request_runs), 2),
+        "imports": median_import,
+    }
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(prog="python -m benchmarks.cold_start", description="Cold-start benchmark.")
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--mongo", default="mock", help="'mock' for mongomock-motor or a mongodb:// URL.")
+    parser.add_argument("--output", help="Write the JSON report here.")
+    parser.add_argument("--compare", help="Baseline JSON report to compare against.")
+    parser.add_argument("--threshold", type=float, default=20.0, help="Regression threshold in percent.")
+    args = parser.parse_args(argv)
+
+    report = run(args)
+    print(f"import main (median of {args.runs}): {report['import_total_ms']:.1f} ms")
+    for name, ms in list(report["imports"]["by_package_ms"].items())[:12]:
+        print(f"  {name:<24}{ms:>10.1f} ms")
+    print(f"time to first request (median): {report['ttfr_ms']:.1f} ms")
+
+    if args.output:
+        os.makedirs(os.path.dirname(args.output) or ".", exist_ok=True)
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+        print(f"report written to {args.output}")
+
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        regressed = False
+        for key in ("import_total_ms", "ttfr_ms"):
+            delta = (report[key] - baseline[key]) / baseline[key] * 100 if baseline[key] else 0.0
+            flag = delta > args.threshold
+            regressed = regressed or flag
+            print(f"{key:<18}{baseline[key]:>10.1f} -> {report[key]:>10.1f} ms ({delta:+.1f}%){'  REGRESSION' if flag else ''}")
+        if regressed:
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,151 @@
+# benchmarks/compression.py
+#
+# Bytes-on-wire and CPU cost of response compression:
+#   - per codec/level (gzip always; br and zstd when installed) and per body size,
+#     using JSON shaped like the admin user list: compressed size, ratio and
+#     compression time per response;
+#   - end to end through `main.app`: GET /fortune/leaderboard with and without
+#     Accept-Encoding, and cached (precompressed) vs uncached.
+#
+#     python -m benchmarks.compression --output compression.json
+
+import argparse
+import asyncio
+import json
+import sys
+import time
+from datetime import datetime, timedelta, timezone
+
+from benchmarks.harness import configure_environment, booted_app, seed
+
+SIZES = (512, 2 * 1024, 16 * 1024, 128 * 1024, 1024 * 1024)
+
+
+def sample_body(size: int) -> bytes:
+    """Admin-user-list-like JSON of roughly `size` bytes."""
+    now = datetime(2024, 6, 1, tzinfo=timezone.utc)
+    users, body = [], b"[]"
+    i = 0
+    while len(body) < size:
+        users.append({
+            "id": f"{0x6650000000000000 + i * 7919:024x}",
+            "username": f"user_{i}",
+            "display_name": f"User {i}",
+            "email": f"user_{i}@example.com",
+            "role": "user",
+            "status": "active",
+            "is_hidden": False,
+            "tags": ["beta"] if i % 7 == 0 else [],
+            "bio": "",
+            "avatar_url": "",
+            "background_url": "",
+            "language": "zh",
+            "timezone": "Asia/Shanghai",
+            "registration_date": (now - timedelta(days=i % 400)).isoformat(),
+            "last_active_date": (now - timedelta(minutes=i * 13 % 10000)).isoformat(),
+            "total_draws": i % 365,
+            "has_drawn_today": i % 2 == 0,
+            "todays_fortune": "吉" if i % 2 == 0 else None,
+            "qq": None,
+            "use_qq_avatar": False,
+        })
+        i += 1
+        body = json.dumps(users, ensure_ascii=False, separators=(",", ":")).encode()
+    return body[:size] if len(body) > size * 1.2 else body
+
+
+def codec_variants() -> list:
+    import gzip
+    variants = [(f"gzip-{level}", lambda body, level=level: gzip.compress(body, compresslevel=level, mtime=0)) for level in (1, 6, 9)]
+    try:
+        import brotli
+        variants += [(f"br-{q}", lambda body, q=q: brotli.compress(body, quality=q)) for q in (1, 4, 11)]
+    except ImportError:
+        pass
+    try:
+        import zstandard
+        variants += [(f"zstd-{level}", zstandard.ZstdCompressor(level=level).compress) for level in (1, 3, 9)]
+    except ImportError:
+        pass
+    return variants
+
+
+def measure_codecs(min_seconds: float) -> list:
+    rows = []
+    for size in SIZES:
+        body = sample_body(size)
+        for name, codec in codec_variants():
+            compressed = codec(body)
+            calls, start = 0, time.perf_counter()
+            while time.perf_counter() - start < min_seconds:
+                codec(body)
+                calls += 1
+            per_call_us = (time.perf_counter() - start) / calls * 1e6
+            rows.append({
+                "body_bytes": len(body),
+                "codec": name,
+                "wire_bytes": len(compressed),
+                "ratio": round(len(body) / len(compressed), 2),
+                "cpu_us": round(per_call_us, 1),
+                "mb_per_s": round(len(body) / per_call_us, 1),
+            })
+    return rows
+
+
+async def measure_endpoint(users: int, requests: int) -> dict:
+    from app.core.config import settings
+
+    results = {}
+    async with booted_app() as (http, db):
+        seeded = await seed(db, users=users, history_days=0, drawn_today_fraction=1.0)
+        cases = [
+            ("identity, uncached", {"Accept-Encoding": "identity"}, 0),
+            ("compressed, uncached", {"Accept-Encoding": "gzip, br, zstd"}, 0),
+            ("compressed, cached", {"Accept-Encoding": "gzip, br, zstd"}, 60),
+        ]
+        for name, headers, cache_seconds in cases:
+            settings.LEADERBOARD_CACHE_SECONDS = cache_seconds
+            response = await http.get("/fortune/leaderboard", headers=headers)
+            start = time.perf_counter()
+            for _ in range(requests):
+                response = await http.get("/fortune/leaderboard", headers=headers)
+            elapsed = time.perf_counter() - start
+            results[name] = {
+                "encoding": response.headers.get("content-encoding", "identity"),
+                "wire_bytes": len(response.content) if "content-encoding" not in response.headers
+                else int(response.headers["content-length"]),
+                "body_bytes": len(response.content),
+                "ms_per_request": round(elapsed / requests * 1000, 3),
+            }
+        results["users_on_board"] = len(seeded)
+    return results
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(prog="python -m benchmarks.compression", description="Response compression benchmark.")
+    parser.add_argument("--min-seconds", type=float, default=0.2, help="Time spent per codec/size cell.")
+    parser.add_argument("--users", type=int, default=2000, help="Users on the leaderboard for the end-to-end run.")
+    parser.add_argument("--requests", type=int, default=50)
+    parser.add_argument("--output", help="Write the JSON report here.")
+    args = parser.parse_args(argv)
+
+    configure_environment()
+    codecs = measure_codecs(args.min_seconds)
+    print(f"{'body':>10}  {'codec':<8}{'wire':>10}{'ratio':>8}{'cpu us':>11}{'MB/s':>8}")
+    for row in codecs:
+        print(f"{row['body_bytes']:>10}  {row['codec']:<8}{row['wire_bytes']:>10}{row['ratio']:>8}{row['cpu_us']:>11}{row['mb_per_s']:>8}")
+
+    endpoint = asyncio.run(measure_endpoint(args.users, args.requests))
+    print(f"\nGET /fortune/leaderboard ({endpoint.pop('users_on_board')} users drawn today)")
+    for name, row in endpoint.items():
+        print(f"  {name:<22}{row['encoding']:<10}{row['wire_bytes']:>10} B on wire {row['ms_per_request']:>9} ms/request")
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump({"codecs": codecs, "leaderboard": endpoint}, f, indent=2)
+        print(f"report written to {args.output}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
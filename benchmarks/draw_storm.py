@@ -0,0 +1,95 @@
+# benchmarks/draw_storm.py
+#
+# Simulates the day-reset boundary: every user fires POST /fortune/draw at the
+# same instant, most of them more than once (double taps, client retries).
+# Runs the storm once per admission configuration and reports latency,
+# throughput and correctness (exactly one fortune per user) for each.
+#
+#     python -m benchmarks.draw_storm --users 10000 --duplicates 3 --output storm.json
+
+import argparse
+import asyncio
+import json
+import random
+import sys
+import time
+
+from benchmarks.harness import (
+    RequestSpec, booted_app, configure_environment, print_report, run_requests, seed, summarize
+)
+
+VARIANTS = {
+    "direct": {"DRAW_COALESCING_ENABLED": False, "DRAW_INSERT_BATCHING_ENABLED": False},
+    "coalesced": {"DRAW_COALESCING_ENABLED": True, "DRAW_INSERT_BATCHING_ENABLED": False},
+    "coalesced+batched": {"DRAW_COALESCING_ENABLED": True, "DRAW_INSERT_BATCHING_ENABLED": True},
+}
+
+
+async def run_variant(name: str, args: argparse.Namespace) -> dict:
+    from app.core.config import settings
+    from app.core.time_service import get_business_day_key
+    from datetime import datetime, timezone
+
+    for key, value in VARIANTS[name].items():
+        setattr(settings, key, value)
+
+    async with booted_app(args.mongo) as (http, db):
+        users = await seed(db, args.users, args.history_days, drawn_today_fraction=0.0)
+        specs = [
+            RequestSpec("POST /fortune/draw", "POST", "/fortune/draw", headers={"Authorization": f"Bearer {user.token}"})
+            for user in users
+            for _ in range(args.duplicates)
+        ]
+        random.shuffle(specs)
+
+        start = time.perf_counter()
+        samples = await run_requests(http, specs, args.concurrency)
+        elapsed = time.perf_counter() - start
+
+        today_key = get_business_day_key(datetime.now(timezone.utc))
+        drawn_today = await db.fortunes.count_documents({"date": today_key})
+
+    report = summarize(samples, elapsed)
+    print(f"\n== {name} ==")
+    print_report(report, elapsed)
+    print(f"fortunes stored for today: {drawn_today} (expected {args.users})")
+    return {
+        "elapsed_s": round(elapsed, 3),
+        "fortunes_stored": drawn_today,
+        "consistent": drawn_today == args.users,
+        "endpoints": report,
+    }
+
+
+async def run_all(args: argparse.Namespace) -> dict:
+    results = {}
+    for name in args.variants:
+        results[name] = await run_variant(name, args)
+    return results
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(prog="python -m benchmarks.draw_storm", description="Day-reset draw storm benchmark.")
+    parser.add_argument("--users", type=int, default=10000)
+    parser.add_argument("--duplicates", type=int, default=2, help="Draw requests sent per user.")
+    parser.add_argument("--history-days", type=int, default=7)
+    parser.add_argument("--concurrency", type=int, default=500)
+    parser.add_argument("--variants", nargs="+", default=list(VARIANTS), choices=list(VARIANTS))
+    parser.add_argument("--mongo", default="mock", help="'mock' for mongomock-motor or a mongodb:// URL.")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--output", help="Write the JSON report here.")
+    args = parser.parse_args(argv)
+
+    random.seed(args.seed)
+    configure_environment(args.mongo)
+    results = asyncio.run(run_all(args))
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump({"users": args.users, "duplicates": args.duplicates, "variants": results}, f, indent=2)
+        print(f"report written to {args.output}")
+    return 0 if all(r["consistent"] for r in results.values()) else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
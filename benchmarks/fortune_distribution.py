@@ -0,0 +1,155 @@
+# benchmarks/fortune_distribution.py
+#
+# Statistical check that the derived fortunes (FORTUNE_DERIVATION_ENABLED) follow the
+# same two-stage 80/20 model as `draw_fortune_logic`:
+#   - goodness of fit of derived values against the model's expected frequencies;
+#   - the same test on `draw_fortune_logic` itself, as a control;
+#   - homogeneity between derived and random draws (2 x 7 contingency table);
+#   - independence of a user's good/bad outcome on consecutive days;
+#   - determinism (same user and day -> same fortune).
+#
+#     python -m benchmarks.fortune_distribution --samples 200000
+#
+# Exits non-zero when any test rejects at the chosen significance level.
+
+import argparse
+import math
+import sys
+from collections import Counter
+from datetime import date, timedelta
+
+from benchmarks.harness import configure_environment
+
+
+def chi2_sf(x: float, df: int) -> float:
+    """Survival function of the chi-square distribution (regularized upper incomplete gamma)."""
+    if x <= 0:
+        return 1.0
+    a, z = df / 2, x / 2
+    if z < a + 1:
+        # Series for the lower incomplete gamma.
+        term = total = 1 / a
+        n = a
+        while abs(term) > 1e-15 * abs(total):
+            n += 1
+            term *= z / n
+            total += term
+        return max(0.0, 1 - total * math.exp(-z + a * math.log(z) - math.lgamma(a)))
+    # Continued fraction for the upper incomplete gamma (Lentz).
+    b = z + 1 - a
+    c = 1 / 1e-300
+    d = 1 / b
+    h = d
+    for i in range(1, 10000):
+        an = -i * (i - a)
+        b += 2
+        d = an * d + b
+        d = 1e-300 if abs(d) < 1e-300 else d
+        c = b + an / c
+        c = 1e-300 if abs(c) < 1e-300 else c
+        d = 1 / d
+        delta = d * c
+        h *= delta
+        if abs(delta - 1) < 1e-15:
+            break
+    return h * math.exp(-z + a * math.log(z) - math.lgamma(a))
+
+
+def expected_probabilities() -> dict:
+    from app.services.fortune_service import BAD_FORTUNES, GOOD_FORTUNES, GOOD_POOL_PROBABILITY
+    probabilities = {value: GOOD_POOL_PROBABILITY / len(GOOD_FORTUNES) for value in GOOD_FORTUNES}
+    probabilities.update({value: (1 - GOOD_POOL_PROBABILITY) / len(BAD_FORTUNES) for value in BAD_FORTUNES})
+    return probabilities
+
+
+def goodness_of_fit(counts: Counter, probabilities: dict) -> tuple:
+    total = sum(counts.values())
+    statistic = sum((counts[v] - total * p) ** 2 / (total * p) for v, p in probabilities.items())
+    return statistic, len(probabilities) - 1
+
+
+def homogeneity(rows: list, categories: list) -> tuple:
+    grand = sum(sum(row[c] for c in categories) for row in rows)
+    statistic = 0.0
+    for row in rows:
+        row_total = sum(row[c] for c in categories)
+        for c in categories:
+            expected = row_total * sum(r[c] for r in rows) / grand
+            statistic += (row[c] - expected) ** 2 / expected
+    return statistic, (len(rows) - 1) * (len(categories) - 1)
+
+
+def derived_samples(samples: int, days: int) -> list:
+    """Fortunes for `samples` (user, day) pairs: samples // days users over consecutive days."""
+    from bson import ObjectId
+    from app.services.fortune_service import derive_fortune
+
+    start = date(2024, 1, 1)
+    day_keys = [(start + timedelta(days=i)).isoformat() for i in range(days)]
+    return [
+        [derive_fortune(str(ObjectId()), key) for key in day_keys]
+        for _ in range(samples // days)
+    ]
+
+
+def run(args: argparse.Namespace) -> list:
+    from bson import ObjectId
+    from app.services.fortune_service import GOOD_FORTUNES, derive_fortune, draw_fortune_logic
+
+    probabilities = expected_probabilities()
+    categories = list(probabilities)
+    by_user = derived_samples(args.samples, args.days)
+    derived = Counter(value for row in by_user for value in row)
+    drawn = Counter(draw_fortune_logic() for _ in range(args.samples))
+
+    results = []
+    statistic, df = goodness_of_fit(derived, probabilities)
+    results.append(("derived vs model (goodness of fit)", statistic, df, chi2_sf(statistic, df)))
+    statistic, df = goodness_of_fit(drawn, probabilities)
+    results.append(("random vs model (control)", statistic, df, chi2_sf(statistic, df)))
+    statistic, df = homogeneity([derived, drawn], categories)
+    results.append(("derived vs random (homogeneity)", statistic, df, chi2_sf(statistic, df)))
+
+    good = set(GOOD_FORTUNES)
+    transitions = [Counter(), Counter()]
+    for row in by_user:
+        for today, tomorrow in zip(row, row[1:]):
+            transitions[today in good][tomorrow in good] += 1
+    statistic, df = homogeneity(transitions, [False, True])
+    results.append(("day-to-day independence (good/bad)", statistic, df, chi2_sf(statistic, df)))
+
+    print(f"{'value':<8}{'expected':>10}{'derived':>10}{'random':>10}")
+    for value, p in probabilities.items():
+        print(f"{value:<8}{p:>10.4f}{derived[value] / sum(derived.values()):>10.4f}{drawn[value] / args.samples:>10.4f}")
+    good_share = sum(derived[v] for v in good) / sum(derived.values())
+    print(f"derived good-pool share: {good_share:.4f}")
+
+    user_id = str(ObjectId())
+    deterministic = all(
+        derive_fortune(user_id, key) == derive_fortune(user_id, key)
+        for key in ("2024-01-01", "2024-02-29", "2024-12-31")
+    )
+    results.append(("determinism", 0.0, 0, 1.0 if deterministic else 0.0))
+    return results
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(prog="python -m benchmarks.fortune_distribution", description="Derived fortune distribution check.")
+    parser.add_argument("--samples", type=int, default=200000)
+    parser.add_argument("--days", type=int, default=10, help="Consecutive days per synthetic user.")
+    parser.add_argument("--alpha", type=float, default=0.001, help="Significance level.")
+    args = parser.parse_args(argv)
+
+    configure_environment()
+    results = run(args)
+    failed = False
+    print()
+    for name, statistic, df, p_value in results:
+        ok = p_value >= args.alpha
+        failed = failed or not ok
+        print(f"{name:<38} chi2={statistic:>9.3f} df={df:<3} p={p_value:.4f}  {'ok' if ok else 'REJECTED'}")
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
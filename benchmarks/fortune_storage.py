@@ -0,0 +1,190 @@
+# benchmarks/fortune_storage.py
+#
+# Storage size and history-query latency of the fortunes layout before and after
+# archiving old months into per-user monthly buckets (app/services/fortune_history.py).
+# Seeds `--users` x `--days` fortunes (default 3000 x 365, ~1.1M), then measures
+#   - storage: collStats size/storageSize/index size on a real mongod, BSON bytes always;
+#   - latency of the 365-day history query and of total_draws for sampled users;
+# runs the archival job and measures again, checking both answers are unchanged.
+#
+#     python -m benchmarks.fortune_storage --mongo mongodb://localhost:27017
+#     python -m benchmarks.fortune_storage --users 50 --days 365      # mongomock, smoke-sized
+#
+# mongomock checks unique indexes by scanning, so seeding slows quadratically; use a
+# real mongod for the 1M+ runs. The target database (DATABASE_NAME from benchmarks.harness) is dropped first.
+
+import argparse
+import asyncio
+import json
+import os
+import random
+import sys
+import time
+from datetime import datetime, timedelta, timezone
+
+from benchmarks.harness import configure_environment, percentile
+
+SEED_CHUNK = 10000
+
+
+async def connect(mongo: str):
+    import app.db as app_db
+    from app.core.migrations import apply_migrations
+
+    database_name = os.environ["DATABASE_NAME"]
+    if mongo == "mock":
+        from mongomock_motor import AsyncMongoMockClient
+        client = AsyncMongoMockClient(tz_aware=True)
+    else:
+        from motor.motor_asyncio import AsyncIOMotorClient
+        client = AsyncIOMotorClient(mongo, tz_aware=True)
+        await client.drop_database(database_name)
+    app_db.set_client(client)
+    db = app_db.get_database()
+    await apply_migrations(db)
+    return db
+
+
+async def seed_fortunes(db, users: int, days: int) -> list:
+    from bson import ObjectId
+    from app.core.time_service import get_business_day_key
+    from app.services.fortune_service import draw_fortune_logic
+
+    user_ids = [ObjectId() for _ in range(users)]
+    await db.users.insert_many([
+        {"_id": user_id, "username": f"storage_user_{i}", "email": f"storage_user_{i}@example.com",
+         "display_name": f"Storage User {i}", "timezone": "UTC"}
+        for i, user_id in enumerate(user_ids)
+    ])
+
+    now = datetime.now(timezone.utc).replace(hour=9, minute=0, second=0, microsecond=0)
+    chunk = []
+    inserted = 0
+    for day in range(1, days + 1):
+        created_at = now - timedelta(days=day)
+        day_key = get_business_day_key(created_at, "UTC")
+        for user_id in user_ids:
+            chunk.append({
+                "user_id": user_id,
+                "value": draw_fortune_logic(),
+                "date": day_key,
+                "tz": "UTC",
+                "created_at": created_at + timedelta(seconds=random.randint(0, 3600))
+            })
+            if len(chunk) >= SEED_CHUNK:
+                await db.fortunes.insert_many(chunk, ordered=False)
+                inserted += len(chunk)
+                chunk = []
+        if day % 30 == 0:
+            print(f"  seeded {inserted + len(chunk)} fortunes...", file=sys.stderr)
+    if chunk:
+        await db.fortunes.insert_many(chunk, ordered=False)
+    return user_ids
+
+
+async def storage(db, mongo: str) -> dict:
+    import bson
+
+    report = {}
+    for name in ("fortunes", "fortune_archive"):
+        entry = {"documents": await db[name].count_documents({})}
+        if mongo == "mock":
+            entry["bson_bytes"] = sum([len(bson.encode(doc)) async for doc in db[name].find({})])
+        else:
+            stats = await db.command("collStats", name)
+            entry.update({
+                "bson_bytes": stats.get("size", 0),
+                "storage_bytes": stats.get("storageSize", 0),
+                "index_bytes": stats.get("totalIndexSize", 0),
+            })
+        report[name] = entry
+    return report
+
+
+async def measure_reads(db, sample: list) -> tuple:
+    from app.services.fortune_history import count_user_fortunes, find_fortune_history
+
+    since = datetime.now(timezone.utc) - timedelta(days=365)
+    history_ms, count_ms, answers = [], [], {}
+    for user_id in sample:
+        start = time.perf_counter()
+        history = await find_fortune_history(db, user_id, since)
+        history_ms.append((time.perf_counter() - start) * 1000)
+        start = time.perf_counter()
+        total = await count_user_fortunes(db, user_id)
+        count_ms.append((time.perf_counter() - start) * 1000)
+        answers[user_id] = (len(history), total)
+
+    def summary(values):
+        values = sorted(values)
+        return {"p50_ms": round(percentile(values, 50), 3), "p95_ms": round(percentile(values, 95), 3),
+                "p99_ms": round(percentile(values, 99), 3)}
+    return {"history": summary(history_ms), "total_draws": summary(count_ms)}, answers
+
+
+async def run(args: argparse.Namespace) -> dict:
+    from app.services.fortune_history import archive_fortunes, latest_archivable_month
+
+    db = await connect(args.mongo)
+    started = time.perf_counter()
+    user_ids = await seed_fortunes(db, args.users, args.days)
+    print(f"seeded {args.users * args.days} fortunes in {time.perf_counter() - started:.1f}s", file=sys.stderr)
+    sample = random.sample(user_ids, min(args.sample, len(user_ids)))
+
+    before_storage = await storage(db, args.mongo)
+    before_reads, before_answers = await measure_reads(db, sample)
+
+    started = time.perf_counter()
+    stats = await archive_fortunes(db, latest_archivable_month(), batch_size=args.batch_size, grace_seconds=0)
+    archive_seconds = time.perf_counter() - started
+
+    after_storage = await storage(db, args.mongo)
+    after_reads, after_answers = await measure_reads(db, sample)
+
+    return {
+        "meta": {"users": args.users, "days": args.days, "fortunes": args.users * args.days,
+                 "mongo": "mongomock" if args.mongo == "mock" else "mongod", "sample": len(sample)},
+        "archive": {**stats, "seconds": round(archive_seconds, 2)},
+        "before": {"storage": before_storage, "reads": before_reads},
+        "after": {"storage": after_storage, "reads": after_reads},
+        "answers_unchanged": before_answers == after_answers,
+    }
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(prog="python -m benchmarks.fortune_storage", description="Fortune storage/archival benchmark.")
+    parser.add_argument("--mongo", default="mock", help="'mock' for mongomock-motor or a mongodb:// URL.")
+    parser.add_argument("--users", type=int, default=3000)
+    parser.add_argument("--days", type=int, default=365)
+    parser.add_argument("--sample", type=int, default=200, help="Users to time history/total_draws reads for.")
+    parser.add_argument("--batch-size", type=int, default=500, help="Users per archival batch.")
+    parser.add_argument("--output", help="Write the JSON report here.")
+    args = parser.parse_args(argv)
+
+    configure_environment(args.mongo)
+    report = asyncio.run(run(args))
+
+    print(f"{report['meta']['fortunes']} fortunes, {args.users} users ({report['meta']['mongo']})")
+    print(f"archival: {report['archive']['archived']} fortunes -> {report['archive']['buckets']} buckets "
+          f"in {report['archive']['seconds']}s (cutoff {report['archive']['cutoff']})")
+    for phase in ("before", "after"):
+        data = report[phase]
+        sizes = ", ".join(
+            f"{name}: {entry['documents']} docs / {entry['bson_bytes'] / 2**20:.1f} MiB"
+            + (f" (storage {entry['storage_bytes'] / 2**20:.1f} MiB, indexes {entry['index_bytes'] / 2**20:.1f} MiB)" if "storage_bytes" in entry else "")
+            for name, entry in data["storage"].items()
+        )
+        print(f"{phase:<7} {sizes}")
+        for query, summary in data["reads"].items():
+            print(f"        {query:<12} p50 {summary['p50_ms']:>8.2f} ms  p95 {summary['p95_ms']:>8.2f} ms  p99 {summary['p99_ms']:>8.2f} ms")
+    print(f"history and total_draws unchanged by archival: {report['answers_unchanged']}")
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+        print(f"report written to {args.output}")
+    return 0 if report["answers_unchanged"] else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,448 @@
+# benchmarks/harness.py
+#
+# Load-test harness for the DailyFortune API.
+#
+# Boots the FastAPI `app` from main.py in-process against mongomock-motor (or a
+# real mongod) and fakeredis, seeds realistic data volumes, drives a scenario mix
+# and reports throughput and latency percentiles per endpoint.
+#
+#     pip install -r requirements.txt -r benchmarks/requirements.txt
+#     python -m benchmarks.harness --scenario mixed --output baseline.json
+#     python -m benchmarks.harness --scenario mixed --compare baseline.json
+#     python -m benchmarks.harness --scenario draw_storm --mongo mongodb://localhost:27017
+#     python -m benchmarks.harness --scenario mixed --max-block-ms 50    # fail if a route blocks the loop
+#
+# Scenarios: draw_storm, me_polling, leaderboard, login_burst, mixed.
+#
+# mongomock answers every query by scanning in Python, so the defaults (200 users,
+# 7 days of history, 1000 requests) take about half a minute there; larger volumes
+# such as --users 1000 --history-days 30 --requests 2000 need a real mongod.
+# A run in which more than --max-error-rate percent of the requests failed exits
+# non-zero and writes no report.
+
+import argparse
+import asyncio
+import json
+import os
+import platform
+import random
+import sys
+import time
+from contextlib import asynccontextmanager
+from datetime import datetime, timedelta, timezone
+from typing import Dict, List, Optional
+
+BENCH_ENV = {
+    "DATABASE_URL": "mongodb://localhost:27017",
+    "DATABASE_NAME": "daily_fortune_bench",
+    "SECRET_KEY": "benchmark-secret-key",
+    "ALGORITHM": "HS256",
+    "ACCESS_TOKEN_EXPIRE_MINUTES": "60",
+    "RATE_LIMITING_ENABLED": "False",
+    "REDIS_URL": "redis://localhost:6379",
+}
+
+SEED_PASSWORD = "benchmark-password"
+SEED_TIMEZONE = "Asia/Shanghai"
+
+
+def configure_environment(
+    mongo: str = "mock", redis: str = "fake", rate_limit: bool = False, admission: bool = False,
+    max_block_ms: Optional[float] = None
+) -> None:
+    """
+    Must run before anything under `app` or `main` is imported: settings and
+    clients are read from the environment at import time.
+    """
+    for key, value in BENCH_ENV.items():
+        os.environ[key] = value
+    if mongo != "mock":
+        os.environ["DATABASE_URL"] = mongo
+    os.environ["RATE_LIMITING_ENABLED"] = str(rate_limit)
+    os.environ["ADMISSION_ENABLED"] = str(admission)
+    os.environ["BLOCKING_DETECTOR_ENABLED"] = str(max_block_ms is not None)
+    if max_block_ms is not None:
+        os.environ["BLOCKING_THRESHOLD_MS"] = str(max_block_ms)
+    if redis == "fake":
+        _install_fakeredis()
+    else:
+        os.environ["REDIS_URL"] = redis
+
+
+def _install_fakeredis() -> None:
+    """Routes every `redis.from_url` / `redis.asyncio.from_url` to one shared in-memory server."""
+    import fakeredis
+    import redis
+    import redis.asyncio
+
+    server = fakeredis.FakeServer()
+
+    def sync_from_url(url, **kwargs):
+        kwargs.pop("connection_pool", None)
+        return fakeredis.FakeRedis(server=server, **kwargs)
+
+    def async_from_url(url, **kwargs):
+        kwargs.pop("connection_pool", None)
+        return fakeredis.FakeAsyncRedis(server=server, **kwargs)
+
+    redis.from_url = sync_from_url
+    redis.Redis.from_url = staticmethod(sync_from_url)
+    redis.asyncio.from_url = async_from_url
+    redis.asyncio.Redis.from_url = staticmethod(async_from_url)
+
+
+# --- App Boot ---
+
+@asynccontextmanager
+async def booted_app(mongo: str = "mock"):
+    """Yields an httpx client wired to the in-process app, plus the database it uses."""
+    import httpx
+    import app.db as app_db
+    import main
+    from app.core.migrations import apply_migrations
+
+    database_name = os.environ["DATABASE_NAME"]
+    if mongo == "mock":
+        from mongomock_motor import AsyncMongoMockClient
+        client = AsyncMongoMockClient(tz_aware=True)
+    else:
+        from motor.motor_asyncio import AsyncIOMotorClient
+        client = AsyncIOMotorClient(mongo, tz_aware=True)
+        await client.drop_database(database_name)
+
+    app_db.set_client(client)
+    database = app_db.get_database()
+
+    await apply_migrations(database)
+    async with main.app.router.lifespan_context(main.app):
+        transport = httpx.ASGITransport(app=main.app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://bench") as http:
+            yield http, database
+
+
+# --- Seeding ---
+
+class SeedUser:
+    __slots__ = ("user_id", "username", "token")
+
+    def __init__(self, user_id, username: str, token: str):
+        self.user_id = user_id
+        self.username = username
+        self.token = token
+
+
+async def seed(db, users: int, history_days: int, drawn_today_fraction: float) -> List[SeedUser]:
+    from app.core.security import create_access_token, get_password_hash
+    from app.core.time_service import get_business_day_key, get_current_day_start_in_utc
+    from app.services.fortune_service import draw_fortune_logic
+
+    await db.config.update_one({"key": "registration_status"}, {"$set": {"value": True}}, upsert=True)
+
+    # One bcrypt hash for everyone: hashing thousands of passwords would dominate setup time.
+    password_hash = get_password_hash(SEED_PASSWORD)
+    seeded_at = datetime.now(timezone.utc).replace(microsecond=0) - timedelta(minutes=5)
+    user_docs = [
+        {
+            "username": f"bench_user_{i}",
+            "display_name": f"Bench User {i}",
+            "email": f"bench_user_{i}@example.com",
+            "password_hash": password_hash,
+            "role": "user",
+            "status": "active",
+            "bio": "",
+            "avatar_url": "",
+            "background_url": "",
+            "language": "zh",
+            "registration_date": seeded_at,
+            "last_active_date": seeded_at,
+            "password_changed_at": seeded_at,
+            "is_hidden": False,
+            "tags": [],
+            "timezone": SEED_TIMEZONE,
+            "qq": None,
+            "use_qq_avatar": False,
+        }
+        for i in range(users)
+    ]
+    result = await db.users.insert_many(user_docs)
+
+    today_start = get_current_day_start_in_utc(SEED_TIMEZONE)
+    fortune_docs = []
+    for index, user_id in enumerate(result.inserted_ids):
+        days = list(range(1, history_days + 1))
+        if index < users * drawn_today_fraction:
+            days.append(0)
+        for day in days:
+            created_at = today_start - timedelta(days=day) + timedelta(minutes=random.randint(0, 1439))
+            fortune_docs.append({
+                "user_id": user_id,
+                "value": draw_fortune_logic(),
+                "date": get_business_day_key(created_at, SEED_TIMEZONE),
+                "tz": SEED_TIMEZONE,
+                "created_at": created_at,
+            })
+        if len(fortune_docs) >= 10000:
+            await db.fortunes.insert_many(fortune_docs, ordered=False)
+            fortune_docs = []
+    if fortune_docs:
+        await db.fortunes.insert_many(fortune_docs, ordered=False)
+
+    return [
+        SeedUser(user_id, doc["username"], create_access_token(data={"sub": str(user_id), "role": doc["role"]}))
+        for user_id, doc in zip(result.inserted_ids, user_docs)
+    ]
+
+
+# --- Scenarios ---
+
+class RequestSpec:
+    __slots__ = ("label", "method", "url", "kwargs")
+
+    def __init__(self, label: str, method: str, url: str, **kwargs):
+        self.label = label
+        self.method = method
+        self.url = url
+        self.kwargs = kwargs
+
+
+def _auth(user: SeedUser) -> dict:
+    return {"headers": {"Authorization": f"Bearer {user.token}"}}
+
+
+def _draw(user: SeedUser) -> RequestSpec:
+    return RequestSpec("POST /fortune/draw", "POST", "/fortune/draw", **_auth(user))
+
+
+def _me(user: SeedUser) -> RequestSpec:
+    return RequestSpec("GET /users/me", "GET", "/users/me", **_auth(user))
+
+
+def _leaderboard(user: SeedUser) -> RequestSpec:
+    return RequestSpec("GET /fortune/leaderboard", "GET", "/fortune/leaderboard")
+
+
+def _login(user: SeedUser) -> RequestSpec:
+    return RequestSpec(
+        "POST /auth/login", "POST", "/auth/login",
+        data={"username": user.username, "password": SEED_PASSWORD}
+    )
+
+
+MIXED_WEIGHTS = [(_me, 50), (_leaderboard, 25), (_draw, 20), (_login, 5)]
+
+
+def build_scenario(name: str, users: List[SeedUser], requests: int) -> List[RequestSpec]:
+    if name == "draw_storm":
+        # Every user draws once, all at the same moment (the day-reset boundary).
+        specs = [_draw(user) for user in users]
+        random.shuffle(specs)
+        return specs
+    if name == "me_polling":
+        return [_me(random.choice(users)) for _ in range(requests)]
+    if name == "leaderboard":
+        return [_leaderboard(None) for _ in range(requests)]
+    if name == "login_burst":
+        return [_login(random.choice(users)) for _ in range(requests)]
+    if name == "mixed":
+        builders, weights = zip(*MIXED_WEIGHTS)
+        return [random.choices(builders, weights)[0](random.choice(users)) for _ in range(requests)]
+    raise ValueError(f"Unknown scenario: {name}")
+
+
+# --- Runner & Reporting ---
+
+async def run_requests(http, specs: List[RequestSpec], concurrency: int) -> Dict[str, List[tuple]]:
+    """Runs `specs` with at most `concurrency` in flight. Returns label -> [(latency_s, status)]."""
+    samples: Dict[str, List[tuple]] = {}
+    queue = iter(specs)
+
+    async def worker():
+        for spec in queue:
+            # In-process requests against mongomock never wait on I/O: without this one
+            # worker would run its whole share as a single step of the event loop.
+            await asyncio.sleep(0)
+            start = time.perf_counter()
+            try:
+                response = await http.request(spec.method, spec.url, **spec.kwargs)
+                status = response.status_code
+            except Exception:
+                status = 0
+            samples.setdefault(spec.label, []).append((time.perf_counter() - start, status))
+
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    return samples
+
+
+def percentile(sorted_values: List[float], pct: float) -> float:
+    if not sorted_values:
+        return 0.0
+    rank = max(0, min(len(sorted_values) - 1, int(round(pct / 100 * len(sorted_values) + 0.5)) - 1))
+    return sorted_values[rank]
+
+
+def summarize(samples: Dict[str, List[tuple]], elapsed: float) -> Dict[str, dict]:
+    report = {}
+    for label, values in sorted(samples.items()):
+        latencies = sorted(latency for latency, _ in values)
+        errors = sum(1 for _, status in values if not 200 <= status < 400)
+        report[label] = {
+            "count": len(values),
+            "errors": errors,
+            "rps": round(len(values) / elapsed, 2) if elapsed else 0.0,
+            "mean_ms": round(sum(latencies) / len(latencies) * 1000, 3),
+            "p50_ms": round(percentile(latencies, 50) * 1000, 3),
+            "p90_ms": round(percentile(latencies, 90) * 1000, 3),
+            "p99_ms": round(percentile(latencies, 99) * 1000, 3),
+            "max_ms": round(latencies[-1] * 1000, 3),
+        }
+    return report
+
+
+def print_report(report: Dict[str, dict], elapsed: float) -> None:
+    header = f"{'endpoint':<28}{'count':>8}{'errors':>8}{'rps':>10}{'p50 ms':>10}{'p90 ms':>10}{'p99 ms':>10}{'max ms':>10}"
+    print(header)
+    print("-" * len(header))
+    for label, row in report.items():
+        print(
+            f"{label:<28}{row['count']:>8}{row['errors']:>8}{row['rps']:>10.1f}"
+            f"{row['p50_ms']:>10.2f}{row['p90_ms']:>10.2f}{row['p99_ms']:>10.2f}{row['max_ms']:>10.2f}"
+        )
+    print(f"\nwall time: {elapsed:.2f}s")
+
+
+def compare_reports(current: Dict[str, dict], baseline: Dict[str, dict], threshold_pct: float) -> bool:
+    """Prints per-endpoint deltas. Returns False when any endpoint regressed beyond the threshold."""
+    ok = True
+    print(f"\n{'endpoint':<28}{'rps Δ%':>10}{'p50 Δ%':>10}{'p99 Δ%':>10}")
+    for label, row in current.items():
+        base = baseline.get(label)
+        if not base:
+            continue
+
+        def delta(key):
+            return (row[key] - base[key]) / base[key] * 100 if base[key] else 0.0
+
+        rps_d, p50_d, p99_d = delta("rps"), delta("p50_ms"), delta("p99_ms")
+        regressed = rps_d < -threshold_pct or p99_d > threshold_pct
+        ok = ok and not regressed
+        print(f"{label:<28}{rps_d:>+10.1f}{p50_d:>+10.1f}{p99_d:>+10.1f}{'  REGRESSION' if regressed else ''}")
+    return ok
+
+
+async def run_benchmark(args: argparse.Namespace) -> dict:
+    from app.core.diagnostics import blocking_detector
+
+    async with booted_app(args.mongo) as (http, db):
+        users = await seed(db, args.users, args.history_days, args.drawn_today_fraction)
+        specs = build_scenario(args.scenario, users, args.requests)
+        if args.max_block_ms is not None:
+            # First requests pay for lazy imports and client setup; those are not the routes' stalls.
+            await run_requests(http, list({spec.label: spec for spec in reversed(specs)}.values()), 1)
+        blocking_detector.reset()  # seeding blocks the loop on purpose
+        start = time.perf_counter()
+        samples = await run_requests(http, specs, args.concurrency)
+        elapsed = time.perf_counter() - start
+        blocking = blocking_detector.report()
+
+    # Shed requests are the expected outcome of the protection being measured, not failures.
+    expected = ({429} if args.rate_limit else set()) | ({503} if args.admission else set())
+    statuses = [status for values in samples.values() for _, status in values]
+    failed = sum(1 for status in statuses if not 200 <= status < 400 and status not in expected)
+    result = {
+        "meta": {
+            "scenario": args.scenario,
+            "users": args.users,
+            "history_days": args.history_days,
+            "requests": len(specs),
+            "concurrency": args.concurrency,
+            "mongo": "mongomock" if args.mongo == "mock" else "mongod",
+            "python": platform.python_version(),
+            "timestamp": datetime.now(timezone.utc).isoformat(),
+            "elapsed_s": round(elapsed, 3),
+            "error_rate_pct": round(failed / len(statuses) * 100, 2) if statuses else 0.0,
+        },
+        "endpoints": summarize(samples, elapsed),
+    }
+    if args.max_block_ms is not None:
+        # mongomock-motor runs queries synchronously on the loop; those stalls are the mock's, not the app's.
+        result["blocking"] = [site for site in blocking if not _in_mongomock(site)]
+        result["blocking_ignored"] = [site for site in blocking if _in_mongomock(site)]
+    return result
+
+
+def _in_mongomock(site: dict) -> bool:
+    return any(f"{os.sep}mongomock" in frame for frame in site["stack"])
+
+
+def print_blocking(sites: List[dict], max_block_ms: float, ignored: List[dict]) -> None:
+    if ignored:
+        print(f"\n{sum(site['count'] for site in ignored)} stalls inside mongomock ignored (use --mongo with a real mongod)")
+    if not sites:
+        print(f"\nno route blocked the event loop for {max_block_ms:g} ms or more")
+        return
+    print(f"\ncall sites that blocked the event loop for {max_block_ms:g} ms or more:")
+    for site in sites:
+        print(
+            f"  {site['count']:>5}x  total {site['total_ms']:>9.1f} ms  max {site['max_ms']:>7.1f} ms  "
+            f"{site['call_site']}  [{site['handler'] or 'no route'}]"
+        )
+        print(f"         blocked in {site['blocked_in']}")
+
+
+def build_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(prog="python -m benchmarks.harness", description="DailyFortune API load-test harness.")
+    parser.add_argument("--scenario", default="mixed", choices=["draw_storm", "me_polling", "leaderboard", "login_burst", "mixed"])
+    parser.add_argument("--users", type=int, default=200)
+    parser.add_argument("--history-days", type=int, default=7, help="Past fortunes seeded per user.")
+    parser.add_argument("--drawn-today-fraction", type=float, default=0.5, help="Share of users that already drew today.")
+    parser.add_argument("--requests", type=int, default=1000, help="Request count (ignored by draw_storm: one per user).")
+    parser.add_argument("--concurrency", type=int, default=50)
+    parser.add_argument("--mongo", default="mock", help="'mock' for mongomock-motor or a mongodb:// URL.")
+    parser.add_argument("--redis", default="fake", help="'fake' for fakeredis or a redis:// URL.")
+    parser.add_argument("--rate-limit", action="store_true", help="Enable slowapi rate limiting.")
+    parser.add_argument("--admission", action="store_true", help="Enable adaptive admission control (load shedding).")
+    parser.add_argument("--max-block-ms", type=float, default=None,
+                        help="Detect calls that block the event loop this long; any found fails the run.")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--output", help="Write the JSON report here.")
+    parser.add_argument("--compare", help="Baseline JSON report to compare against.")
+    parser.add_argument("--threshold", type=float, default=10.0, help="Regression threshold in percent.")
+    parser.add_argument("--max-error-rate", type=float, default=1.0,
+                        help="Percent of failed requests (429/503 excluded when --rate-limit/--admission) "
+                             "above which the run is invalid: it fails and no report is written.")
+    return parser
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    args = build_parser().parse_args(argv)
+    random.seed(args.seed)
+    configure_environment(args.mongo, args.redis, args.rate_limit, args.admission, args.max_block_ms)
+
+    result = asyncio.run(run_benchmark(args))
+    print_report(result["endpoints"], result["meta"]["elapsed_s"])
+    if args.max_block_ms is not None:
+        print_blocking(result["blocking"], args.max_block_ms, result["blocking_ignored"])
+
+    error_rate = result["meta"]["error_rate_pct"]
+    if error_rate > args.max_error_rate:
+        # Latencies of failed requests say nothing about the endpoints; never keep them as a baseline.
+        print(f"\n{error_rate:g}% of requests failed (limit {args.max_error_rate:g}%): run discarded")
+        return 1
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(result, f, indent=2)
+        print(f"report written to {args.output}")
+
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        if not compare_reports(result["endpoints"], baseline["endpoints"], args.threshold):
+            return 1
+    if result.get("blocking"):
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
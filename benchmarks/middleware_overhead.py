@@ -0,0 +1,182 @@
+# benchmarks/middleware_overhead.py
+#
+# Requests/sec through the full middleware stack of `main.app` on `GET /`, comparing
+# the pure ASGI RequestContextMiddleware with the previous `@app.middleware("http")`
+# (BaseHTTPMiddleware) request logger. Requests are driven straight through the ASGI
+# interface, so the numbers isolate the application stack from any HTTP client/server.
+#
+#     python -m benchmarks.middleware_overhead --requests 20000 --output middleware.json
+#
+# It also checks that a streaming response passes through the middleware unbuffered.
+
+import argparse
+import asyncio
+import json
+import logging
+import sys
+import time
+
+from benchmarks.harness import configure_environment
+
+ROOT_SCOPE = {
+    "type": "http",
+    "asgi": {"version": "3.0", "spec_version": "2.3"},
+    "http_version": "1.1",
+    "method": "GET",
+    "scheme": "http",
+    "path": "/",
+    "raw_path": b"/",
+    "query_string": b"",
+    "root_path": "",
+    "headers": [(b"host", b"bench"), (b"user-agent", b"bench")],
+    "client": ("127.0.0.1", 50000),
+    "server": ("bench", 80),
+}
+
+
+async def legacy_log_requests(request, call_next):
+    """The request logger as it was registered with `@app.middleware("http")`."""
+    from jose import jwt, JWTError
+    from app.core.config import settings
+
+    start_time = time.time()
+
+    user_id = "anonymous"
+    auth_header = request.headers.get("authorization")
+    if auth_header and auth_header.startswith("Bearer "):
+        token = auth_header.split(" ")[1]
+        try:
+            payload = jwt.decode(token, settings.SECRET_KEY, algorithms=[settings.ALGORITHM])
+            user_id = payload.get("sub", "unknown")
+        except JWTError:
+            user_id = "invalid_token"
+
+    response = await call_next(request)
+    process_time = (time.time() - start_time) * 1000
+    logging.getLogger("api_logger").info(
+        f'user="{user_id}" ip="{request.client.host}" method="{request.method}" '
+        f'path="{request.url.path}" status={response.status_code} duration={process_time:.2f}ms'
+    )
+    return response
+
+
+def use_stack(app, variant: str, original: list) -> None:
+    from starlette.middleware import Middleware
+    from starlette.middleware.base import BaseHTTPMiddleware
+    from app.core.middleware import RequestContextMiddleware
+
+    if variant == "asgi":
+        app.user_middleware = list(original)
+    else:
+        # Previously the logger sat inside CORSMiddleware.
+        app.user_middleware = [m for m in original if m.cls is not RequestContextMiddleware]
+        app.user_middleware.append(Middleware(BaseHTTPMiddleware, dispatch=legacy_log_requests))
+    app.middleware_stack = None
+
+
+async def drive(app, requests: int, concurrency: int) -> float:
+    async def receive():
+        return {"type": "http.request", "body": b"", "more_body": False}
+
+    async def send(message):
+        pass
+
+    remaining = iter(range(requests))
+
+    async def worker():
+        for _ in remaining:
+            await app(dict(ROOT_SCOPE), receive, send)
+
+    start = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    return requests / (time.perf_counter() - start)
+
+
+async def check_streaming() -> bool:
+    """The first chunk of a streaming response must reach the client before the stream ends."""
+    from starlette.applications import Starlette
+    from starlette.responses import StreamingResponse
+    from starlette.routing import Route
+    from app.core.middleware import RequestContextMiddleware
+
+    release = asyncio.Event()
+    first_chunk_seen = asyncio.Event()
+
+    async def stream(request):
+        async def body():
+            yield b"first\n"
+            await release.wait()
+            yield b"second\n"
+        return StreamingResponse(body(), media_type="application/x-ndjson")
+
+    app = RequestContextMiddleware(Starlette(routes=[Route("/stream", stream)]))
+
+    async def receive():
+        await asyncio.Event().wait()
+
+    async def send(message):
+        if message["type"] == "http.response.body" and message.get("body") == b"first\n":
+            first_chunk_seen.set()
+
+    task = asyncio.create_task(app({**ROOT_SCOPE, "path": "/stream", "raw_path": b"/stream"}, receive, send))
+    try:
+        await asyncio.wait_for(first_chunk_seen.wait(), timeout=2)
+        passed = True
+    except asyncio.TimeoutError:
+        passed = False
+    release.set()
+    await task
+    return passed
+
+
+async def run(args: argparse.Namespace) -> dict:
+    import main
+
+    if not args.keep_log_file:
+        logger = logging.getLogger("api_logger")
+        logger.handlers = [logging.NullHandler()]
+
+    original = list(main.app.user_middleware)
+    results = {}
+    for variant in ("base_http", "asgi"):
+        use_stack(main.app, variant, original)
+        await drive(main.app, min(1000, args.requests), args.concurrency)  # warm-up
+        runs = [await drive(main.app, args.requests, args.concurrency) for _ in range(args.runs)]
+        results[variant] = round(sorted(runs)[len(runs) // 2], 1)
+    use_stack(main.app, "asgi", original)
+
+    return {
+        "requests": args.requests,
+        "concurrency": args.concurrency,
+        "rps": results,
+        "speedup": round(results["asgi"] / results["base_http"], 3),
+        "streaming_unbuffered": await check_streaming(),
+    }
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(prog="python -m benchmarks.middleware_overhead", description="Middleware stack microbenchmark.")
+    parser.add_argument("--requests", type=int, default=20000)
+    parser.add_argument("--concurrency", type=int, default=50)
+    parser.add_argument("--runs", type=int, default=3)
+    parser.add_argument("--keep-log-file", action="store_true", help="Write access log lines to api.log during the run.")
+    parser.add_argument("--output", help="Write the JSON report here.")
+    args = parser.parse_args(argv)
+
+    configure_environment()
+    report = asyncio.run(run(args))
+    print(f"GET / through main.app ({args.requests} requests, concurrency {args.concurrency}, median of {args.runs})")
+    for variant, rps in report["rps"].items():
+        print(f"  {variant:<10}{rps:>12.1f} req/s")
+    print(f"  speedup   {report['speedup']:>12.3f}x")
+    print(f"streaming response unbuffered: {report['streaming_unbuffered']}")
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+        print(f"report written to {args.output}")
+    return 0 if report["streaming_unbuffered"] else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
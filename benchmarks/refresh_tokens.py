@@ -0,0 +1,120 @@
+# benchmarks/refresh_tokens.py
+#
+# Throughput of POST /auth/refresh with token rotation, through `main.app`:
+#   - every simulated client holds its own cookie jar and refreshes in a loop,
+#     so each request spends the previous token and receives the next one;
+#   - once per revocation store backend ("redis" against fakeredis, "memory");
+#   - the per-refresh MongoDB read timed alone: the full user document the endpoint
+#     used to load, and the status/role projection it reads now;
+#   - a replayed (stolen) token must revoke its family.
+#
+#     python -m benchmarks.refresh_tokens --clients 50 --refreshes 20 --output refresh.json
+
+import argparse
+import asyncio
+import json
+import sys
+import time
+
+from benchmarks.harness import configure_environment, booted_app, percentile, print_report, seed, summarize
+
+
+async def _refresh_loop(client, refreshes: int, samples: list) -> None:
+    for _ in range(refreshes):
+        started = time.perf_counter()
+        response = await client.post("/auth/refresh")
+        samples.append((time.perf_counter() - started, response.status_code))
+
+
+async def run_backend(backend: str, users, clients: int, refreshes: int) -> dict:
+    import httpx
+    import main
+    from app.core.config import settings
+    from app.services.refresh_tokens import issue_refresh_token
+
+    settings.REFRESH_TOKEN_STORE_BACKEND = backend
+    transport = httpx.ASGITransport(app=main.app)
+    sessions = []
+    for i in range(clients):
+        client = httpx.AsyncClient(transport=transport, base_url="http://bench")
+        client.cookies.set("refresh_token", await issue_refresh_token(str(users[i % len(users)].user_id), "user"))
+        sessions.append(client)
+
+    samples: list = []
+    started = time.perf_counter()
+    await asyncio.gather(*(_refresh_loop(client, refreshes, samples) for client in sessions))
+    elapsed = time.perf_counter() - started
+    for client in sessions:
+        await client.aclose()
+    return summarize({f"POST /auth/refresh ({backend})": samples}, elapsed), elapsed
+
+
+async def reuse_check(http, user) -> dict:
+    """A replayed token is refused and takes the legitimate client's next token down with it."""
+    from app.core.config import settings
+    from app.services.refresh_tokens import issue_refresh_token
+
+    settings.REFRESH_TOKEN_REUSE_GRACE_SECONDS = 0
+    stolen = await issue_refresh_token(str(user.user_id), "user")
+    first = await http.post("/auth/refresh", headers={"Cookie": f"refresh_token={stolen}"})
+    rotated = first.cookies.get("refresh_token")
+    await asyncio.sleep(1.1)
+    replay = await http.post("/auth/refresh", headers={"Cookie": f"refresh_token={stolen}"})
+    descendant = await http.post("/auth/refresh", headers={"Cookie": f"refresh_token={rotated}"})
+    return {
+        "first_use": first.status_code,
+        "replay": replay.status_code,
+        "replay_detail": replay.json().get("detail"),
+        "legitimate_after_replay": descendant.status_code,
+    }
+
+
+async def mongo_read_reference(db, users, reads: int) -> dict:
+    """The users.find_one by _id of each refresh: full document (before rotation) and status/role only (now)."""
+    report = {"reads": reads}
+    for name, projection in (("full_document", None), ("status_role", {"_id": 0, "status": 1, "role": 1})):
+        latencies = []
+        for i in range(reads):
+            started = time.perf_counter()
+            await db.users.find_one({"_id": users[i % len(users)].user_id}, projection)
+            latencies.append(time.perf_counter() - started)
+        latencies.sort()
+        report[name] = {"p50_ms": round(percentile(latencies, 50) * 1000, 3), "p99_ms": round(percentile(latencies, 99) * 1000, 3)}
+    return report
+
+
+async def run(args: argparse.Namespace) -> dict:
+    configure_environment()
+    async with booted_app() as (http, db):
+        users = await seed(db, users=max(args.clients, 10), history_days=1, drawn_today_fraction=0.0)
+        http.cookies.clear()
+        report = {"clients": args.clients, "refreshes_per_client": args.refreshes, "backends": {}}
+        for backend in ("redis", "memory"):
+            rows, elapsed = await run_backend(backend, users, args.clients, args.refreshes)
+            print_report(rows, elapsed)
+            print()
+            report["backends"].update(rows)
+        report["mongo_read_reference"] = await mongo_read_reference(db, users, args.clients * args.refreshes)
+        print(f"users.find_one by _id per refresh: {report['mongo_read_reference']}")
+        report["reuse"] = await reuse_check(http, users[0])
+        print(f"token reuse: {report['reuse']}")
+    return report
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--clients", type=int, default=50, help="Concurrent sessions, each with its own cookie jar.")
+    parser.add_argument("--refreshes", type=int, default=20, help="Sequential refreshes per session.")
+    parser.add_argument("--output", help="Write the report as JSON to this file.")
+    args = parser.parse_args(argv)
+
+    report = asyncio.run(run(args))
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+    ok = report["reuse"]["replay"] == 401 and report["reuse"]["legitimate_after_replay"] == 401
+    return 0 if ok else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
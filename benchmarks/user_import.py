@@ -0,0 +1,124 @@
+# benchmarks/user_import.py
+#
+# Bulk user import (app/services/user_import.py) against per-user registration:
+#   - a generated CSV with a share of invalid rows, rows repeated within the file
+#     and rows colliding with accounts that already exist;
+#   - `import_users` over that file, with the hashing pool size and bcrypt cost
+#     given on the command line;
+#   - the registration path (hash + insert_one per user) on a sample of the same
+#     users, extrapolated to the full file;
+#   - the report must account for every row, and an imported user must be able to log in.
+#
+#     python -m benchmarks.user_import --users 10000 --workers 8 --output import.json
+#     python -m benchmarks.user_import --users 2000 --rounds 4     # pipeline overhead only
+
+import argparse
+import asyncio
+import io
+import json
+import random
+import sys
+import time
+
+from benchmarks.harness import configure_environment, booted_app, seed
+
+INVALID_SHARE = 0.01
+REPEATED_SHARE = 0.01
+EXISTING_USERS = 20
+
+
+def build_csv(users: int, existing) -> tuple:
+    """The CSV text, how many rows of each kind it holds, and one valid user's index."""
+    rows = [f"import_user_{i},import_user_{i}@example.com,password-{i}" for i in range(users)]
+    counts = {"valid": users, "invalid": 0, "repeated": 0, "existing": 0}
+    invalid = set(random.sample(range(users), int(users * INVALID_SHARE)))
+    for i in invalid:
+        rows[i] = f"import user {i},not-an-email,short"
+        counts["invalid"] += 1
+    valid = [i for i in range(users) if i not in invalid]
+    for n in range(int(users * REPEATED_SHARE)):
+        rows.append(f"import_user_{random.choice(valid)},repeat_{n}@example.com,password")
+        counts["repeated"] += 1
+    for user in existing:
+        rows.append(f"{user.username},{user.username}@elsewhere.example.com,password")
+        counts["existing"] += 1
+    counts["valid"] -= counts["invalid"]
+    return "username,email,password\n" + "\n".join(rows) + "\n", counts, valid[0]
+
+
+async def registration_reference(db, sample: int, rounds: int) -> float:
+    """Seconds per user of the one-by-one path: a bcrypt hash, then an insert_one."""
+    from datetime import datetime, timezone
+    from app.core.security import hash_passwords
+    from app.repository import new_user_doc
+
+    started = time.perf_counter()
+    for i in range(sample):
+        password_hash = hash_passwords([f"password-{i}"], rounds)[0]
+        now = datetime.now(timezone.utc).replace(microsecond=0)
+        await db.users.insert_one(new_user_doc(f"reference_user_{i}", f"reference_user_{i}@example.com", password_hash, now))
+    return (time.perf_counter() - started) / sample
+
+
+async def run(args: argparse.Namespace) -> dict:
+    configure_environment()
+    async with booted_app() as (http, db):
+        from app.services.user_import import import_users, read_rows
+
+        existing = await seed(db, users=EXISTING_USERS, history_days=0, drawn_today_fraction=0.0)
+        text, counts, login_index = build_csv(args.users, existing)
+
+        started = time.perf_counter()
+        report = await import_users(
+            db, read_rows(io.StringIO(text, newline=""), "csv"), workers=args.workers, rounds=args.rounds
+        )
+        elapsed = time.perf_counter() - started
+
+        per_user = await registration_reference(db, args.reference_sample, args.rounds)
+        login = await http.post(
+            "/auth/login", data={"username": f"import_user_{login_index}", "password": f"password-{login_index}"}
+        )
+        upgraded = await db.users.find_one({"username": f"import_user_{login_index}"}, {"password_hash": 1})
+
+    result = {
+        "users": args.users,
+        "workers": args.workers,
+        "rounds": args.rounds,
+        "input": counts,
+        "rows": report["rows"],
+        "imported": report["imported"],
+        "invalid": len(report["invalid"]),
+        "conflicts": len(report["conflicts"]),
+        "seconds": round(elapsed, 2),
+        "users_per_second": round(report["imported"] / elapsed, 1),
+        "registration_path_seconds_estimate": round(per_user * counts["valid"], 2),
+        "imported_user_login": login.status_code,
+        "hash_cost_after_login": int(upgraded["password_hash"].split("$")[2]),
+    }
+    for key, value in result.items():
+        print(f"{key:<36} {value}")
+    return result
+
+
+def main(argv=None) -> int:
+    from app.core.security import BCRYPT_ROUNDS
+
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--users", type=int, default=2000, help="Distinct users in the generated file.")
+    parser.add_argument("--workers", type=int, default=None, help="Hashing processes (default: one per CPU).")
+    parser.add_argument("--rounds", type=int, default=BCRYPT_ROUNDS, help="bcrypt cost.")
+    parser.add_argument("--reference-sample", type=int, default=20, help="Users registered one by one for the estimate.")
+    parser.add_argument("--output", help="Write the report as JSON to this file.")
+    args = parser.parse_args(argv)
+
+    result = asyncio.run(run(args))
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(result, f, indent=2)
+    accounted = result["imported"] + result["invalid"] + result["conflicts"] == result["rows"]
+    ok = accounted and result["imported"] == result["input"]["valid"] and result["imported_user_login"] == 200
+    return 0 if ok else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
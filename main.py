@@ -1,33 +1,45 @@
 # main.py
 
 from fastapi import FastAPI, Request
-from fastapi.middleware.cors import CORSMiddleware
 from fastapi.responses import JSONResponse, Response
-from pymongo import IndexModel, ASCENDING
-from pymongo.errors import OperationFailure
+from pymongo.errors import ConnectionFailure
 from contextlib import asynccontextmanager
 import logging
-from logging.handlers import RotatingFileHandler
-import time
-from jose import jwt, JWTError
+import queue
+from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler
 
 # --- Core Application Imports ---
-from app.db import db
-from app.routers import auth, config, fortune, users, admin
+from app.db import get_database, close_client
+from app.routers import auth, config, fortune, users, admin, export, diagnostics
 from app.core.config import settings
-
-# --- Rate Limiting Imports (Conditional) ---
-from app.core.rate_limiter import limiter, limiter_decorator
-if limiter:
-    from slowapi.errors import RateLimitExceeded
+from app.core.migrations import verify_schema_version
+from app.services.draw_admission import deferred_draws, drain_background_records, fortune_insert_queue
+from app.services.avatar_proxy import avatar_proxy
+from app.services.leaderboard import leaderboard_broadcaster
+from app.services.luck import luck_histogram
+from app.services.refresh_tokens import RefreshTokenStoreUnavailable
+from app.services.user_import import shared_hash_pool
+from app.core.redis_client import close_redis
+from app.core.diagnostics import blocking_detector, loop_lag_monitor
+from app.core.resilience import DatabaseUnavailable, database_unavailable_response, db_breaker
+from app.core.middleware import (
+    AdmissionMiddleware, CompressionMiddleware, IdempotencyMiddleware, RequestContextMiddleware,
+    SettingsCORSMiddleware
+)
+from app.core.rate_limiter import get_limiter, limiter_decorator
 
 # --- Logging Setup ---
 logger = logging.getLogger("api_logger")
 logger.setLevel(logging.INFO)
-handler = RotatingFileHandler("api.log", maxBytes=5*1024*1024, backupCount=5)
+# delay=True: the file is opened on the first log record, not at import time.
+handler = RotatingFileHandler("api.log", maxBytes=5*1024*1024, backupCount=5, delay=True)
 formatter = logging.Formatter('%(asctime)s - %(levelname)s - %(message)s')
 handler.setFormatter(formatter)
-logger.addHandler(handler)
+# Records are queued and written (and the file rotated) by a listener thread, so
+# logging never blocks the event loop on disk I/O. Started and flushed by the lifespan.
+log_queue = queue.SimpleQueue()
+logger.addHandler(QueueHandler(log_queue))
+log_listener = QueueListener(log_queue, handler)
 
 
 @asynccontextmanager
@@ -35,25 +47,38 @@ async def lifespan(app: FastAPI):
     """
     Application startup and shutdown logic.
     """
-    logger.info("Application startup: creating database indexes...")
-    try:
-        await db.users.create_indexes([
-            IndexModel([("username", ASCENDING)], unique=True, name="username_unique"),
-            IndexModel([("email", ASCENDING)], unique=True, name="email_unique"),
-            IndexModel([("display_name", ASCENDING)], unique=True, name="display_name_unique", collation={'locale': 'en', 'strength': 2})
-        ])
-        await db.fortunes.create_indexes([
-            IndexModel([("user_id", ASCENDING)], name="fortune_user_id"),
-            IndexModel([("user_id", ASCENDING), ("date", ASCENDING)], unique=True, name="user_date_unique")
-        ])
-        await db.config.create_indexes([
-            IndexModel([("key", ASCENDING)], unique=True, name="config_key_unique")
-        ])
-        logger.info("Database indexes created successfully.")
-    except OperationFailure as e:
-        logger.error(f"An error occurred during index creation: {e}")
+    log_listener.start()
+    logger.info(f"Rate limiting is {'ENABLED. Storage: ' + settings.REDIS_URL if get_limiter() else 'DISABLED'}.")
+    
+    logger.info("Application startup: verifying database schema version...")
+    db = get_database()
+    schema_ok = await verify_schema_version(db)
+    if not schema_ok and settings.SCHEMA_CHECK_STRICT:
+        raise RuntimeError("Database schema is out of date. Run `python -m app.cli migrate apply`.")
+    if settings.DRAW_INSERT_BATCHING_ENABLED:
+        fortune_insert_queue.start(db)
+    leaderboard_broadcaster.start()
+    luck_histogram.start(db)
+    if settings.DIAGNOSTICS_ENABLED:
+        loop_lag_monitor.start()
+    if settings.BLOCKING_DETECTOR_ENABLED:
+        blocking_detector.start(settings.BLOCKING_THRESHOLD_MS)
     yield
+    await blocking_detector.stop()
+    await loop_lag_monitor.stop()
+    await db_breaker.stop()
+    if deferred_draws:
+        logger.warning(f"Shutting down with {len(deferred_draws)} deferred draws not replayed.")
+    await drain_background_records()
+    await leaderboard_broadcaster.stop()
+    await luck_histogram.stop()
+    await fortune_insert_queue.stop()
+    await avatar_proxy.close()
+    await shared_hash_pool.close()
+    await close_redis()
+    close_client()
     logger.info("Application shutdown.")
+    log_listener.stop()
 
 
 app = FastAPI(
@@ -63,68 +88,59 @@ app = FastAPI(
     lifespan=lifespan
 )
 
-# --- Rate Limiting Setup (Conditional) ---
-if settings.RATE_LIMITING_ENABLED and limiter:
-    logger.info(f"Rate limiting is ENABLED. Storage: {settings.REDIS_URL}")
-    app.state.limiter = limiter
-
-    @app.exception_handler(RateLimitExceeded)
-    async def rate_limit_exceeded_handler(request: Request, exc: RateLimitExceeded):
-        logger.warning(f"Rate limit exceeded for IP {request.client.host} on path {request.url.path}")
-        return JSONResponse(
-            status_code=429,
-            content={"detail": f"Rate limit exceeded: {exc.detail}"},
-        )
-else:
-    logger.info("Rate limiting is DISABLED.")
-
-# --- Logging Middleware ---
-@app.middleware("http")
-async def log_requests(request: Request, call_next):
-    start_time = time.time()
-    
-    user_id = "anonymous"
-    auth_header = request.headers.get("authorization")
-    if auth_header and auth_header.startswith("Bearer "):
-        token = auth_header.split(" ")[1]
-        try:
-            payload = jwt.decode(token, settings.SECRET_KEY, algorithms=[settings.ALGORITHM])
-            user_id = payload.get("sub", "unknown")
-        except JWTError:
-            user_id = "invalid_token"
-
-    response = await call_next(request)
-    process_time = (time.time() - start_time) * 1000
-    ip_address = request.client.host
-    
-    log_message = (
-        f'user="{user_id}" '
-        f'ip="{ip_address}" '
-        f'method="{request.method}" '
-        f'path="{request.url.path}" '
-        f'status={response.status_code} '
-        f'duration={process_time:.2f}ms'
+# --- Rate Limiting ---
+# Built on first use by app/core/rate_limiter.py (get_limiter); routes answer 429 themselves.
+
+# --- Degraded Mode (database unreachable) ---
+@app.exception_handler(DatabaseUnavailable)
+@app.exception_handler(ConnectionFailure)
+async def database_unavailable_handler(request: Request, exc: Exception):
+    return await database_unavailable_response(request)
+
+db_breaker.on_recovery(lambda: deferred_draws.replay(get_database()))
+
+# --- Refresh Token Store (Redis unreachable, see app/services/refresh_tokens.py) ---
+@app.exception_handler(RefreshTokenStoreUnavailable)
+async def refresh_token_store_unavailable_handler(request: Request, exc: RefreshTokenStoreUnavailable):
+    return JSONResponse(
+        status_code=503,
+        content={"detail": "Sessions are temporarily unavailable, please retry later."}
     )
-    logger.info(log_message)
-    return response
+
+# --- Overload Protection ---
+# Innermost of the middlewares, so shed 503s still carry CORS headers and are logged.
+app.add_middleware(AdmissionMiddleware)
+
+# --- Idempotency-Key ---
+# Outside admission control: replayed responses do not take a concurrency slot.
+app.add_middleware(IdempotencyMiddleware)
 
 # --- Dynamic CORS Middleware Configuration ---
-# The origins list is now dynamically read from the settings via the .env file.
-logger.info(f"CORS origins configured for: {settings.CORS_ORIGINS}")
+# The origins list is read from CORS_ORIGINS when the middleware is built at startup.
 app.add_middleware(
-    CORSMiddleware,
-    allow_origins=settings.cors_origins_list,
+    SettingsCORSMiddleware,
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["X-Request-ID", "X-Export-Watermark", "X-Next-Cursor", "X-Degraded", "Idempotent-Replayed"],
 )
 
+# --- Response Compression ---
+app.add_middleware(CompressionMiddleware)
+
+# --- Request Context Middleware (logging, timing, request id) ---
+# Added last so it is the outermost layer and also sees CORS preflight requests.
+app.add_middleware(RequestContextMiddleware)
+
 # --- API Routers ---
 app.include_router(auth.router)
 app.include_router(config.router)
 app.include_router(fortune.router)
 app.include_router(users.router)
 app.include_router(admin.router)
+app.include_router(export.router)
+# Admin only; answers 404 unless DIAGNOSTICS_ENABLED.
+app.include_router(diagnostics.router)
 
 # --- Root Endpoint ---
 @app.get("/")